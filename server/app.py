@@ -25,10 +25,18 @@ from jinja2 import Environment, PackageLoader
 from core.api import api
 from core.stats import stats
 from core.route_generation import Route
-from core.misc import Overpass, Color
+from core.misc import Overpass, LocalOverpass, Color
+from core.memory_db import MemoryClient
+from core.overpass_stream import stream_elements
+from core.tile_store import TileStore
+from core.route_cache import RouteCache, SingleFlight
+from core.route_workers import RouteWorkerPool
+from core.contraction import ContractionHierarchy
 from core.user import User, UserBase
+from core.user_cache import UserCache
+from core.run_store import RunStore
 from core.group import Message
-from core.decorators import jsonrequired, memoized, authrequired, validate_token
+from core.decorators import jsonrequired, authrequired, validate_token
 from core.utils import run_with_ngrok, snowflake, parse_snowflake, get_stack_variable
 from core import config
 
@@ -74,6 +82,16 @@ async def fetch(url):
 app.fetch = fetch
 
 
+async def stream(url):
+    """Makes a http get request, yielding Overpass elements as the response arrives"""
+    async with app.session.get(url) as response:
+        async for element in stream_elements(response.content.iter_chunked(64 * 1024)):
+            yield element
+
+
+app.stream = stream
+
+
 async def setup_indexes(app):
     coll = app.db.users
     index_info = await coll.index_information()
@@ -81,6 +99,7 @@ async def setup_indexes(app):
         await coll.create_index(
             [("username", "text"), ("full_name", "text"), ("email", "text")]
         )
+    await app.runs.setup_indexes()
 
 
 @app.listener("before_server_start")
@@ -88,8 +107,45 @@ async def init(app, loop):
     app.secret = config.SECRET
     app.session = aiohttp.ClientSession(loop=loop)  # we use this to make web requests
     app.webhook = Webhook.Async(config.WEBHOOK_URL, session=app.session)
-    app.db = AsyncIOMotorClient(config.MONGO_URI).majorproject
-    app.users = UserBase(app)
+    if config.MONGO_URI == "memory://":
+        app.db = MemoryClient().majorproject  # Load testing without a database
+    else:
+        app.db = AsyncIOMotorClient(config.MONGO_URI).majorproject
+    app.users = UserBase(
+        app,
+        UserCache(config.USER_CACHE_ENTRIES, config.USER_CACHE_BYTES, config.USER_CACHE_TTL),
+    )
+    app.runs = RunStore(
+        app.db,
+        config.TRACK_TOLERANCE,
+        config.TRACK_STATIONARY_RADIUS,
+        config.TRACK_INTERVAL,
+    )
+    if config.OVERPASS_MOCK:
+        # Comma separated Overpass json dumps answer map requests instead of Overpass,
+        # app.fetch is left alone for other requests such as Google sign in
+        overpass = LocalOverpass.from_files(*config.OVERPASS_MOCK.split(","))
+        app.tile_store = TileStore(config.TILE_STORE, overpass.fetch, stream=overpass.stream)
+    else:
+        app.tile_store = TileStore(config.TILE_STORE, app.fetch, stream=app.stream)
+    app.route_cache = RouteCache(
+        config.ROUTE_CACHE_ENTRIES, config.ROUTE_CACHE_BYTES, config.ROUTE_CACHE_TTL
+    )
+    app.route_flights = SingleFlight()
+    if config.ROUTE_WORKERS:
+        app.route_workers = RouteWorkerPool(
+            config.TILE_STORE,
+            config.ROUTE_WORKERS,
+            config.ROUTE_QUEUE_DEPTH,
+            config.ROUTE_REGION,
+            config.ROUTE_PARALLEL_LEGS,
+        )
+    else:
+        app.route_workers = None  # Routes run on the default thread executor
+    if config.CONTRACTION_HIERARCHY:
+        app.hierarchy = ContractionHierarchy.load(config.CONTRACTION_HIERARCHY)
+    else:
+        app.hierarchy = None
 
     em = Embed(color=Color.green)
     em.set_author("[INFO] Starting Worker", url=app.ngrok_url)
@@ -117,6 +173,8 @@ async def aexit(app, loop):
 
     # await app.webhook.send(embed=em)
     await app.session.close()
+    if app.route_workers is not None:
+        app.route_workers.shutdown()
 
 
 @app.exception(SanicException)
@@ -1,2 +1,3 @@
 from .route_generation import *
+from .road_graph import *
 from .points import *
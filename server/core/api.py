@@ -12,10 +12,14 @@ from sanic.exceptions import abort
 from sanic.log import logger
 
 from core.route_generation import Route, Point, Node, Way
-from core.route import SavedRoute, SavedRun, Run
+from core.route_profile import RouteProfile
+from core.route import SavedRoute, SavedRun, Run, LocationPacket
+from core import polyline
 from core.misc import Overpass, Color
 from core.user import User
-from core.decorators import jsonrequired, memoized, authrequired
+from core.run_store import RunStore, decode_cursor
+from core.decorators import jsonrequired, authrequired, timed
+from core.metrics import metrics
 from core.points import run_stats
 from core import config
 
@@ -25,12 +29,12 @@ api = Blueprint("api", url_prefix="/api")
 locationCache = {}
 
 """
-Route API Calls (Single, Multiple)
+Route API Calls (Single, Multiple, Loop)
 """
 
 
 @api.get("/route")
-@memoized
+@timed(name="api.route")
 async def route(request):
     """
     Api Endpoint that returns a route
@@ -40,39 +44,34 @@ async def route(request):
     # Generate Bounding Box
     start = Point.from_string(data.get("start"))
     end = Point.from_string(data.get("end"))
+    profile = data.get("profile", "default")  # File name in route_profiles
+    if profile not in RouteProfile.names():
+        abort(400, f"Profile must be one of {', '.join(RouteProfile.names())}.")
+    search = route_search(request.app, data, Route.two_point_bounding_box(start, end), profile)
+    format = route_format(data)
     # Check Valid Distance
     min_euclidean_distance = start - end
     if min_euclidean_distance > 50000:  # 50km
         return response.json({"success": False, "error_message": "Route too long."})
-    bounding_box = Route.bounding_points_to_string(
-        Route.two_point_bounding_box(start, end)
-    )
-    endpoint = Overpass.REQ.format(bounding_box)  # Generate url to query api
-    # Fetch Node Data and Way Data
-    task = request.app.fetch(endpoint)
-    data = await asyncio.gather(task)  # Data is array with response as first element
-    elements = data[0]["elements"]  # Nodes and Ways are together in array in json
-    node_data, way_data = [], []
-    for element in elements:
-        if element["type"] == "node":
-            node_data.append(element)
-        elif element["type"] == "way":
-            way_data.append(element)
-        else:
-            raise Exception("Unidentified element type")
-    # Generate Route
-    nodes, ways = Route.transform_json_nodes_and_ways(node_data, way_data)
-    start_node = start.closest_node(nodes)
-    end_node = end.closest_node(nodes)
-    partial = functools.partial(
-        Route.generate_route, nodes, ways, start_node.id, end_node.id
-    )
-    route = await request.app.loop.run_in_executor(None, partial)
-    return response.json(route.json)
+    # Check Route Cache
+    flight_key = request.app.route_cache.key("route", start, end, search=search, profile=profile)
+    key = flight_key + (format,)
+    payload = request.app.route_cache.get(key)
+    if payload is None:
+        # Concurrent requests for the same route share one generation whatever their format
+        route = await request.app.route_flights.do(
+            flight_key, generate_point_route, request.app, start, end, search, profile
+        )
+        with metrics.span("route.payload"):
+            payload = route.to_json(format)
+        if key not in request.app.route_cache:
+            request.app.route_cache.put(key, payload)
+    with metrics.span("route.serialise"):
+        return response.json(payload)
 
 
 @api.get("/route/multiple")
-@memoized
+@timed(name="api.route_multiple")
 async def multiple_route(request):
     """
     Api Endpoint that returns a multiple waypoint route
@@ -81,31 +80,211 @@ async def multiple_route(request):
     data = request.args
     # Generate Locations and Bounding Box
     location_points = [Point.from_string(waypoint) for waypoint in data["waypoints"]]
+    profile = data.get("profile", "default")  # File name in route_profiles
+    if profile not in RouteProfile.names():
+        abort(400, f"Profile must be one of {', '.join(RouteProfile.names())}.")
+    search = route_search(request.app, data, Route.convex_hull(location_points), profile)
+    format = route_format(data)
     min_euclidean_distance = Route.get_route_distance(location_points)
     # Check Valid Distance
     if min_euclidean_distance > 50000:  # 50km
         return response.json({"success": False, "error_message": "Route too long."})
-    bounding_box = Route.bounding_points_to_string(Route.convex_hull(location_points))
-    endpoint = Overpass.REQ.format(bounding_box)  # Generate url to query api
-    # Fetch Node Data and Way Data
-    task = request.app.fetch(endpoint)
-    data = await asyncio.gather(task)  # Data is array with response as first element
-    elements = data[0]["elements"]  # Nodes and Ways are together in array in json
-    node_data, way_data = [], []
-    for element in elements:
-        if element["type"] == "node":
-            node_data.append(element)
-        elif element["type"] == "way":
-            way_data.append(element)
+    # Check Route Cache
+    flight_key = request.app.route_cache.key(
+        "multiple", *location_points, search=search, profile=profile
+    )
+    key = flight_key + (format,)
+    payload = request.app.route_cache.get(key)
+    if payload is None:
+        # Concurrent requests for the same route share one generation whatever their format
+        route = await request.app.route_flights.do(
+            flight_key, generate_waypoint_route, request.app, location_points, search, profile
+        )
+        with metrics.span("route.payload"):
+            payload = route.to_json(format)
+        if key not in request.app.route_cache:
+            request.app.route_cache.put(key, payload)
+    with metrics.span("route.serialise"):
+        return response.json(payload)
+
+
+@api.get("/route/loop")
+@timed(name="api.route_loop")
+async def loop_route(request):
+    """
+    Api Endpoint that returns a loop of a distance in metres from a start point
+    """
+    data = request.args
+    start = Point.from_string(data.get("start"))
+    try:
+        distance = float(data.get("distance"))
+    except (TypeError, ValueError):
+        abort(400, "Distance must be a number of metres.")
+    if distance <= 0:
+        abort(400, "Distance must be a number of metres.")
+    format = route_format(data)
+    # Check Valid Distance
+    if distance > 50000:  # 50km
+        return response.json({"success": False, "error_message": "Route too long."})
+    # Check Route Cache
+    flight_key = request.app.route_cache.key("loop", start, distance=distance)
+    key = flight_key + (format,)
+    payload = request.app.route_cache.get(key)
+    if payload is None:
+        # Concurrent requests for the same route share one generation whatever their format
+        route = await request.app.route_flights.do(
+            flight_key, generate_loop_route, request.app, start, distance
+        )
+        with metrics.span("route.payload"):
+            payload = route.to_json(format)
+        if key not in request.app.route_cache:
+            request.app.route_cache.put(key, payload)
+    with metrics.span("route.serialise"):
+        return response.json(payload)
+
+
+def route_search(app, data, polygon: list, profile: str) -> str:
+    """
+    Search of a route request, astar, bidirectional, hierarchy or auto by default
+    Hierarchy searches are only accepted where the loaded contraction hierarchy can answer them
+    """
+    search = data.get("search", "auto")
+    if search not in Route.SEARCHES:
+        abort(400, f"Search must be one of {', '.join(Route.SEARCHES)}.")
+    if search == "hierarchy" and (
+        app.hierarchy is None or not app.hierarchy.answers(polygon, RouteProfile.load(profile))
+    ):
+        abort(400, "Hierarchy search is not available for this region and profile.")
+    return search
+
+
+def route_format(data) -> str:
+    """
+    Geometry format of a route response, points by default or an encoded polyline
+    """
+    format = data.get("format", "points")
+    if format not in Route.FORMATS:
+        abort(400, f"Format must be one of {', '.join(Route.FORMATS)}.")
+    return format
+
+
+def snap(graph, points: list) -> list:
+    """
+    Ids of the graph nodes closest to each point
+    """
+    with metrics.span("route.snap"):
+        return [int(graph.ids[graph.closest_index(point)]) for point in points]
+
+
+async def generate_point_route(app, start, end, search="auto", profile="default"):
+    """
+    Loads the region around two points and generates a route between them
+    """
+    bounding_box = Route.two_point_bounding_box(start, end)
+    route_profile = RouteProfile.load(profile)
+    if app.hierarchy is not None and app.hierarchy.covers(bounding_box):
+        graph = app.hierarchy.graph
+        start_id, end_id = snap(graph, [start, end])
+        if route_profile.uniform:
+            # Preprocessed region, the resident graph and its hierarchy answer directly
+            # Searches other than the hierarchy query walk the whole resident graph,
+            # so this still runs off the event loop
+            partial = functools.partial(Route.generate_graph_route, graph, start_id, end_id, search)
+        else:
+            # The hierarchy was built on lengths, other profiles search the resident graph
+            partial = functools.partial(
+                Route.generate_graph_route, graph, start_id, end_id, search, profile=route_profile
+            )
+        return await app.loop.run_in_executor(None, partial)
+    if app.route_workers is not None:
+        # Workers read tiles from disk themselves, they only need them to be ingested
+        await app.tile_store.ensure_region(bounding_box)
+        with metrics.span("route.workers"):
+            return await app.route_workers.route(start, end, search, profile)
+    # Load Node Data and Way Data from local tiles, Overpass is only used for missing tiles
+    graph = await app.tile_store.load_region_graph(bounding_box)
+    # Generate Route, the graph is only used once so it is simplified around the endpoints
+    start_id, end_id = snap(graph, [start, end])
+    partial = functools.partial(
+        Route.generate_graph_route,
+        graph,
+        start_id,
+        end_id,
+        search,
+        simplify=True,
+        profile=route_profile,
+    )
+    return await app.loop.run_in_executor(None, partial)
+
+
+async def generate_waypoint_route(app, location_points, search="auto", profile="default"):
+    """
+    Loads the region around waypoints and generates a route through them in order
+    """
+    bounding_box = Route.convex_hull(location_points)
+    route_profile = RouteProfile.load(profile)
+    if app.hierarchy is not None and app.hierarchy.covers(bounding_box):
+        graph = app.hierarchy.graph
+        waypoint_ids = snap(graph, location_points)
+        if route_profile.uniform:
+            # Preprocessed region, the resident graph and its hierarchy answer directly
+            # Searches other than the hierarchy query walk the whole resident graph,
+            # so this still runs off the event loop
+            partial = functools.partial(
+                Route.generate_graph_multi_route, graph, waypoint_ids, search
+            )
         else:
-            raise Exception("Unidentified element type")
-    # Generate Route
-    nodes, ways = Route.transform_json_nodes_and_ways(node_data, way_data)
-    waypoint_nodes = [point.closest_node(nodes) for point in location_points]
-    waypoint_ids = [node.id for node in waypoint_nodes]
-    partial = functools.partial(Route.generate_multi_route, nodes, ways, waypoint_ids)
-    route = await request.app.loop.run_in_executor(None, partial)
-    return response.json(route.json)
+            # The hierarchy was built on lengths, other profiles search the resident graph
+            partial = functools.partial(
+                Route.generate_graph_multi_route, graph, waypoint_ids, search, profile=route_profile
+            )
+        return await app.loop.run_in_executor(None, partial)
+    if app.route_workers is not None:
+        # Workers read tiles from disk themselves, they only need them to be ingested
+        await app.tile_store.ensure_region(bounding_box)
+        with metrics.span("route.workers"):
+            return await app.route_workers.multi_route(location_points, search, profile)
+    # Load Node Data and Way Data from local tiles, Overpass is only used for missing tiles
+    graph = await app.tile_store.load_region_graph(bounding_box)
+    # Generate Route, the graph is only used once so it is simplified around the waypoints
+    waypoint_ids = snap(graph, location_points)
+    partial = functools.partial(
+        Route.generate_graph_multi_route,
+        graph,
+        waypoint_ids,
+        search,
+        simplify=True,
+        profile=route_profile,
+    )
+    return await app.loop.run_in_executor(None, partial)
+
+
+async def generate_loop_route(app, start, distance):
+    """
+    Loads the region a loop can reach and generates a loop from the start
+    Loop generation caps its expansions and time, so it returns the best loop found in budget
+    """
+    bounding_box = Route.loop_bounding_box(start, distance)
+    if app.hierarchy is not None and app.hierarchy.covers(bounding_box):
+        # Preprocessed region, the resident graph is already loaded but a loop search
+        # takes too long to run on the event loop
+        graph = app.hierarchy.graph
+        start_id = snap(graph, [start])[0]
+        partial = functools.partial(Route.generate_graph_loop, graph, start_id, distance)
+        return await app.loop.run_in_executor(None, partial)
+    if app.route_workers is not None:
+        # Workers read tiles from disk themselves, they only need them to be ingested
+        await app.tile_store.ensure_region(bounding_box)
+        with metrics.span("route.workers"):
+            return await app.route_workers.loop(start, distance)
+    # Load Node Data and Way Data from local tiles, Overpass is only used for missing tiles
+    graph = await app.tile_store.load_region_graph(bounding_box)
+    # Generate Route, the graph is only used once so it is simplified around the start
+    start_id = snap(graph, [start])[0]
+    partial = functools.partial(
+        Route.generate_graph_loop, graph, start_id, distance, simplify=True
+    )
+    return await app.loop.run_in_executor(None, partial)
 
 
 """
@@ -139,6 +318,7 @@ async def register(request):
 
 
 @api.post("/login")
+@timed(name="api.login")
 @jsonrequired
 async def login(request):
     """
@@ -207,11 +387,14 @@ async def save_route(request, user):
     start_name = data.get("start_name")
     end_name = data.get("end_name")
     description = data.get("description")
-    route = Route.from_real_time_data(data.get('route'), data.get('distance'))
+    route = Route.from_real_time_data(
+        data.get('route'), data.get('distance'), data.get('precision', polyline.PRECISION)
+    )
     saved_route = SavedRoute.from_real_time_data(route, name, description, start_name, end_name)
 
     await user.set_to_dict_field('saved_routes',saved_route.id,saved_route.to_dict())
-    user.saved_routes[saved_route.id] = saved_route
+    if user.is_loaded('saved_routes'):
+        user.saved_routes[saved_route.id] = saved_route
 
     resp = {
         'success': True,
@@ -220,6 +403,7 @@ async def save_route(request, user):
 
 
 @api.post("/save_run")
+@timed(name="api.save_run")
 @jsonrequired
 @authrequired
 async def save_run(request, user):
@@ -235,17 +419,15 @@ async def save_run(request, user):
     likes = []
     comments = []
     saved_run = SavedRun.from_real_time_data(name,description,run_info,location_packets, likes, comments)
-    user.stats.update_stats(saved_run.run_info) # Updating Stats
+    user.stats.update_stats(saved_run) # Updating Stats
 
     await user.set_field('stats', user.stats.to_dict()) # Adding new stats
 
-    await user.set_to_dict_field('saved_runs', saved_run.id, saved_run.to_dict()) # Adding saved routes
-    user.saved_runs[saved_run.id] = saved_run
+    await user.add_saved_run(saved_run) # Adding saved run
 
     for follower_id in user.followers:
         follower = await request.app.users.find_account(_id=follower_id)
-        follower.feed.add_item(user.id, saved_run.id) # Adding saved run to follower
-        await follower.set_field('feed', follower.feed.to_dict()) # Adding saved run to follower on db
+        await follower.add_feed_item(user.id, saved_run.id) # Adding saved run to follower on db
 
     resp = {
         'success': True,
@@ -253,6 +435,7 @@ async def save_run(request, user):
     return response.json(resp)
 
 @api.post("/add_run")
+@timed(name="api.add_run")
 @jsonrequired
 @authrequired
 async def add_run(request, user):
@@ -264,12 +447,11 @@ async def add_run(request, user):
     run_info = data.get('run_info')
     location_packets = data.get('location_packets')
     run = Run.from_real_time_data(location_packets, run_info)
-    user.stats.update_stats(run.run_info) # Updating Stats
+    user.stats.update_stats(run) # Updating Stats
 
     await user.set_field('stats', user.stats.to_dict()) # Adding new stats
 
-    await user.push_to_array_field('runs', run.to_dict()) # Pushing run
-    user.runs.append(run)
+    await user.add_run(run) # Adding run to history
 
     resp = {
         'success': True,
@@ -434,17 +616,19 @@ async def update_run(request, user):
         abort(400,"Bad request: Missing required parameters (owner & runID)")
     else:
         owner = await request.app.users.find_account(_id=owner)
+    if not owner:
+        abort(404, "User not found.")
+    updates = []
     if like is not None:
         if like:
-            await owner.push_to_array_field(f"saved_runs.{runID}.likes",user.id)
-            owner.saved_runs[runID].likes.append(user.id)
+            updates.append({"$push": {"likes": user.id}})
         else:
-            await owner.remove_item_from_array_field(f"saved_runs.{runID}.likes",user.id)
-            owner.saved_runs[runID].likes.remove(user.id)
+            updates.append({"$pull": {"likes": user.id}})
     if comment is not None:
-        await owner.push_to_array_field(f"saved_runs.{runID}.comments",[user.full_name,comment])
-        owner.saved_runs[runID].comments.append([user.full_name,comment])
-    request.app.users.clear_cache(owner)
+        updates.append({"$push": {"comments": [user.full_name,comment]}})
+    for update in updates:
+        if not await owner.update_saved_run(runID, update):
+            abort(404, "Run not found.")
     return response.json({'success': True})
 
 """
@@ -459,23 +643,23 @@ async def get_info(request, user):
     Get user info. Useful call that can be called to retrieve user/route information
     Jason Yu/Sunny Yan
     """
-    info = user.to_dict()
+    format = route_format(request.args)
+    await user.load("saved_routes") # The feed is left unloaded, it is only used by /get_feed
     resp = {
         'success': True,
         'info' : {
-            'full_name': info['full_name'],
-            'email': info['credentials']['email'],
-            'username': info['username'],
-            'points': info['stats']['points'],
-            'followers': info['followers'],
-            'following': info['following'],
-            'follow_requests': info['follow_requests'],
-            'pending_follows': info['pending_follows'],
-            'stats': info['stats'],
-            'bio': info['bio'],
-            'saved_routes': info['saved_routes'],
-            'saved_runs': info['saved_runs'],
-            'runs': info['runs'],
+            'full_name': user.full_name,
+            'email': user.credentials.email,
+            'username': user.username,
+            'points': user.stats.points,
+            'followers': user.followers,
+            'following': user.following,
+            'follow_requests': user.follow_requests,
+            'pending_follows': user.pending_follows,
+            'stats': user.stats.to_dict(),
+            'bio': user.bio,
+            'saved_routes': saved_routes_json(user, format),
+            **(await run_pages(user)),
         }
     }
     return response.json(resp)
@@ -489,7 +673,7 @@ async def find_friends(request, user):
 
     projection = {"_id": 1, "username": 1, "bio": 1}
 
-    results = await request.app.db.users.find(query).to_list(10)
+    results = await request.app.db.users.find(query, projection).to_list(10)
     results = [
         {"user_id": user["_id"], "name": user["username"], "bio": user["bio"]}
         for user in results
@@ -498,6 +682,7 @@ async def find_friends(request, user):
     return response.json(results)
 
 @api.post('/get_feed')
+@timed(name="api.get_feed")
 @authrequired
 @jsonrequired
 async def get_feed(request, user):
@@ -506,16 +691,7 @@ async def get_feed(request, user):
     Returns 10 feed items
     Jason Yu/Sunny Yan
     """
-    feed_items = [feed_item.to_dict() for feed_item in user.feed.get_latest_ten()]
-    async def get_route_from_id(userID,routeID):
-        user = await request.app.users.find_account(_id=userID)
-        return {
-            "user_id":userID,
-            "user_name":user.full_name,
-            "route":user.saved_runs[routeID]
-        }
-    feed_items = [await get_route_from_id(*item.values()) for item in feed_items]
-    resp = {"success": True, "feed_items": feed_items}
+    resp = {"success": True, "feed_items": await user.feed_runs()}
     return response.json(resp)
 
 
@@ -623,28 +799,122 @@ async def get_other_info(request, user):
 
     if not user:
         abort(404)
-    info = user.to_dict()
+    format = route_format(request.args)
+    await user.load("saved_routes") # The feed is left unloaded, it is only used by /get_feed
 
     resp = {
         'success': True,
         'info' : {
-            'full_name': info['full_name'],
-            'email': info['credentials']['email'],
-            'username': info['username'],
-            'points': info['stats']['points'],
-            'followers': info['followers'],
-            'following': info['following'],
-            'follow_requests': info['follow_requests'],
-            'pending_follows': info['pending_follows'],
-            'stats': info['stats'],
-            'bio': info['bio'],
-            'saved_routes': info['saved_routes'],
-            'saved_runs': info['saved_runs'],
-            'runs': info['runs'],
+            'full_name': user.full_name,
+            'email': user.credentials.email,
+            'username': user.username,
+            'points': user.stats.points,
+            'followers': user.followers,
+            'following': user.following,
+            'follow_requests': user.follow_requests,
+            'pending_follows': user.pending_follows,
+            'stats': user.stats.to_dict(),
+            'bio': user.bio,
+            'saved_routes': saved_routes_json(user, format),
+            **(await run_pages(user)),
         }
     }
     return response.json(resp)
 
+async def run_pages(user) -> dict:
+    """
+    First pages of a user's runs and saved runs, the rest are fetched from /runs and /saved_runs
+    """
+    runs, runs_cursor = await user.runs_page()
+    saved_runs, saved_runs_cursor = await user.saved_runs_page()
+    return {
+        'runs': [run.to_dict() for run in runs],
+        'runs_cursor': runs_cursor,
+        'saved_runs': dict((saved_run.id, saved_run.to_dict()) for saved_run in saved_runs),
+        'saved_runs_cursor': saved_runs_cursor,
+    }
+
+@api.get("/runs")
+@timed(name="api.runs")
+@authrequired
+async def get_runs(request, user):
+    """
+    Page of run history, newest first
+    Takes cursor from the previous page, limit and user_id to page another user's runs
+    """
+    user, cursor, limit = await page_args(request, user)
+    runs, next_cursor = await user.runs_page(cursor, limit)
+    return response.json({
+        'success': True,
+        'runs': [run.to_dict() for run in runs],
+        'cursor': next_cursor,
+    })
+
+@api.get("/saved_runs")
+@timed(name="api.saved_runs")
+@authrequired
+async def get_saved_runs(request, user):
+    """
+    Page of saved runs, newest first
+    """
+    user, cursor, limit = await page_args(request, user)
+    saved_runs, next_cursor = await user.saved_runs_page(cursor, limit)
+    return response.json({
+        'success': True,
+        'saved_runs': [saved_run.to_dict() for saved_run in saved_runs],
+        'cursor': next_cursor,
+    })
+
+@api.get("/runs/<run_id>/track")
+@timed(name="api.run_track")
+@authrequired
+async def get_run_track(request, user, run_id):
+    """
+    Full resolution location packets of a run or saved run, stored runs are simplified
+    Takes user_id for the runs of another user
+    """
+    other_user_id = request.args.get("user_id")
+    if other_user_id and other_user_id != user.id:
+        user = await request.app.users.find_account(_id=other_user_id)
+        if not user:
+            abort(404)
+    track = await user.full_track(run_id)
+    if track is None:
+        abort(404, "Run not found.")
+    return response.json({
+        'success': True,
+        'location_packets': [
+            LocationPacket.from_tuple(packet).to_dict() for packet in track
+        ],
+    })
+
+async def page_args(request, user):
+    other_user_id = request.args.get("user_id")
+    if other_user_id and other_user_id != user.id:
+        user = await request.app.users.find_account(_id=other_user_id)
+        if not user:
+            abort(404)
+    try:
+        limit = int(request.args.get("limit", RunStore.PAGE_SIZE))
+    except ValueError:
+        abort(400, "Limit must be an integer.")
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except Exception as e:
+            abort(400, str(e))
+    return user, cursor, limit
+
+def saved_routes_json(user, format: str) -> dict:
+    """
+    Saved routes of a user in a response format, they are stored as polylines
+    """
+    return dict(
+        (route_id, saved_route.to_dict(format))
+        for route_id, saved_route in user.saved_routes.items()
+    )
+
 """
 Key Retrieval
 """
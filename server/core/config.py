@@ -8,5 +8,19 @@ WEBHOOK_URL = config("webhook_url")
 GOOGLE_MAPS_API = config("google_maps_api")
 GOOGLE_ANDROID_LOGIN_ID = config("google_android_login_id")
 GOOGLE_IOS_LOGIN_ID = config("google_ios_login_id")
-
-
+TILE_STORE = config("tile_store", default="tiles")
+ROUTE_CACHE_ENTRIES = config("route_cache_entries", default=1024, cast=int)
+ROUTE_CACHE_BYTES = config("route_cache_bytes", default=64 * 1024 * 1024, cast=int)
+ROUTE_CACHE_TTL = config("route_cache_ttl", default=3600, cast=float)
+USER_CACHE_ENTRIES = config("user_cache_entries", default=10000, cast=int)
+USER_CACHE_BYTES = config("user_cache_bytes", default=64 * 1024 * 1024, cast=int)
+USER_CACHE_TTL = config("user_cache_ttl", default=300, cast=float)
+ROUTE_WORKERS = config("route_workers", default=0, cast=int)
+ROUTE_QUEUE_DEPTH = config("route_queue_depth", default=32, cast=int)
+ROUTE_REGION = config("route_region", default="")
+ROUTE_PARALLEL_LEGS = config("route_parallel_legs", default=False, cast=bool)
+CONTRACTION_HIERARCHY = config("contraction_hierarchy", default="")
+OVERPASS_MOCK = config("overpass_mock", default="")
+TRACK_TOLERANCE = config("track_tolerance", default=2.0, cast=float)
+TRACK_STATIONARY_RADIUS = config("track_stationary_radius", default=3.0, cast=float)
+TRACK_INTERVAL = config("track_interval", default=1.0, cast=float)
@@ -0,0 +1,310 @@
+from __future__ import annotations
+from heapq import heappush, heappop, heapify
+from math import inf
+
+import numpy as np
+
+from .road_graph import RoadGraph
+from .route_profile import RouteProfile
+
+WITNESS_SETTLE_LIMIT = 60  # Settled nodes before a witness search gives up and a shortcut is added
+
+
+class ContractionHierarchy:
+    """
+    Contraction hierarchy over a RoadGraph for fast repeat queries in a fixed region
+    Nodes are contracted in order of rank, adding shortcut edges that keep shortest path
+    costs between the remaining nodes. Only edges towards higher ranked nodes are kept
+    (the road graph is undirected, so one upward graph serves both query directions);
+    a shortcut remembers the node it bypasses so routes can be unpacked.
+    """
+
+    def __init__(self, graph: RoadGraph, ranks, offsets, targets, weights, middles, region):
+        self.graph = graph
+        self.ranks = ranks  # int32, contraction order of each node
+        self.offsets = offsets  # int32, upward CSR offsets
+        self.targets = targets  # int32, higher ranked node of each upward edge
+        self.weights = weights  # float64, metres of each upward edge
+        self.middles = middles  # int32, bypassed node of a shortcut, -1 for road edges
+        self.region = region  # (south, west, north, east) the hierarchy was built for
+        graph.hierarchy = self
+
+    @classmethod
+    def build(cls, graph: RoadGraph, region: tuple = None) -> ContractionHierarchy:
+        """
+        Contracts every node of a graph, ordered lazily by edge difference
+        """
+        adjacent = [dict() for index in range(len(graph))]  # neighbour -> (weight, middle)
+        for index in range(len(graph)):
+            for neighbour, length in graph.neighbours(index):
+                adjacent[index][neighbour] = (length, -1)
+        contracted_neighbours = [0] * len(graph)
+        upward = [None] * len(graph)
+        ranks = np.zeros(len(graph), dtype=np.int32)
+
+        queue = [
+            (cls.priority(adjacent, contracted_neighbours, index), index)
+            for index in range(len(graph))
+        ]
+        heapify(queue)
+        rank = 0
+        while queue:
+            priority, index = heappop(queue)
+            # Priorities go stale as neighbours are contracted, recheck before contracting
+            shortcuts = cls.shortcuts(adjacent, index)
+            current = cls.priority(adjacent, contracted_neighbours, index, shortcuts)
+            if queue and current > queue[0][0]:
+                heappush(queue, (current, index))
+                continue
+            for (first, second), weight in shortcuts.items():
+                if weight < adjacent[first].get(second, (inf,))[0]:
+                    adjacent[first][second] = (weight, index)
+                    adjacent[second][first] = (weight, index)
+            upward[index] = adjacent[index]
+            for neighbour in adjacent[index]:
+                del adjacent[neighbour][index]
+                contracted_neighbours[neighbour] += 1
+            adjacent[index] = {}
+            ranks[index] = rank
+            rank += 1
+
+        offsets = np.zeros(len(graph) + 1, dtype=np.int32)
+        np.cumsum([len(edges) for edges in upward], out=offsets[1:])
+        targets = np.fromiter(
+            (neighbour for edges in upward for neighbour in edges), np.int32, offsets[-1]
+        )
+        weights = np.fromiter(
+            (weight for edges in upward for weight, middle in edges.values()),
+            np.float64,
+            offsets[-1],
+        )
+        middles = np.fromiter(
+            (middle for edges in upward for weight, middle in edges.values()),
+            np.int32,
+            offsets[-1],
+        )
+        if region is None:
+            region = (
+                float(graph.latitudes.min()),
+                float(graph.longitudes.min()),
+                float(graph.latitudes.max()),
+                float(graph.longitudes.max()),
+            )
+        return cls(graph, ranks, offsets, targets, weights, middles, region)
+
+    @classmethod
+    def priority(
+        cls, adjacent: list, contracted_neighbours: list, index: int, shortcuts: dict = None
+    ) -> int:
+        """
+        Edge difference of contracting a node, plus its contracted neighbours to spread contraction
+        """
+        if shortcuts is None:
+            shortcuts = cls.shortcuts(adjacent, index)
+        return (
+            len(shortcuts)
+            - len(adjacent[index])
+            + contracted_neighbours[index]
+        )
+
+    @staticmethod
+    def shortcuts(adjacent: list, index: int) -> dict:
+        """
+        Shortcuts needed to contract a node: (first, second) -> weight for every pair of
+        neighbours whose shortest connection runs through the node
+        """
+        neighbours = adjacent[index]
+        shortcuts = {}
+        for first, (first_weight, _) in neighbours.items():
+            limit = first_weight + max(weight for weight, _ in neighbours.values())
+            # Witness search from first around the node being contracted
+            costs = {first: 0}
+            settled = set()
+            frontier = [(0, first)]
+            while frontier and len(settled) < WITNESS_SETTLE_LIMIT:
+                cost, current = heappop(frontier)
+                if current in settled:
+                    continue
+                if cost > limit:
+                    break
+                settled.add(current)
+                for neighbour, (weight, _) in adjacent[current].items():
+                    if neighbour == index:
+                        continue
+                    new_cost = cost + weight
+                    if new_cost < costs.get(neighbour, inf):
+                        costs[neighbour] = new_cost
+                        heappush(frontier, (new_cost, neighbour))
+            for second, (second_weight, _) in neighbours.items():
+                if second <= first:
+                    continue
+                through = first_weight + second_weight
+                if costs.get(second, inf) > through:
+                    shortcuts[(first, second)] = through
+        return shortcuts
+
+    def upward(self, index: int):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return zip(self.targets[start:end].tolist(), self.weights[start:end].tolist())
+
+    def query(self, start: int, end: int, stats: dict = None) -> tuple:
+        """
+        Bidirectional Dijkstra over upward edges from both ends
+        Returns the unpacked path as a list of graph indices and its length in metres
+        """
+        costs = ({start: 0}, {end: 0})
+        parents = ({start: None}, {end: None})
+        settled = (set(), set())
+        frontiers = ([(0, start)], [(0, end)])
+        best_cost, meeting = inf, None
+        while frontiers[0] or frontiers[1]:
+            for side in (0, 1):
+                frontier = frontiers[side]
+                if not frontier:
+                    continue
+                if frontier[0][0] >= best_cost:
+                    frontier.clear()  # Nothing left on this side can improve the route
+                    continue
+                cost, current = heappop(frontier)
+                if current in settled[side]:
+                    continue
+                settled[side].add(current)
+                if current in costs[1 - side]:
+                    meeting_cost = cost + costs[1 - side][current]
+                    if meeting_cost < best_cost:
+                        best_cost, meeting = meeting_cost, current
+                for neighbour, weight in self.upward(current):
+                    new_cost = cost + weight
+                    if new_cost < costs[side].get(neighbour, inf):
+                        costs[side][neighbour] = new_cost
+                        parents[side][neighbour] = current
+                        heappush(frontier, (new_cost, neighbour))
+        if meeting is None:
+            raise Exception("End node cannot be reached")
+        if stats is not None:
+            stats["expansions"] = len(settled[0]) + len(settled[1])
+        forward = RoadGraph.walk_parents(parents[0], meeting)[::-1]
+        backward = RoadGraph.walk_parents(parents[1], meeting)
+        hierarchy_path = forward + backward[1:]
+        path = [hierarchy_path[0]]
+        for first, second in zip(hierarchy_path[:-1], hierarchy_path[1:]):
+            path += self.unpack(first, second)
+        return path, best_cost
+
+    def middle(self, first: int, second: int) -> int:
+        """
+        Node bypassed by the edge between two nodes, -1 when it is a road edge
+        """
+        if self.ranks[first] > self.ranks[second]:
+            first, second = second, first
+        start, end = self.offsets[first], self.offsets[first + 1]
+        position = start + self.targets[start:end].tolist().index(second)
+        return int(self.middles[position])
+
+    def unpack(self, first: int, second: int) -> list:
+        """
+        Road graph nodes after first along the edge from first to second
+        """
+        path = []
+        edges = [(first, second)]
+        while edges:
+            first, second = edges.pop()
+            middle = self.middle(first, second)
+            if middle == -1:
+                path.append(second)
+            else:
+                edges.append((middle, second))
+                edges.append((first, middle))
+        return path
+
+    def covers(self, points: list) -> bool:
+        """
+        Whether a polygon lies inside the region the hierarchy was built for
+        """
+        south, west, north, east = self.region
+        return all(
+            south <= point.latitude <= north and west <= point.longitude <= east
+            for point in points
+        )
+
+    def answers(self, points: list, profile: RouteProfile) -> bool:
+        """
+        Whether a hierarchy query can route inside a polygon with a profile
+        The hierarchy was built on lengths, so only profiles where roads cost their length qualify
+        """
+        return profile.uniform and self.covers(points)
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            ids=self.graph.ids,
+            latitudes=self.graph.latitudes,
+            longitudes=self.graph.longitudes,
+            graph_offsets=self.graph.offsets,
+            graph_targets=self.graph.targets,
+            graph_lengths=self.graph.lengths,
+            graph_highways=self.graph.highways,
+            ranks=self.ranks,
+            offsets=self.offsets,
+            targets=self.targets,
+            weights=self.weights,
+            middles=self.middles,
+            region=np.array(self.region),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> ContractionHierarchy:
+        arrays = np.load(path)
+        graph = RoadGraph(
+            arrays["ids"],
+            arrays["latitudes"],
+            arrays["longitudes"],
+            arrays["graph_offsets"],
+            arrays["graph_targets"],
+            arrays["graph_lengths"],
+            arrays["graph_highways"] if "graph_highways" in arrays.files else None,
+        )
+        return cls(
+            graph,
+            arrays["ranks"],
+            arrays["offsets"],
+            arrays["targets"],
+            arrays["weights"],
+            arrays["middles"],
+            tuple(arrays["region"].tolist()),
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from .tile_store import TileStore
+    from .route_generation import Point
+
+    parser = argparse.ArgumentParser(
+        description="Build a contraction hierarchy for a region of an ingested tile store"
+    )
+    parser.add_argument("directory", help="Tile store directory")
+    parser.add_argument("output", help="Output file, eg hierarchy.npz")
+    parser.add_argument(
+        "region", nargs=4, type=float, metavar=("SOUTH", "WEST", "NORTH", "EAST")
+    )
+    args = parser.parse_args()
+
+    south, west, north, east = args.region
+    store = TileStore(args.directory)
+    tiles = store.tiles_for_polygon(
+        [Point(south, west), Point(south, east), Point(north, east), Point(north, west)]
+    )
+    missing = store.missing_tiles(tiles)
+    if missing:
+        print(f"Warning: {len(missing)} tiles of the region have not been ingested")
+    graph = store.load_graph(tiles)
+    time1 = time.time()
+    hierarchy = ContractionHierarchy.build(graph, tuple(args.region))
+    hierarchy.save(args.output)
+    print(
+        f"Contracted {len(graph)} nodes in {time.time() - time1:.1f}s, "
+        f"{len(hierarchy.targets)} upward edges written to {args.output}"
+    )
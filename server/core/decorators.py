@@ -1,10 +1,13 @@
 import asyncio
 import functools
+import inspect
 from functools import wraps
 from sanic.exceptions import abort
 import time
 import jwt
 
+from .metrics import metrics
+
 
 def jsonrequired(func):
     """
@@ -52,22 +55,6 @@ def authrequired(func):
             abort(401, "Invalid token")
     return wrapper
 
-def memoized(func):
-    """
-    Abdur Raqeeb
-    """
-    func.cache = {}
-
-    @wraps(func)
-    async def wrapper(request, *args, **kwargs):
-        key = str(request.args)
-        if key not in func.cache:
-            func.cache[key] = await func(request, *args, **kwargs)
-        return func.cache[key]
-
-    return wrapper
-
-
 def asyncexecutor(_func=None, *, loop=None, executor=None):
     """
     Abdur Raqeeb
@@ -88,30 +75,29 @@ def asyncexecutor(_func=None, *, loop=None, executor=None):
         return decorator(_func)
 
 
-def timed(f):
+def timed(_func=None, *, name=None):
     """
-    Decorator that prints out the time taken for a function to execute.
+    Decorator that records the time taken for a function to execute as a span in metrics
+    The span is named after the function unless a name is given, eg @timed(name="api.route")
     Abdur Raqeeb
     """
 
-    coro = inspect.iscoroutinefunction(f)
-
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        time1 = time.time()
-        ret = f(*args, **kwargs)
-        time2 = time.time()
-        time_taken = (time2 - time1) * 1000.0
-        print(f"{f.__name__:s} function took {time_taken:.3f} ms")
-        return ret
-
-    @wraps(f)
-    async def async_wrapper(*args, **kwargs):
-        time1 = time.time()
-        ret = await f(*args, **kwargs)
-        time2 = time.time()
-        time_taken = (time2 - time1) * 1000.0
-        print(f"{f.__name__:s} function took {time_taken:.3f} ms")
-        return ret
-
-    return async_wrapper if coro else wrapper
+    def decorator(f):
+        span = name or f"{f.__module__}.{f.__qualname__}"
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with metrics.span(span):
+                return f(*args, **kwargs)
+
+        @wraps(f)
+        async def async_wrapper(*args, **kwargs):
+            with metrics.span(span):
+                return await f(*args, **kwargs)
+
+        return async_wrapper if inspect.iscoroutinefunction(f) else wrapper
+
+    if _func is None:  # @timed(name=...)
+        return decorator
+    else:  # @timed
+        return decorator(_func)
@@ -0,0 +1,68 @@
+import numpy as np
+
+EARTH_RADIUS = 6371000
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance in metres between coordinates, element wise over numpy arrays
+    Arrays broadcast, so a scalar on one side gives one to many distances
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def coordinates(points: list) -> tuple:
+    """
+    Splits a list of points into latitude and longitude arrays
+    """
+    latitudes = np.fromiter((point.latitude for point in points), np.float64, len(points))
+    longitudes = np.fromiter((point.longitude for point in points), np.float64, len(points))
+    return latitudes, longitudes
+
+
+def segment_distances(latitudes, longitudes):
+    """
+    Distance of every consecutive segment of a track, one shorter than the track
+    """
+    latitudes, longitudes = np.asarray(latitudes), np.asarray(longitudes)
+    return haversine(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+
+
+def distances_from(latitude: float, longitude: float, latitudes, longitudes):
+    """
+    Distance from one coordinate to each of many
+    """
+    return haversine(latitude, longitude, np.asarray(latitudes), np.asarray(longitudes))
+
+
+def pairwise_distances(latitudes1, longitudes1, latitudes2, longitudes2):
+    """
+    Matrix of distances between every coordinate of one set and every coordinate of another
+    """
+    return haversine(
+        np.asarray(latitudes1)[:, None],
+        np.asarray(longitudes1)[:, None],
+        np.asarray(latitudes2)[None, :],
+        np.asarray(longitudes2)[None, :],
+    )
+
+
+def track_distance(points: list) -> float:
+    """
+    Total length of a list of points in metres
+    """
+    return columns_distance(*coordinates(points))
+
+
+def columns_distance(latitudes, longitudes) -> float:
+    """
+    Total length in metres of a track given as latitude and longitude columns
+    """
+    if len(latitudes) < 2:
+        return 0.0
+    return float(segment_distances(latitudes, longitudes).sum())
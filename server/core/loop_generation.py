@@ -0,0 +1,171 @@
+from __future__ import annotations
+import time
+from heapq import heappush, heappop
+from itertools import count
+from math import atan2, hypot, inf, pi
+
+MAX_LOOP_EXPANSIONS = 200000  # Nodes settled over every search of one loop
+LOOP_TIME_BUDGET = 1.0  # Seconds spent improving a loop before the best found is returned
+LOOP_SECTORS = 12  # Bearings around the start that turnaround candidates are spread over
+LOOP_TOLERANCE = 0.05  # Score at which a loop is good enough to stop looking
+OVERLAP_PENALTY = 0.5  # Score added for a loop that runs over all of its own roads twice
+
+
+class SearchLimitReached(Exception):
+    """
+    Raised by a search abandoned at its expansion limit
+    """
+
+
+class LoopGenerator:
+    """
+    Generates a loop of roughly a target distance that starts and ends at one node
+    A bounded Dijkstra from the start finds every node within half the distance, the furthest
+    a loop can reach. In each sector of bearing around the start the node closest to a third
+    of the distance is a turnaround candidate, and pairs of candidates make triangles
+    start -> first -> second -> start, which are scored on how far they miss the target and
+    how much road they run over twice. An out and back to the node closest to half the
+    distance is always a fallback.
+    Searches share an expansion cap and candidates stop after the time budget, so a loop is
+    returned in bounded time with the best candidate found so far.
+    """
+
+    def __init__(
+        self,
+        graph,
+        max_expansions: int = MAX_LOOP_EXPANSIONS,
+        time_budget: float = LOOP_TIME_BUDGET,
+    ):
+        self.graph = graph
+        self.max_expansions = max_expansions
+        self.time_budget = time_budget
+
+    def generate(self, start: int, distance: float, stats: dict = None) -> tuple:
+        """
+        Returns the loop as a list of graph indices starting and ending at start and its length
+        """
+        deadline = time.monotonic() + self.time_budget
+        costs, parents, expansions = self.tree(start, distance / 2)
+        if len(costs) == 1:
+            raise Exception("No loop could be found from the start.")
+
+        # Out and back is always possible, later candidates have to beat it
+        turnaround = min(costs, key=lambda index: abs(costs[index] - distance / 2))
+        out = self.tree_path(parents, turnaround)
+        best_path = out + out[-2::-1]
+        best_length = 2 * costs[turnaround]
+        best_score = self.score(best_path, best_length, distance)
+        candidates = 1
+
+        space = self.graph.search_space()
+        for first, second in self.turnarounds(start, costs, distance):
+            if (
+                best_score <= LOOP_TOLERANCE
+                or expansions >= self.max_expansions
+                or time.monotonic() >= deadline
+            ):
+                break
+            leg_stats = {}
+            try:
+                leg, leg_length = space.astar(
+                    first, second, leg_stats, self.max_expansions - expansions
+                )
+            except SearchLimitReached:
+                break  # Expansion cap reached
+            finally:
+                expansions += leg_stats.get("expansions", 0)
+            candidates += 1
+            path = (
+                self.tree_path(parents, first)
+                + leg[1:]
+                + self.tree_path(parents, second)[-2::-1]
+            )
+            length = costs[first] + leg_length + costs[second]
+            score = self.score(path, length, distance)
+            if score < best_score:
+                best_path, best_length, best_score = path, length, score
+
+        if stats is not None:
+            stats["expansions"] = expansions
+            stats["candidates"] = candidates
+            stats["score"] = best_score
+        return best_path, best_length
+
+    def tree(self, start: int, max_cost: float) -> tuple:
+        """
+        Dijkstra from the start settling every node up to max_cost or the expansion cap
+        Returns costs and parents of settled nodes and the number of expansions
+        """
+        costs = {}
+        parents = {start: None}
+        tentative = {start: 0}
+        counter = count()
+        frontier = [(0, next(counter), start)]
+        while frontier and len(costs) < self.max_expansions:
+            cost, _, current = heappop(frontier)
+            if current in costs:
+                continue
+            if cost > max_cost:
+                break
+            costs[current] = cost
+            for neighbour, length in self.graph.neighbours(current):
+                new_cost = cost + length
+                if neighbour not in costs and new_cost < tentative.get(neighbour, inf):
+                    tentative[neighbour] = new_cost
+                    parents[neighbour] = current
+                    heappush(frontier, (new_cost, next(counter), neighbour))
+        return costs, parents, len(costs)
+
+    def turnarounds(self, start: int, costs: dict, distance: float) -> list:
+        """
+        Pairs of turnaround candidates 60 to 120 degrees apart around the start,
+        ordered by how close their straight line triangle is to the target distance
+        """
+        graph = self.graph
+        latitude, longitude = graph.latitudes[start], graph.longitudes[start]
+        sectors = {}
+        for index, cost in costs.items():
+            if cost < distance / 6:
+                continue
+            bearing = atan2(
+                (graph.latitudes[index] - latitude) * graph.vert_unit,
+                (graph.longitudes[index] - longitude) * graph.hor_unit,
+            )
+            sector = int((bearing + pi) / (2 * pi) * LOOP_SECTORS) % LOOP_SECTORS
+            closest = sectors.get(sector)
+            if closest is None or abs(cost - distance / 3) < abs(costs[closest] - distance / 3):
+                sectors[sector] = index
+        pairs = []
+        for sector, first in sectors.items():
+            for step in range(LOOP_SECTORS // 6, LOOP_SECTORS // 3 + 1):
+                second = sectors.get((sector + step) % LOOP_SECTORS)
+                if second is None:
+                    continue
+                straight = hypot(
+                    (graph.latitudes[first] - graph.latitudes[second]) * graph.vert_unit,
+                    (graph.longitudes[first] - graph.longitudes[second]) * graph.hor_unit,
+                )
+                estimate = costs[first] + straight + costs[second]
+                pairs.append((abs(estimate - distance), first, second))
+        pairs.sort()
+        return [(first, second) for _, first, second in pairs]
+
+    @staticmethod
+    def tree_path(parents: dict, index: int) -> list:
+        """
+        Path from the start of the tree to a node
+        """
+        path = []
+        while index is not None:
+            path.append(index)
+            index = parents[index]
+        return path[::-1]
+
+    @staticmethod
+    def score(path: list, length: float, distance: float) -> float:
+        """
+        Relative miss of the target distance plus a penalty for roads used twice
+        """
+        edges = [frozenset(edge) for edge in zip(path[:-1], path[1:])]
+        overlap = 1 - len(set(edges)) / len(edges) if edges else 1
+        return abs(length - distance) / distance + OVERLAP_PENALTY * 2 * overlap
@@ -0,0 +1,412 @@
+import copy
+import re
+from itertools import count
+
+
+class MemoryClient:
+    """
+    In-memory stand-in for AsyncIOMotorClient, used for load testing without a database
+    Databases and collections are created on first access like Motor's,
+    eg MemoryClient().majorproject.users
+    """
+
+    def __init__(self):
+        self.databases = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self.databases:
+            self.databases[name] = MemoryDatabase(name)
+        return self.databases[name]
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name)
+        return self.collections[name]
+
+
+class InsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+
+
+class MemoryCollection:
+    """
+    Motor collection over a dict of documents keyed by _id
+    Supports the subset of queries, updates and projections the server uses.
+    Documents are copied in and out, so callers can mutate what they get back
+    the way they can with documents decoded from BSON.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.documents = {}  # _id -> document, in insertion order
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self.ids = count(1)
+
+    async def find_one(self, query: dict = None, projection=None):
+        for document in self.matching(query or {}):
+            return project(document, projection)
+        return None
+
+    def find(self, query: dict = None, projection=None):
+        return MemoryCursor(self, query or {}, projection)
+
+    async def count_documents(self, query: dict) -> int:
+        return sum(1 for _ in self.matching(query))
+
+    async def insert_one(self, document: dict) -> InsertResult:
+        document = copy.deepcopy(document)
+        if "_id" not in document:
+            document["_id"] = next(self.ids)
+        self.check_unique(document)
+        self.documents[document["_id"]] = document
+        return InsertResult(document["_id"])
+
+    async def insert_many(self, documents: list) -> list:
+        return [(await self.insert_one(document)).inserted_id for document in documents]
+
+    async def replace_one(self, query: dict, document: dict, upsert: bool = False):
+        for current in self.matching(query):
+            replacement = copy.deepcopy(document)
+            replacement["_id"] = current["_id"]
+            self.documents[current["_id"]] = replacement
+            return UpdateResult(1, 1)
+        if upsert:
+            return UpdateResult(0, 0, (await self.insert_one(document)).inserted_id)
+        return UpdateResult(0, 0)
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        return await self.update(query, update, upsert, many=False)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False):
+        return await self.update(query, update, upsert, many=True)
+
+    async def update(self, query: dict, update: dict, upsert: bool, many: bool):
+        matched = modified = 0
+        for document in list(self.matching(query)):
+            matched += 1
+            before = copy.deepcopy(document)
+            apply_update(document, update)
+            modified += document != before
+            if not many:
+                break
+        if matched == 0 and upsert:
+            document = dict(
+                (key, value)
+                for key, value in query.items()
+                if not key.startswith("$") and not isinstance(value, dict)
+            )
+            apply_update(document, update)
+            return UpdateResult(0, 0, (await self.insert_one(document)).inserted_id)
+        return UpdateResult(matched, modified)
+
+    async def delete_one(self, query: dict) -> DeleteResult:
+        for document in self.matching(query):
+            del self.documents[document["_id"]]
+            return DeleteResult(1)
+        return DeleteResult(0)
+
+    async def delete_many(self, query: dict) -> DeleteResult:
+        ids = [document["_id"] for document in self.matching(query)]
+        for document_id in ids:
+            del self.documents[document_id]
+        return DeleteResult(len(ids))
+
+    async def create_index(self, keys, unique: bool = False, name: str = None, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = name or "_".join(f"{key}_{direction}" for key, direction in keys)
+        self.indexes[name] = {"key": list(keys), "unique": unique}
+        return name
+
+    async def index_information(self) -> dict:
+        return copy.deepcopy(self.indexes)
+
+    async def drop(self):
+        self.documents.clear()
+
+    def check_unique(self, document: dict):
+        for name, index in self.indexes.items():
+            if not index.get("unique"):
+                continue
+            key = [get_path(document, field) for field, _ in index["key"]]
+            for other in self.documents.values():
+                if other["_id"] != document["_id"] and [
+                    get_path(other, field) for field, _ in index["key"]
+                ] == key:
+                    raise Exception(f"Duplicate key error on index {name}.")
+
+    def text_fields(self) -> list:
+        return [
+            field
+            for index in self.indexes.values()
+            for field, kind in index["key"]
+            if kind == "text"
+        ]
+
+    def matching(self, query: dict):
+        if "_id" in query and not isinstance(query["_id"], dict):
+            document = self.documents.get(query["_id"])  # Primary key lookup
+            if document is not None and matches(document, query, self.text_fields()):
+                yield document
+            return
+        text_fields = self.text_fields() if "$text" in query else []
+        for document in list(self.documents.values()):
+            if matches(document, query, text_fields):
+                yield document
+
+
+class MemoryCursor:
+    """
+    Cursor over a MemoryCollection query with Motor's sort, skip, limit and to_list
+    """
+
+    def __init__(self, collection: MemoryCollection, query: dict, projection):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.order = []
+        self.skipped = 0
+        self.limited = 0
+        self.results = None
+
+    def sort(self, key, direction: int = 1):
+        self.order = [(key, direction)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, skipped: int):
+        self.skipped = skipped
+        return self
+
+    def limit(self, limited: int):
+        self.limited = limited
+        return self
+
+    def evaluate(self) -> list:
+        documents = list(self.collection.matching(self.query))
+        for key, direction in reversed(self.order):
+            documents.sort(
+                key=lambda document: sort_key(get_path(document, key)), reverse=direction < 0
+            )
+        documents = documents[self.skipped :]
+        if self.limited:
+            documents = documents[: self.limited]
+        return [project(document, self.projection) for document in documents]
+
+    async def to_list(self, length: int = None) -> list:
+        if self.results is None:
+            self.results = self.evaluate()
+        if not length:
+            documents, self.results = self.results, []
+        else:
+            documents, self.results = self.results[:length], self.results[length:]
+        return documents
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.results is None:
+            self.results = self.evaluate()
+        if not self.results:
+            raise StopAsyncIteration
+        return self.results.pop(0)
+
+
+MISSING = object()
+
+
+def get_path(document, path: str):
+    """
+    Value at a dotted path, MISSING when any part is absent
+    """
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        elif isinstance(value, list):
+            # A field of an array of documents is the array of that field, as in Mongo
+            value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        else:
+            return MISSING
+    return value
+
+
+def set_path(document: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def unset_path(document: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def sort_key(value):
+    # Mongo orders missing and null first, then numbers, then strings
+    if value is MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value))
+
+
+def compare(value, condition) -> bool:
+    """
+    Whether a field value meets a query condition, arrays match when any element does
+    """
+    if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+        return all(operator(value, key, argument) for key, argument in condition.items())
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    if value is MISSING:
+        return condition is None
+    return value == condition
+
+
+def operator(value, key: str, argument) -> bool:
+    if key == "$exists":
+        return (value is not MISSING) == bool(argument)
+    if key == "$ne":
+        return not compare(value, argument)
+    if key == "$in":
+        return any(compare(value, item) for item in argument)
+    if key == "$nin":
+        return not any(compare(value, item) for item in argument)
+    if value is MISSING or value is None:
+        return False
+    values = value if isinstance(value, list) else [value]
+    try:
+        if key == "$gt":
+            return any(item > argument for item in values)
+        if key == "$gte":
+            return any(item >= argument for item in values)
+        if key == "$lt":
+            return any(item < argument for item in values)
+        if key == "$lte":
+            return any(item <= argument for item in values)
+    except TypeError:
+        return False  # Mongo never matches across types
+    raise Exception(f"Unsupported query operator {key}.")
+
+
+def matches(document: dict, query: dict, text_fields: list = ()) -> bool:
+    for key, condition in query.items():
+        if key == "$text":
+            words = set(re.findall(r"\w+", condition["$search"].lower()))
+            text = " ".join(
+                str(get_path(document, field)) for field in text_fields
+            ).lower()
+            if not words & set(re.findall(r"\w+", text)):
+                return False
+        elif key == "$or":
+            if not any(matches(document, part, text_fields) for part in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, part, text_fields) for part in condition):
+                return False
+        elif not compare(get_path(document, key), condition):
+            return False
+    return True
+
+
+def apply_update(document: dict, update: dict):
+    for update_operator, fields in update.items():
+        for path, value in fields.items():
+            current = get_path(document, path)
+            if update_operator == "$set":
+                set_path(document, path, copy.deepcopy(value))
+            elif update_operator == "$unset":
+                unset_path(document, path)
+            elif update_operator == "$inc":
+                set_path(document, path, (0 if current is MISSING else current) + value)
+            elif update_operator in ("$push", "$addToSet"):
+                if current is MISSING:
+                    current = []
+                    set_path(document, path, current)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in items:
+                    if update_operator == "$push" or item not in current:
+                        current.append(copy.deepcopy(item))
+                if isinstance(value, dict) and "$slice" in value:
+                    limit = value["$slice"]  # Negative keeps the last items
+                    current[:] = current[limit:] if limit < 0 else current[:limit]
+            elif update_operator == "$pull":
+                if isinstance(current, list):
+                    current[:] = [item for item in current if not pulled(item, value)]
+            else:
+                raise Exception(f"Unsupported update operator {update_operator}.")
+
+
+def pulled(item, condition) -> bool:
+    """
+    Whether $pull removes an array item, a document condition is a query on document items
+    """
+    if isinstance(item, dict) and isinstance(condition, dict) and not any(
+        key.startswith("$") for key in condition
+    ):
+        return matches(item, condition)
+    return compare(item, condition)
+
+
+def project(document: dict, projection) -> dict:
+    """
+    Copy of a document with only the projected fields, as find and find_one return it
+    """
+    if not projection:
+        return copy.deepcopy(document)
+    if isinstance(projection, list):
+        projection = dict((field, 1) for field in projection)
+    include_id = projection.get("_id", 1)
+    fields = dict((key, value) for key, value in projection.items() if key != "_id")
+    if all(not value for value in fields.values()):
+        result = copy.deepcopy(document)  # Exclusion projection
+        for path in fields:
+            unset_path(result, path)
+    else:
+        result = {}
+        for path in fields:
+            value = get_path(document, path)
+            if value is not MISSING:
+                set_path(result, path, copy.deepcopy(value))
+        if include_id:
+            result["_id"] = document["_id"]
+    if not include_id:
+        result.pop("_id", None)
+    return result
@@ -0,0 +1,131 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from half a millisecond to ten seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+class Histogram:
+    """
+    Durations counted into fixed buckets, with their count, sum and maximum
+    """
+
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last count is above every bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate of a quantile, interpolated inside the bucket it falls in
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum * 1000, 3),
+            "mean_ms": round(self.sum * 1000 / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "buckets": dict(
+                (str(bucket), count) for bucket, count in zip(self.buckets + ("+Inf",), self.counts)
+            ),
+        }
+
+
+class Metrics:
+    """
+    Registry of timing histograms by span name, eg "route.search" or "mongo.users.find_one"
+    Spans are recorded from the event loop and executor threads alike, so updates are locked.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        Times the body of a with block, awaits inside it count towards the span
+        """
+        time1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - time1)
+
+    def timed(self, name: str, func, *args, **kwargs):
+        """
+        Calls a function inside a span, for work handed to an executor
+        """
+        with self.span(name):
+            return func(*args, **kwargs)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return dict(
+                (name, histogram.to_dict())
+                for name, histogram in sorted(self.histograms.items())
+            )
+
+    def prometheus(self, gauges: dict = None) -> str:
+        """
+        Histograms and extra gauges in the Prometheus text format
+        """
+        lines = [
+            "# HELP racepace_span_seconds Time spent in instrumented spans",
+            "# TYPE racepace_span_seconds histogram",
+        ]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'racepace_span_seconds_bucket{{span="{name}",le="{bucket}"}} {cumulative}'
+                    )
+                lines.append(f'racepace_span_seconds_sum{{span="{name}"}} {histogram.sum}')
+                lines.append(f'racepace_span_seconds_count{{span="{name}"}} {histogram.count}')
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE racepace_{name} gauge")
+            lines.append(f"racepace_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()  # Process wide registry the server records into
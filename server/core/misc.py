@@ -1,3 +1,9 @@
+import json
+import re
+
+from .overpass_stream import stream_elements
+
+
 class Overpass:
     """Sunny"""
 
@@ -22,6 +28,64 @@ out;""".replace(
     # You can put this command in one line in the final version
     # Command description: Finds all ways with the tag highway in the area given,
     # then finds all nodes associated with these ways
+    BBOX_REQ = BASE + "[out:json];(way[highway]({});>;);out;"
+    # Same command over a "south,west,north,east" bounding box, used to fill tile store tiles
+
+
+class LocalOverpass:
+    """
+    Stand-in for the Overpass API that answers bounding box requests from local json dumps
+    Usable as the fetch of a TileStore, eg LocalOverpass.from_files("nodes.json", "ways.json").fetch
+    or as its stream, which sends the response through the streaming parser in small chunks
+    """
+
+    CHUNK_SIZE = 4096
+
+    BBOX_PATTERN = re.compile(r"\(([-\d.e]+),([-\d.e]+),([-\d.e]+),([-\d.e]+)\)")
+
+    def __init__(self, elements: list):
+        self.nodes = dict(
+            (element["id"], element) for element in elements if element["type"] == "node"
+        )
+        self.ways = [
+            element
+            for element in elements
+            if element["type"] == "way" and "highway" in element.get("tags", {})
+        ]
+        self.requests = 0
+
+    @classmethod
+    def from_files(cls, *paths):
+        elements = []
+        for path in paths:
+            with open(path) as f:
+                elements += json.load(f)["elements"]
+        return cls(elements)
+
+    async def fetch(self, url: str) -> dict:
+        self.requests += 1
+        south, west, north, east = map(float, self.BBOX_PATTERN.search(url).groups())
+        elements, node_ids = [], set()
+        for way in self.ways:
+            way_nodes = [self.nodes[node_id] for node_id in way["nodes"] if node_id in self.nodes]
+            if any(
+                south <= node["lat"] <= north and west <= node["lon"] <= east
+                for node in way_nodes
+            ):
+                elements.append(way)
+                node_ids.update(node["id"] for node in way_nodes)
+        # Overpass lists nodes before the ways that use them
+        elements = [self.nodes[node_id] for node_id in node_ids] + elements
+        return {"elements": elements}
+
+    async def stream(self, url: str):
+        body = json.dumps(await self.fetch(url)).encode()
+        async for element in stream_elements(self.chunks(body)):
+            yield element
+
+    async def chunks(self, body: bytes):
+        for start in range(0, len(body), self.CHUNK_SIZE):
+            yield body[start : start + self.CHUNK_SIZE]
 
 
 class Color:
@@ -0,0 +1,99 @@
+import codecs
+import json
+
+ROUTING_TAGS = ("highway", "surface", "sidewalk")  # Way tags read by route profiles
+WHITESPACE = " \t\r\n,"
+
+
+class ElementParser:
+    """
+    Incremental parser for Overpass json responses
+    Bytes are fed in as they arrive and elements are decoded one at a time from inside the
+    elements array, so only the element being read is ever held as text rather than the
+    whole response. Elements are compacted as they are decoded, see compact_element.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.in_elements = False
+        self.finished = False
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        Takes the next chunk of the response, returns the elements it completed
+        """
+        self.buffer += self.text.decode(chunk)
+        if self.finished:
+            self.buffer = ""  # Trailing fields such as remark are not used
+            return []
+        if not self.in_elements:
+            start = self.buffer.find('"elements"')
+            bracket = self.buffer.find("[", start) if start != -1 else -1
+            if bracket == -1:
+                # Keep enough of the header for a key split across chunks
+                self.buffer = self.buffer[start:] if start != -1 else self.buffer[-10:]
+                return []
+            self.buffer = self.buffer[bracket + 1 :]
+            self.in_elements = True
+
+        elements = []
+        buffer = self.buffer
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                self.finished = True
+                position = len(buffer)
+                break
+            try:
+                element, position = self.decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break  # Element split across chunks, the rest arrives with the next one
+            element = compact_element(element)
+            if element is not None:
+                elements.append(element)
+        self.buffer = buffer[position:]
+        return elements
+
+    def close(self):
+        if not self.finished:
+            raise Exception("Overpass response ended before its elements did.")
+
+
+def compact_element(element: dict) -> dict:
+    """
+    Keeps only what routing reads: node coordinates, way node lists and ROUTING_TAGS
+    """
+    if element["type"] == "node":
+        return {
+            "type": "node",
+            "id": element["id"],
+            "lat": element["lat"],
+            "lon": element["lon"],
+        }
+    if element["type"] == "way":
+        tags = element.get("tags", {})
+        return {
+            "type": "way",
+            "id": element["id"],
+            "nodes": element["nodes"],
+            "tags": dict((tag, tags[tag]) for tag in ROUTING_TAGS if tag in tags),
+        }
+    return None  # Relations and areas are not part of the road graph
+
+
+async def stream_elements(chunks):
+    """
+    Yields compacted elements from an async iterator of response chunks,
+    eg response.content.iter_chunked of an aiohttp response
+    """
+    parser = ElementParser()
+    async for chunk in chunks:
+        for element in parser.feed(chunk):
+            yield element
+    parser.close()
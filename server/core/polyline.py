@@ -0,0 +1,64 @@
+"""
+Encoded polyline codec, the format of the Google Maps and OSRM polyline
+Each coordinate is stored as the zigzag encoded difference from the one before it,
+written as a varint of 5 bit groups shifted into printable ascii. Consecutive route nodes
+are close together, so most coordinates take 3 or 4 characters instead of a json float.
+"""
+
+PRECISION = 5  # Decimal places of responses, about a metre
+STORAGE_PRECISION = 6  # Decimal places of stored routes, about ten centimetres
+
+
+def encode_value(value: int, chunks: list):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode(coordinates, precision: int = PRECISION) -> str:
+    """
+    Encodes (latitude, longitude) pairs, or anything with latitude and longitude attributes
+    """
+    factor = 10 ** precision
+    chunks = []
+    last_latitude = last_longitude = 0
+    for coordinate in coordinates:
+        if hasattr(coordinate, "latitude"):
+            latitude, longitude = coordinate.latitude, coordinate.longitude
+        else:
+            latitude, longitude = coordinate
+        latitude = int(round(latitude * factor))
+        longitude = int(round(longitude * factor))
+        encode_value(latitude - last_latitude, chunks)
+        encode_value(longitude - last_longitude, chunks)
+        last_latitude, last_longitude = latitude, longitude
+    return "".join(chunks)
+
+
+def decode(string: str, precision: int = PRECISION) -> list:
+    """
+    Decodes a polyline into a list of (latitude, longitude) pairs
+    """
+    factor = 10 ** precision
+    coordinates = []
+    values = [0, 0]  # Running latitude and longitude
+    index = 0
+    result = shift = 0
+    for character in string:
+        byte = ord(character) - 63
+        if byte < 0 or byte > 0x3F:
+            raise Exception("Invalid polyline.")
+        result |= (byte & 0x1F) << shift
+        shift += 5
+        if byte & 0x20:
+            continue  # More chunks of this value follow
+        values[index] += ~(result >> 1) if result & 1 else result >> 1
+        result = shift = 0
+        if index == 1:
+            coordinates.append((values[0] / factor, values[1] / factor))
+        index = 1 - index
+    if shift or index:
+        raise Exception("Invalid polyline.")
+    return coordinates
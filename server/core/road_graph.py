@@ -0,0 +1,635 @@
+from __future__ import annotations
+import copy
+from array import array
+from heapq import heappush, heappop
+from itertools import chain, count
+from math import hypot, inf
+
+import numpy as np
+
+from .route_generation import Route, Point, Node
+from .spatial_index import GridIndex
+from .loop_generation import LoopGenerator, SearchLimitReached
+from .route_profile import RouteProfile, highway_code
+
+
+class RoadGraph:
+    """
+    Compact road graph held in contiguous arrays
+    Node ids are sorted so the id -> index map is a binary search,
+    coordinates are parallel arrays and adjacency is in compressed sparse row form:
+    the neighbours of node i are targets[offsets[i]:offsets[i + 1]]
+    Edge lengths and heuristics are measured on one plane scaled by the coordinate units
+    at the centre of the graph, so straight line distance never exceeds a path length
+    Searches follow edge weights, which are the lengths unless a RouteProfile is applied
+    """
+
+    def __init__(self, ids, latitudes, longitudes, offsets, targets, lengths, highways=None):
+        self.ids = ids  # int64, sorted
+        self.latitudes = latitudes  # float64
+        self.longitudes = longitudes  # float64
+        self.offsets = offsets  # int32, len(ids) + 1
+        self.targets = targets  # int32, node index of each directed edge
+        self.lengths = lengths  # float32, metres of each directed edge
+        if highways is None:
+            highways = np.zeros(len(targets), dtype=np.uint8)
+        self.highways = highways  # uint8, HIGHWAY_TYPES code of each directed edge
+        self.weights = lengths  # float32, search cost of each directed edge
+        self.profile_weights = {}  # profile name -> weights, compiled once per graph
+        self.vert_unit, self.hor_unit = coordinate_units(latitudes, longitudes)
+        self._spatial_index = None
+        self.hierarchy = None  # ContractionHierarchy over this graph, once one is loaded
+        # Set on graphs made by simplify: the full graph, and per edge the full graph
+        # indices of the nodes the edge collapsed, in CSR form parallel to targets
+        self.parent = None
+        self.chain_offsets = None
+        self.chain_indices = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the graph arrays in bytes
+        """
+        return sum(
+            array.nbytes
+            for array in (
+                self.ids,
+                self.latitudes,
+                self.longitudes,
+                self.offsets,
+                self.targets,
+                self.lengths,
+                self.highways,
+            )
+        )
+
+    @classmethod
+    def from_elements(cls, elements: list) -> RoadGraph:
+        """
+        Generates a graph from an Overpass element list, which holds nodes and ways together
+        """
+        node_data, way_data = [], []
+        for element in elements:
+            if element["type"] == "node":
+                node_data.append(element)
+            elif element["type"] == "way":
+                way_data.append(element)
+            else:
+                raise Exception("Unidentified element type")
+        return cls.from_json(node_data, way_data)
+
+    @classmethod
+    def from_json(cls, nodes_json: list, ways_json: list) -> RoadGraph:
+        """
+        Generates a graph from node and way json in a single vectorised pass
+        Ways reference node ids; references to nodes outside of nodes_json are dropped
+        """
+        ids = np.fromiter((node["id"] for node in nodes_json), np.int64, len(nodes_json))
+        latitudes = np.fromiter((node["lat"] for node in nodes_json), np.float64, len(nodes_json))
+        longitudes = np.fromiter((node["lon"] for node in nodes_json), np.float64, len(nodes_json))
+        way_lengths = np.fromiter((len(way["nodes"]) for way in ways_json), np.int64, len(ways_json))
+        way_node_ids = np.fromiter(
+            chain.from_iterable(way["nodes"] for way in ways_json),
+            np.int64,
+            int(way_lengths.sum()),
+        )
+        way_highways = np.fromiter(
+            (highway_code(way.get("tags", {})) for way in ways_json), np.uint8, len(ways_json)
+        )
+        return cls.from_arrays(
+            ids, latitudes, longitudes, way_lengths, way_node_ids, way_highways
+        )
+
+    @classmethod
+    def from_arrays(
+        cls, ids, latitudes, longitudes, way_lengths, way_node_ids, way_highways=None
+    ) -> RoadGraph:
+        """
+        Generates a graph from node id and coordinate arrays and the node ids of every way
+        laid end to end, way_lengths giving the number of nodes in each way
+        and way_highways the highway code of each way
+        Nodes listed more than once, such as nodes shared between tiles, are merged
+        """
+        if way_highways is None:
+            way_highways = np.zeros(len(way_lengths), dtype=np.uint8)
+        ids, unique = np.unique(ids, return_index=True)
+        latitudes, longitudes = latitudes[unique], longitudes[unique]
+
+        # Every consecutive pair of node ids in a way is an edge, pairs spanning two ways are not
+        way_ends = np.cumsum(way_lengths) - 1
+        pair_mask = np.ones(max(len(way_node_ids) - 1, 0), dtype=bool)
+        pair_mask[way_ends[(way_ends >= 0) & (way_ends < len(pair_mask))]] = False
+
+        indices = np.searchsorted(ids, way_node_ids)
+        indices[indices == len(ids)] = 0
+        known = ids[indices] == way_node_ids if len(ids) else np.zeros(len(way_node_ids), bool)
+        sources, targets = indices[:-1], indices[1:]
+        pair_mask &= known[:-1] & known[1:] & (sources != targets)
+        highways = np.repeat(way_highways, way_lengths)[:-1]  # Highway of the way of each pair
+        sources, targets, highways = sources[pair_mask], targets[pair_mask], highways[pair_mask]
+
+        # Roads are walkable both ways, duplicate edges shared by ways are merged
+        sources, targets, highways = (
+            np.concatenate((sources, targets)),
+            np.concatenate((targets, sources)),
+            np.concatenate((highways, highways)),
+        )
+        edge_keys, first_edges = np.unique(sources * len(ids) + targets, return_index=True)
+        highways = highways[first_edges]
+        sources, targets = edge_keys // max(len(ids), 1), edge_keys % max(len(ids), 1)
+
+        offsets = np.zeros(len(ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(sources, minlength=len(ids)), out=offsets[1:])
+        vert_unit, hor_unit = coordinate_units(latitudes, longitudes)
+        lengths = np.hypot(
+            (latitudes[targets] - latitudes[sources]) * vert_unit,
+            (longitudes[targets] - longitudes[sources]) * hor_unit,
+        )
+        return cls(
+            ids,
+            latitudes,
+            longitudes,
+            offsets,
+            targets.astype(np.int32),
+            lengths.astype(np.float32),
+            highways.astype(np.uint8),
+        )
+
+    def index_of(self, node_id: int) -> int:
+        """
+        Index of a node id in the graph arrays
+        """
+        index = int(np.searchsorted(self.ids, node_id))
+        if index == len(self.ids) or self.ids[index] != node_id:
+            raise Exception("Node not in node space. Specify a valid node.")
+        return index
+
+    def __contains__(self, node_id: int) -> bool:
+        index = int(np.searchsorted(self.ids, node_id))
+        return index < len(self.ids) and self.ids[index] == node_id
+
+    def degree(self, index: int) -> int:
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def on_way(self, index: int) -> bool:
+        """
+        Whether the node lies on a way, ie has any neighbours
+        """
+        return self.offsets[index + 1] != self.offsets[index]
+
+    def neighbours(self, index: int):
+        """
+        Returns (neighbour index, edge weight) pairs of a node
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return zip(self.targets[start:end].tolist(), self.weights[start:end].tolist())
+
+    def edge_position(self, first: int, second: int) -> int:
+        """
+        Position in targets of the edge from first to second
+        """
+        start, end = self.offsets[first], self.offsets[first + 1]
+        return int(start) + self.targets[start:end].tolist().index(second)
+
+    def path_length(self, path: list) -> float:
+        """
+        Length in metres of a path of graph indices
+        """
+        return sum(
+            float(self.lengths[self.edge_position(first, second)])
+            for first, second in zip(path[:-1], path[1:])
+        )
+
+    def with_profile(self, profile: RouteProfile) -> RoadGraph:
+        """
+        View of the graph whose searches follow the weights of a RouteProfile
+        Weights are compiled on first use and kept with the graph. The view shares every
+        array with the graph but not its contraction hierarchy, which was built on lengths.
+        """
+        if profile.uniform:
+            return self
+        weights = self.profile_weights.get(profile.name)
+        if weights is None:
+            weights = profile.weights(self.lengths, self.highways)
+            self.profile_weights[profile.name] = weights
+        view = copy.copy(self)
+        view.weights = weights
+        view.hierarchy = None
+        return view
+
+    def node(self, index: int) -> Node:
+        """
+        Materialises a Node for a graph index, only done for nodes in a returned route
+        """
+        return Node(
+            self.latitudes[index], self.longitudes[index], int(self.ids[index]), {}
+        )
+
+    def route_nodes(self, path: list) -> list:
+        """
+        Materialises the Nodes of a path of graph indices, putting back nodes collapsed by simplify
+        """
+        if self.parent is None:
+            return [self.node(index) for index in path]
+        nodes = [self.node(path[0])]
+        for first, second in zip(path[:-1], path[1:]):
+            position = self.edge_position(first, second)
+            collapsed = self.chain_indices[
+                self.chain_offsets[position] : self.chain_offsets[position + 1]
+            ]
+            nodes += [self.parent.node(index) for index in collapsed.tolist()]
+            nodes.append(self.node(second))
+        return nodes
+
+    def component(self, start: int) -> list:
+        """
+        Indices of every node connected to a node
+        """
+        offsets, targets = self.offsets.tolist(), self.targets.tolist()
+        seen = bytearray(len(self))
+        seen[start] = 1
+        component = [start]
+        for index in component:
+            for neighbour in targets[offsets[index] : offsets[index + 1]]:
+                if not seen[neighbour]:
+                    seen[neighbour] = 1
+                    component.append(neighbour)
+        return component
+
+    def simplify(self, keep: list) -> RoadGraph:
+        """
+        Graph of the component of keep[0] with chains of degree 2 nodes collapsed into single edges
+        Junctions, dead ends and the nodes in keep, such as snapped route endpoints, remain.
+        Node ids, edge lengths and weights carry over, so searches run unchanged on the smaller
+        graph, and the collapsed nodes of each edge are kept for route_nodes to expand routes with
+        """
+        offsets, targets, lengths, weights = (
+            self.offsets.tolist(),
+            self.targets.tolist(),
+            self.lengths.tolist(),
+            self.weights.tolist(),
+        )
+        junctions = set(
+            index for index in self.component(keep[0]) if offsets[index + 1] - offsets[index] != 2
+        )
+        junctions.update(keep)
+
+        # Walk from every junction along each of its edges until the next junction
+        edges = {}  # (junction, junction) -> (weight, length, first edge, collapsed indices)
+        for junction in junctions:
+            for position in range(offsets[junction], offsets[junction + 1]):
+                previous, current = junction, targets[position]
+                weight, length = weights[position], lengths[position]
+                collapsed = []
+                while current not in junctions:
+                    collapsed.append(current)
+                    following = offsets[current]
+                    if targets[following] == previous:
+                        following += 1
+                    weight += weights[following]
+                    length += lengths[following]
+                    previous, current = current, targets[following]
+                if current == junction:
+                    continue  # A road that loops back never shortens a route
+                if weight < edges.get((junction, current), (inf,))[0]:
+                    # Cheapest of parallel roads
+                    edges[(junction, current)] = (weight, length, position, collapsed)
+
+        kept = np.array(sorted(junctions), dtype=np.int64)
+        new_indices = dict((index, new_index) for new_index, index in enumerate(kept.tolist()))
+        edge_list = sorted(
+            (new_indices[first], new_indices[second], weight, length, position, collapsed)
+            for (first, second), (weight, length, position, collapsed) in edges.items()
+        )
+        sources = np.fromiter((edge[0] for edge in edge_list), np.int64, len(edge_list))
+        graph_offsets = np.zeros(len(kept) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(sources, minlength=len(kept)), out=graph_offsets[1:])
+        chain_offsets = np.zeros(len(edge_list) + 1, dtype=np.int32)
+        np.cumsum([len(edge[5]) for edge in edge_list], out=chain_offsets[1:])
+        simplified = RoadGraph(
+            self.ids[kept],
+            self.latitudes[kept],
+            self.longitudes[kept],
+            graph_offsets,
+            np.fromiter((edge[1] for edge in edge_list), np.int32, len(edge_list)),
+            np.fromiter((edge[3] for edge in edge_list), np.float32, len(edge_list)),
+            self.highways[np.fromiter((edge[4] for edge in edge_list), np.int64, len(edge_list))],
+        )
+        if self.weights is not self.lengths:
+            simplified.weights = np.fromiter(
+                (edge[2] for edge in edge_list), np.float32, len(edge_list)
+            )
+        # Lengths were measured in the units of the full graph, the heuristic has to match
+        simplified.vert_unit, simplified.hor_unit = self.vert_unit, self.hor_unit
+        simplified.parent = self
+        simplified.chain_offsets = chain_offsets
+        simplified.chain_indices = np.fromiter(
+            chain.from_iterable(edge[5] for edge in edge_list), np.int32, chain_offsets[-1]
+        )
+        return simplified
+
+    @property
+    def spatial_index(self) -> GridIndex:
+        """
+        Grid index over the graph nodes, built on first use and kept with the graph
+        """
+        if self._spatial_index is None:
+            self._spatial_index = GridIndex(self.latitudes, self.longitudes)
+        return self._spatial_index
+
+    def nearest(self, point: Point, k: int = 1, predicate=None) -> list:
+        """
+        Indices of the k closest nodes to a point, predicate takes a node index
+        """
+        return self.spatial_index.nearest(point, k, predicate)
+
+    def closest_index(self, point: Point) -> int:
+        """
+        Index of the node on a way that is closest to a point
+        """
+        closest = self.nearest(point, 1, self.on_way)
+        if not closest:
+            raise Exception("No way node could be found.")
+        return closest[0]
+
+    def distances_to(self, index: int) -> list:
+        """
+        Straight line distance from every node to one node, used as a search heuristic
+        """
+        return np.hypot(
+            (self.latitudes - self.latitudes[index]) * self.vert_unit,
+            (self.longitudes - self.longitudes[index]) * self.hor_unit,
+        ).tolist()
+
+    def astar(self, start: int, end: int, stats: dict = None) -> tuple:
+        """
+        A* between two graph indices using edge weights as costs
+        and the straight line distance to the end as the heuristic
+        Returns the path as a list of indices and its length in metres
+        Node expansions are recorded in stats when given
+        """
+        return self.search(start, end, self.distances_to(end), stats)
+
+    def dijkstra(self, start: int, end: int, stats: dict = None) -> tuple:
+        """
+        Dijkstra between two graph indices, the baseline A* is validated against
+        """
+        return self.search(start, end, [0] * len(self), stats)
+
+    def search(self, start: int, end: int, heuristic: list, stats: dict = None) -> tuple:
+        """
+        Best first search from start to end ordered by cost plus heuristic
+        """
+        costs = {start: 0}
+        parents = {start: None}
+        visited = set()
+        counter = count()
+        frontier = [(heuristic[start], next(counter), start)]
+        while frontier:
+            _, _, current = heappop(frontier)
+            if current in visited:
+                continue
+            if current == end:
+                break
+            visited.add(current)
+            current_cost = costs[current]
+            for neighbour, length in self.neighbours(current):
+                if neighbour in visited:
+                    continue
+                new_cost = current_cost + length
+                if new_cost < costs.get(neighbour, inf):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = current
+                    heappush(
+                        frontier, (new_cost + heuristic[neighbour], next(counter), neighbour)
+                    )
+        else:
+            raise Exception("End node cannot be reached")
+        if stats is not None:
+            stats["expansions"] = len(visited)
+        return self.walk_parents(parents, end)[::-1], costs[end]
+
+    def bidirectional_astar(self, start: int, end: int, stats: dict = None) -> tuple:
+        """
+        A* searching forward from the start and backward from the end at the same time
+        Both searches use the average potential p(v) = (h_end(v) - h_start(v)) / 2,
+        which keeps reduced edge costs non negative in both directions, so the searches can
+        stop once the smallest forward and backward keys sum to at least the best meeting cost
+        Returns the path as a list of indices and its length in metres
+        """
+        to_end, to_start = self.distances_to(end), self.distances_to(start)
+        potentials = [
+            (end_distance - start_distance) / 2
+            for end_distance, start_distance in zip(to_end, to_start)
+        ]
+        # Index 0 is the forward search, index 1 the backward search, the backward potential is -p
+        signs = (1, -1)
+        costs = ({start: 0}, {end: 0})
+        parents = ({start: None}, {end: None})
+        visited = (set(), set())
+        counter = count()
+        frontiers = (
+            [(potentials[start], next(counter), start)],
+            [(-potentials[end], next(counter), end)],
+        )
+        best_cost, meeting = inf, None
+        if start == end:
+            best_cost, meeting = 0, start
+        while frontiers[0] and frontiers[1]:
+            if frontiers[0][0][0] + frontiers[1][0][0] >= best_cost:
+                break
+            # Expand the direction with the smaller frontier
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            other = 1 - side
+            _, _, current = heappop(frontiers[side])
+            if current in visited[side]:
+                continue
+            visited[side].add(current)
+            current_cost = costs[side][current]
+            for neighbour, length in self.neighbours(current):
+                if neighbour in visited[side]:
+                    continue
+                new_cost = current_cost + length
+                if new_cost < costs[side].get(neighbour, inf):
+                    costs[side][neighbour] = new_cost
+                    parents[side][neighbour] = current
+                    heappush(
+                        frontiers[side],
+                        (
+                            new_cost + signs[side] * potentials[neighbour],
+                            next(counter),
+                            neighbour,
+                        ),
+                    )
+                    if neighbour in costs[other]:
+                        meeting_cost = new_cost + costs[other][neighbour]
+                        if meeting_cost < best_cost:
+                            best_cost, meeting = meeting_cost, neighbour
+        if meeting is None:
+            raise Exception("End node cannot be reached")
+        if stats is not None:
+            stats["expansions"] = len(visited[0]) + len(visited[1])
+        forward = self.walk_parents(parents[0], meeting)[::-1]
+        backward = self.walk_parents(parents[1], meeting)[1:]
+        return forward + backward, best_cost
+
+    def loop(self, start: int, distance: float, stats: dict = None) -> tuple:
+        """
+        Loop of roughly distance metres from a graph index back to itself, see LoopGenerator
+        """
+        return LoopGenerator(self).generate(start, distance, stats)
+
+    def search_space(self) -> SearchSpace:
+        """
+        Scratch arrays for running many searches over this graph, eg the legs of a multi route
+        """
+        return SearchSpace(self)
+
+    @staticmethod
+    def walk_parents(parents: dict, index: int) -> list:
+        """
+        Follows parent pointers from a node back to the root of a search
+        """
+        path = []
+        while index is not None:
+            path.append(index)
+            index = parents[index]
+        return path
+
+
+class RoadGraphBuilder:
+    """
+    Collects nodes and ways into flat arrays as they are parsed, then builds a RoadGraph
+    Only ids, coordinates, way node ids and highway codes are kept, so elements can be
+    dropped as soon as they are added and memory stays close to the size of the final graph
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.way_lengths = array("q")
+        self.way_node_ids = array("q")
+        self.way_highways = array("B")
+
+    def add(self, element: dict):
+        if element["type"] == "node":
+            self.ids.append(element["id"])
+            self.latitudes.append(element["lat"])
+            self.longitudes.append(element["lon"])
+        elif element["type"] == "way":
+            self.way_lengths.append(len(element["nodes"]))
+            self.way_node_ids.extend(element["nodes"])
+            self.way_highways.append(highway_code(element.get("tags", {})))
+        else:
+            raise Exception("Unidentified element type")
+
+    def add_elements(self, elements):
+        for element in elements:
+            self.add(element)
+
+    def build(self) -> RoadGraph:
+        return RoadGraph.from_arrays(
+            np.frombuffer(self.ids, np.int64),
+            np.frombuffer(self.latitudes, np.float64),
+            np.frombuffer(self.longitudes, np.float64),
+            np.frombuffer(self.way_lengths, np.int64),
+            np.frombuffer(self.way_node_ids, np.int64),
+            np.frombuffer(self.way_highways, np.uint8),
+        )
+
+
+class SearchSpace:
+    """
+    Scratch arrays reused by consecutive searches over one RoadGraph
+    Costs, parents and visited flags are held in arrays over every node, allocated once.
+    Each search records the entries it writes and only those are reset before the next,
+    so a leg of a multi waypoint route costs what it explores rather than a pass over the graph.
+    A search space belongs to one thread, the graph itself can be shared.
+    """
+
+    def __init__(self, graph: RoadGraph):
+        self.graph = graph
+        self.latitudes = graph.latitudes.tolist()
+        self.longitudes = graph.longitudes.tolist()
+        self.costs = [inf] * len(graph)
+        self.parents = [-1] * len(graph)
+        self.visited = bytearray(len(graph))
+        self.touched = []  # Indices written by the last search
+
+    def reset(self):
+        costs, parents, visited = self.costs, self.parents, self.visited
+        for index in self.touched:
+            costs[index] = inf
+            parents[index] = -1
+            visited[index] = 0
+        self.touched.clear()
+
+    def astar(self, start: int, end: int, stats: dict = None, limit: int = None) -> tuple:
+        """
+        RoadGraph.astar on the scratch arrays
+        The heuristic is worked out for the nodes reached rather than for the whole graph
+        A search that would expand more than limit nodes is abandoned
+        """
+        self.reset()
+        graph = self.graph
+        costs, parents, visited, touched = self.costs, self.parents, self.visited, self.touched
+        latitudes, longitudes = self.latitudes, self.longitudes
+        end_latitude, end_longitude = latitudes[end], longitudes[end]
+        vert_unit, hor_unit = graph.vert_unit, graph.hor_unit
+        costs[start] = 0
+        touched.append(start)
+        counter = count()
+        frontier = [(0, next(counter), start)]
+        expansions = 0
+        while frontier:
+            _, _, current = heappop(frontier)
+            if visited[current]:
+                continue
+            if current == end:
+                break
+            if expansions == limit:
+                raise SearchLimitReached("Search expansion limit reached")
+            visited[current] = 1
+            expansions += 1
+            current_cost = costs[current]
+            for neighbour, length in graph.neighbours(current):
+                if visited[neighbour]:
+                    continue
+                new_cost = current_cost + length
+                if new_cost < costs[neighbour]:
+                    if costs[neighbour] == inf:
+                        touched.append(neighbour)
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = current
+                    estimate = new_cost + hypot(
+                        (latitudes[neighbour] - end_latitude) * vert_unit,
+                        (longitudes[neighbour] - end_longitude) * hor_unit,
+                    )
+                    heappush(frontier, (estimate, next(counter), neighbour))
+        else:
+            raise Exception("End node cannot be reached")
+        if stats is not None:
+            stats["expansions"] = expansions
+        path = []
+        index = end
+        while index != -1:
+            path.append(index)
+            index = parents[index]
+        return path[::-1], costs[end]
+
+
+def coordinate_units(latitudes, longitudes) -> tuple:
+    """
+    Route.get_coordinate_units at the centre of a set of coordinates
+    """
+    if not len(latitudes):
+        return 0.0, 0.0
+    centre = Point(
+        (float(latitudes.min()) + float(latitudes.max())) / 2,
+        (float(longitudes.min()) + float(longitudes.max())) / 2,
+    )
+    return Route.get_coordinate_units(centre)
@@ -1,6 +1,8 @@
 from .route_generation import Route, Point
 from .points import run_stats
+from .geodesy import track_distance, columns_distance
 from .utils import snowflake
+from .track import Track
 
 class LocationPacket:
     """
@@ -18,6 +20,14 @@ class LocationPacket:
     def from_data(cls, data):
         return cls(**data)
 
+    @classmethod
+    def from_tuple(cls, packet):
+        latitude, longitude, timestamp, speed = packet
+        return cls({"latitude": latitude, "longitude": longitude}, timestamp, speed)
+
+    def to_tuple(self):
+        return (self.location.latitude, self.location.longitude, self.timestamp, self.speed)
+
     def to_dict(self):
         return {
             "location": self.location.to_dict(),
@@ -28,13 +38,41 @@ class LocationPacket:
 class Run:
     """
     A run that has been completed by user, but not saved to feed
+    Runs are stored with their packets as a columnar Track, which is only turned into
+    LocationPackets when they are used.
     Jason Yu
     """
 
     def __init__(self, location_packets, run_info):
-        self.location_packets = location_packets # Location packets
+        self.location_packets = location_packets # Location packets, or a Track of them
         self.run_info = run_info # Stores all run info generated on phone
 
+    @property
+    def location_packets(self):
+        if self._location_packets is None:
+            self._location_packets = [LocationPacket.from_tuple(packet) for packet in self.track]
+        return self._location_packets
+
+    @location_packets.setter
+    def location_packets(self, location_packets):
+        if isinstance(location_packets, Track):
+            self.track, self._location_packets = location_packets, None
+        else:
+            self.track, self._location_packets = None, location_packets
+
+    def packets(self):
+        """
+        Yields the location packets, decoding them one at a time from a stored track
+        """
+        if self._location_packets is not None:
+            return iter(self._location_packets)
+        return map(LocationPacket.from_tuple, self.track)
+
+    def to_track(self) -> Track:
+        if self.track is None:
+            self.track = Track.from_packets(packet.to_tuple() for packet in self._location_packets)
+        return self.track
+
     @classmethod
     def from_real_time_data(cls, location_packets, run_info):
         """
@@ -51,13 +89,30 @@ class Run:
         Generates Recent Route class from database data
         Jason Yu
         """
-        location_packets = [LocationPacket.from_data(packet) for packet in data['location_packets']]
-        run = cls(location_packets, data['run_info'])
+        run = cls(packets_from_data(data), data['run_info'])
         return run
 
+    def get_distance(self) -> float:
+        """
+        Distance covered by the location packets in metres
+        """
+        if self._location_packets is None:
+            latitudes, longitudes, _, _ = self.track.decode()
+            return columns_distance(latitudes, longitudes)
+        return track_distance([packet.location for packet in self._location_packets])
+
     def to_dict(self):
         return {
-            "location_packets": [packet.to_dict() for packet in self.location_packets],
+            "location_packets": [packet.to_dict() for packet in self.packets()],
+            "run_info": self.run_info,
+        }
+
+    def to_storage_dict(self):
+        """
+        Run as it is stored, with the packets encoded as a track
+        """
+        return {
+            "track": self.to_track().encode(),
             "run_info": self.run_info,
         }
 
@@ -83,7 +138,8 @@ class SavedRun(Run):
         Jason Yu
         """
         data['run_id'] = data.pop("id") # Using Arg Name, id is reserved
-        data["location_packets"] = [LocationPacket.from_data(packet) for packet in data["location_packets"]]
+        data["location_packets"] = packets_from_data(data)
+        data.pop("track", None)
         saved_run = cls(**data)
         return saved_run
 
@@ -104,12 +160,31 @@ class SavedRun(Run):
             "id": self.id,
             "name": self.name,
             "description": self.description,
-            "location_packets": [packet.to_dict() for packet in self.location_packets],
+            "location_packets": [packet.to_dict() for packet in self.packets()],
+            "run_info": self.run_info,
+            "likes":self.likes,
+            "comments":self.comments,
+        }
+
+    def to_storage_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "track": self.to_track().encode(),
             "run_info": self.run_info,
             "likes":self.likes,
             "comments":self.comments,
         }
 
+def packets_from_data(data):
+    """
+    Track of stored run data, or the packets of runs stored before tracks
+    """
+    if "track" in data:
+        return Track.from_bytes(data["track"])
+    return [LocationPacket.from_data(packet) for packet in data["location_packets"]]
+
 class SavedRoute:
     """
     When a user generates a route and chooses to save it, they can reuse route again in the future.
@@ -138,11 +213,18 @@ class SavedRoute:
         saved_route = cls(route_id, name, description, route, start_name, end_name)
         return saved_route
 
-    def to_dict(self):
+    def to_dict(self, format="storage"):
+        """
+        Saved routes are stored as polylines, "points" or "polyline" give the response forms
+        """
+        if format == "storage":
+            route = self.route.to_storage_dict()
+        else:
+            route = self.route.to_dict(format)
         return {
             'id': self.id,
             'name':self.name,
-            'route':self.route.to_dict(),
+            'route':route,
             'description':self.description,
             'start_name': self.start_name,
             'end_name': self.end_name,
@@ -0,0 +1,143 @@
+from __future__ import annotations
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+
+class RouteCache:
+    """
+    Bounded cache of successful route payloads
+    Entries are evicted least recently used first once either the entry count or the
+    estimated byte budget is exceeded, and expire after a time to live.
+    Keys are built from quantised coordinates so nearby requests share an entry.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600,
+        precision: int = 4,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # Seconds
+        self.precision = precision  # Decimal places kept, 4 is roughly 11m
+        self.entries = OrderedDict()  # key -> (expiry time, size, payload)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def key(self, kind: str, *points, **options) -> tuple:
+        """
+        Cache key for a route request, made of its kind, quantised points and extra options
+        """
+        quantised = tuple(
+            (round(point.latitude, self.precision), round(point.longitude, self.precision))
+            for point in points
+        )
+        return (kind, quantised, tuple(sorted(options.items())))
+
+    def get(self, key):
+        """
+        Returns the cached payload or None, a hit marks the entry as recently used
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expiry, size, payload = entry
+        if expiry <= time.monotonic():
+            self.remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, key, payload: dict):
+        """
+        Stores a successful Route.json payload, payloads that failed are never cached
+        """
+        if not payload.get("success"):
+            return
+        size = len(json.dumps(payload))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, size, payload)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        expiry, size, payload = self.entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key onto one shared future
+    The first caller starts the work, callers arriving before it finishes await the same result.
+    The work is shielded, so one waiter disconnecting does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self.flights = {}  # key -> future of the call in flight
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.flights)
+
+    async def do(self, key, function, *args, **kwargs):
+        """
+        Awaits function(*args, **kwargs), or the identical call already in flight for key
+        """
+        future = self.flights.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(function(*args, **kwargs))
+            self.flights[key] = future
+            future.add_done_callback(lambda done: self.flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.flights),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
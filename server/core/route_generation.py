@@ -3,9 +3,14 @@ import copy
 import json
 from staticmap import StaticMap, Line
 from io import BytesIO
+from heapq import heappush, heappop
+from itertools import count
 from math import *
 
-EARTH_RADIUS = 6371000
+from .geodesy import EARTH_RADIUS, coordinates, distances_from, track_distance
+from .route_profile import RouteProfile
+from .metrics import metrics
+from . import polyline
 
 
 class Point:
@@ -61,14 +66,16 @@ class Point:
         self, other: Point, hor_unit: float, vert_unit: float
     ) -> float:
         """
-        Heuristic value based on euclidean distance on geo units
+        Straight line distance in metres on a local plane scaled by geo units
+        Never more than the length of any path between the points on the same plane,
+        so it is an admissible and consistent A* heuristic
         Jason YU
         """
         delta_lat = abs(self.latitude - other.latitude)
         delta_lon = abs(self.longitude - other.longitude)
         x_dist = hor_unit * delta_lon
         y_dist = vert_unit * delta_lat
-        return x_dist ** 2 + y_dist ** 2
+        return sqrt(x_dist ** 2 + y_dist ** 2)
 
     def __iter__(self):
         """
@@ -87,26 +94,35 @@ class Point:
     def __repr__(self):
         return f"({self.latitude},{self.longitude})"
 
-    def closest_node(self, nodes: dict) -> Node:
+    def closest_node(self, nodes: dict, index=None) -> Node:
         """
         Returns the closest node from a dict of nodes
+        Uses a GridIndex over the nodes when one is given
         Abdur Raqueeb
         """
-        sorted_nodes = sorted(nodes.values(), key=lambda other: self - other)
-        return sorted_nodes[0]
+        if index is not None:
+            return nodes[index.nearest(self)[0]]
+        candidates = list(nodes.values())
+        distances = distances_from(self.latitude, self.longitude, *coordinates(candidates))
+        return candidates[int(distances.argmin())]
 
-    def closest_way_node(self, nodes: dict, way_node_ids: set) -> Node:
+    def closest_way_node(self, nodes: dict, way_node_ids: set, index=None) -> Node:
         """
         Returns closest node which is in a way from a dict of nodes and a dict of ways
-        Not in use
+        Uses a GridIndex over the nodes when one is given
         Jason Yu
         """
-        sorted_nodes = sorted(nodes.values(), key=lambda other: self - other)
-        for node in sorted_nodes:
-            if node.id in way_node_ids:
-                return node
+        if index is not None:
+            closest = index.nearest(self, 1, lambda node_id: node_id in way_node_ids)
         else:
+            way_nodes = [node for node in nodes.values() if node.id in way_node_ids]
+            closest = []
+            if way_nodes:
+                distances = distances_from(self.latitude, self.longitude, *coordinates(way_nodes))
+                closest = [way_nodes[int(distances.argmin())].id]
+        if not closest:
             raise Exception("No way node could be found.")
+        return nodes[closest[0]]
 
     def get_midpoint(self, other) -> Point:
         """
@@ -171,11 +187,11 @@ class Node(Point):
         """
         return self.id == other.id
 
-    def get_tag_multiplier(self, profile):
+    def get_tag_multiplier(self, profile: RouteProfile) -> float:
         """
         Jason Yu
         """
-        return 1
+        return profile.multiplier(self.tags)
 
     @staticmethod
     def json_to_nodes(json_nodes: list) -> dict:
@@ -252,46 +268,113 @@ class Route:
     Jason Yu/Abdur Raqueeb
     """
 
+    BIDIRECTIONAL_DISTANCE = 5000  # Metres, auto search goes bidirectional above this
+    SEARCHES = ("auto", "astar", "bidirectional", "hierarchy")
+    FORMATS = ("points", "polyline")
+
     def __init__(self, route: list, distance: int):
         self.route = route
         self.distance = distance
 
+    @property
+    def route(self) -> list:
+        """
+        Points of the route, a route loaded from its polyline is decoded on first use
+        """
+        if self._route is None and self.encoded is not None:
+            string, precision = self.encoded
+            self._route = [
+                Point(latitude, longitude)
+                for latitude, longitude in polyline.decode(string, precision)
+            ]
+        return self._route
+
+    @route.setter
+    def route(self, route: list):
+        self._route = route
+        self.encoded = None  # (polyline, precision) of a route that has not been decoded
+
     @property
     def json(self):
         """
         Jason Yu/Abdur Raqueeb
         """
-        json = self.to_dict()
+        return self.to_json()
+
+    def to_json(self, format: str = "points") -> dict:
+        json = self.to_dict(format)
         json["success"] = True
         return json
 
-    def to_dict(self):
+    def to_dict(self, format: str = "points"):
         """
+        Route as a list of latitude/longitude dicts, or with format="polyline"
+        as an encoded polyline string
         Jason Yu/Abdur Raqueeb
         """
+        if format == "polyline":
+            return {
+                "route": self.to_polyline(),
+                "distance": self.distance,
+                "format": "polyline",
+                "precision": polyline.PRECISION,
+            }
         route = [
             {"latitude": node.latitude, "longitude": node.longitude}
             for node in self.route
         ]
         return {"route": route, "distance": self.distance}
 
+    def to_polyline(self, precision: int = polyline.PRECISION) -> str:
+        """
+        Route as an encoded polyline, reused without decoding when already encoded
+        """
+        if self.encoded is not None and self.encoded[1] == precision:
+            return self.encoded[0]
+        return polyline.encode(self.route, precision)
+
+    def to_storage_dict(self) -> dict:
+        """
+        Compact form saved in user documents, see from_data
+        """
+        return {
+            "polyline": self.to_polyline(polyline.STORAGE_PRECISION),
+            "precision": polyline.STORAGE_PRECISION,
+            "distance": self.distance,
+        }
+
+    @classmethod
+    def from_polyline(cls, string: str, distance: float, precision: int = polyline.PRECISION):
+        """
+        Route that keeps its polyline and only decodes points when they are used
+        """
+        route = cls(None, distance)
+        route.encoded = (string, precision)
+        return route
+
     @classmethod
     def from_data(cls, data):
         """
         Jason Yu
         Class method that takes array of location objects and distance
+        Routes saved by to_storage_dict are loaded from their polyline
         """
-        running_route = data['route']
         distance = data['distance']
+        if "polyline" in data:
+            return cls.from_polyline(data["polyline"], distance, data["precision"])
+        running_route = data['route']
         route = [Point(node_json['latitude'], node_json['longitude']) for node_json in running_route]
         return cls(route, distance)
 
     @classmethod
-    def from_real_time_data(cls, route, distance):
+    def from_real_time_data(cls, route, distance, precision: int = polyline.PRECISION):
         """
         Jason Yu
         Class method that takes array of location objects and distance
+        The route can also be sent as an encoded polyline string
         """
+        if isinstance(route, str):
+            return cls.from_polyline(route, distance, precision)
         running_route = [Point(node_json['latitude'], node_json['longitude']) for node_json in route]
         return cls(running_route, distance)
 
@@ -312,6 +395,19 @@ class Route:
         point2 = Point(latitude + lat_unit, longitude + lon_unit)
         return [point1, point2]
 
+    @classmethod
+    def loop_bounding_box(cls, location: Point, distance: float) -> list:
+        """
+        Square around a point that any loop of a distance from it stays inside
+        """
+        south_west, north_east = cls.rectangle_bounding_box(location, distance, distance)
+        return [
+            south_west,
+            Point(south_west.latitude, north_east.longitude),
+            north_east,
+            Point(north_east.latitude, south_west.longitude),
+        ]
+
     @classmethod
     def two_point_bounding_box(cls, location: Point, other: Point) -> str:
         """
@@ -412,104 +508,232 @@ class Route:
 
     @classmethod
     def generate_route(
-        cls, nodes: dict, ways: dict, start_id: int, end_id: int
+        cls,
+        nodes: dict,
+        ways: dict,
+        start_id: int,
+        end_id: int,
+        neighbours: dict = None,
+        stats: dict = None,
     ) -> Route:
         """
         Generates the shortest route to a destination
-        Uses A* with euclidean distance as heuristic
+        Uses A* with edge lengths in metres as costs and straight line distance as heuristic,
+        both measured on a plane scaled by the coordinate units at the start
         Uses tags to change cost of moving to nodes
+        Frontier is a binary heap with lazy deletion, paths are kept as parent pointers
+        Neighbours from find_neighbours can be passed in when routing many legs over the same ways
+        Settled nodes are recorded in stats["expansions"] when stats is given
         Jason Yu
         """
-        # Set up constants, sets and distance units
-        unvisited, visited = set(node_id for node_id in nodes), set()
-        path_dict = dict((node, {"cost": inf, "path": [node]}) for node in nodes)
-        neighbours = cls.find_neighbours(ways)
-        path_dict[start_id] = {"cost": 0, "path": [start_id]}
-        vert_unit, hor_unit = cls.get_coordinate_units(nodes[start_id])
-        end_point = nodes[end_id]
-
         # Verify whether route can be completed
+        if neighbours is None:
+            neighbours = cls.find_neighbours(ways)
         if end_id not in nodes:
             raise Exception("End node not in node space. Specify a valid node.")
         elif start_id not in nodes:
             raise Exception("Start node not in node space. Specify a valid node.")
         elif end_id not in neighbours or start_id not in neighbours:
             raise Exception("No connecting neighbour")
-        else:
-            current = start_id
-
-        while current != end_id:
-            # Gets next node, if initial node has been visited
-            if start_id in visited:
-                unvisited_node_costs = dict()
-                for node_id in unvisited:
-                    current_cost = path_dict[node_id]["cost"]
-                    heuristic_cost = current_cost + end_point.heuristic_distance(
-                        nodes[node_id], vert_unit, hor_unit
-                    )
-                    unvisited_node_costs[node_id] = heuristic_cost
-                next_node, cost = min(
-                    unvisited_node_costs.items(), key=lambda item: item[1]
-                )
-                if cost == inf:
-                    raise Exception("End node cannot be reached")
-                else:
-                    current = next_node
 
-            # Update Neighbours and then mark current as visited
+        # Set up constants, heap and distance units
+        vert_unit, hor_unit = cls.get_coordinate_units(nodes[start_id])
+        end_point = nodes[end_id]
+        costs = {start_id: 0}
+        parents = {start_id: None}
+        visited = set()
+        counter = count()  # Tie breaker so heap never compares node ids
+        frontier = [(0, next(counter), start_id)]
+
+        while frontier:
+            _, _, current = heappop(frontier)
+            if current in visited:
+                continue  # Stale heap entry, node already settled with lower cost
+            if current == end_id:
+                break
+            visited.add(current)
+
+            # Update Neighbours
             current_point = nodes[current]
-            current_cost, current_path = path_dict[current].values()
-            for neighbour in neighbours[current] & unvisited:
-                neighbour_cost = path_dict[neighbour]["cost"]
+            current_cost = costs[current]
+            for neighbour in neighbours[current]:
+                if neighbour in visited or neighbour not in nodes:
+                    continue
                 neighbour_node = nodes[neighbour]
-                heuristic_cost = (
+                edge_cost = (
                     neighbour_node.tag_multiplier
                     * current_point.heuristic_distance(
-                        neighbour_node, vert_unit, hor_unit
+                        neighbour_node, hor_unit, vert_unit
                     )
                 )
-                new_cost = heuristic_cost + current_cost
-                if new_cost < neighbour_cost:
-                    path_dict[neighbour]["cost"] = new_cost
-                    path_dict[neighbour]["path"] = current_path + [neighbour]
-            unvisited.remove(current)
-            visited.add(current)
-
-        # Retrieve route, calculate actual distance
-        heuristic_cost, fastest_route = path_dict[end_id].values()
+                new_cost = edge_cost + current_cost
+                if new_cost < costs.get(neighbour, inf):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = current
+                    estimate = new_cost + end_point.heuristic_distance(
+                        neighbour_node, hor_unit, vert_unit
+                    )
+                    heappush(frontier, (estimate, next(counter), neighbour))
+        else:
+            raise Exception("End node cannot be reached")
+        if stats is not None:
+            stats["expansions"] = len(visited)
+
+        # Retrieve route by walking parents back from the end, calculate actual distance
+        fastest_route = []
+        node_id = end_id
+        while node_id is not None:
+            fastest_route.append(node_id)
+            node_id = parents[node_id]
+        fastest_route.reverse()
         route = [nodes[node_id] for node_id in fastest_route]
         actual_distance = cls.get_route_distance(route)
         return cls(route, actual_distance)
 
     @classmethod
     def generate_multi_route(
-        cls, nodes: dict, ways: dict, node_waypoint_ids: list
+        cls, nodes: dict, ways: dict, node_waypoint_ids: list, stats: dict = None
     ) -> Route:
         """
         Generate route that passes through all way points in order
+        Expansions of every leg are summed into stats when stats is given
         Jason Yu
         """
+        neighbours = cls.find_neighbours(ways)  # Shared by every leg
         start = node_waypoint_ids[0]
         start_point = nodes[start]
         multi_distance = 0
         multi_route = [start_point]
         pairs = zip(node_waypoint_ids[:-1], node_waypoint_ids[1:])
         for current_node, next_node in pairs:
-            route = cls.generate_route(nodes, ways, current_node, next_node)
+            leg_stats = {}
+            route = cls.generate_route(
+                nodes, ways, current_node, next_node, neighbours, leg_stats
+            )
+            if stats is not None:
+                stats["expansions"] = stats.get("expansions", 0) + leg_stats["expansions"]
             multi_distance += route.distance
             multi_route += route.route[1:]
         return cls(multi_route, multi_distance)
 
+    @classmethod
+    def generate_graph_route(
+        cls,
+        graph,
+        start_id: int,
+        end_id: int,
+        search: str = "auto",
+        stats: dict = None,
+        space=None,
+        simplify: bool = False,
+        profile: RouteProfile = None,
+    ) -> Route:
+        """
+        Generates the shortest route to a destination on a prebuilt RoadGraph
+        Search is "astar", "bidirectional", "hierarchy" or "auto", which queries the graph's
+        contraction hierarchy when one is loaded and otherwise searches bidirectionally
+        once the endpoints are further apart than BIDIRECTIONAL_DISTANCE
+        A* runs on the scratch arrays of a SearchSpace when one is given
+        With simplify the search runs on RoadGraph.simplify around the endpoints,
+        which is worth it for graphs built for a single request
+        With a profile the search follows its weights, the distance is still in metres
+        """
+        start, end = graph.index_of(start_id), graph.index_of(end_id)
+        if not graph.on_way(start) or not graph.on_way(end):
+            raise Exception("No connecting neighbour")
+        if profile is not None:
+            graph = graph.with_profile(profile)
+        if simplify:
+            with metrics.span("route.simplify"):
+                graph = graph.simplify([start, end])
+            start, end = graph.index_of(start_id), graph.index_of(end_id)
+        if search == "auto" and graph.hierarchy is not None:
+            search = "hierarchy"
+        elif search == "auto":
+            distance = graph.node(start) - graph.node(end)
+            search = "bidirectional" if distance > cls.BIDIRECTIONAL_DISTANCE else "astar"
+        with metrics.span(f"route.search.{search}"):
+            if search == "hierarchy":
+                if graph.hierarchy is None:
+                    raise Exception("No contraction hierarchy is loaded for this region.")
+                path, distance = graph.hierarchy.query(start, end, stats)
+            elif search == "bidirectional":
+                path, distance = graph.bidirectional_astar(start, end, stats)
+            elif search == "astar" and space is not None:
+                path, distance = space.astar(start, end, stats)
+            elif search == "astar":
+                path, distance = graph.astar(start, end, stats)
+            else:
+                raise Exception(f"Unknown search {search}.")
+        if graph.weights is not graph.lengths:
+            distance = graph.path_length(path)  # Search cost was in profile weights
+        return cls(graph.route_nodes(path), distance)
+
+    @classmethod
+    def generate_graph_multi_route(
+        cls,
+        graph,
+        node_waypoint_ids: list,
+        search: str = "auto",
+        simplify: bool = False,
+        profile: RouteProfile = None,
+        stats: dict = None,
+    ) -> Route:
+        """
+        Generate route that passes through all way points in order on a prebuilt RoadGraph
+        Every A* leg reuses one SearchSpace, so legs do not reallocate search state
+        With simplify every leg runs on one RoadGraph.simplify around all the waypoints
+        Expansions of every leg are summed into stats when stats is given
+        """
+        if profile is not None:
+            graph = graph.with_profile(profile)
+        if simplify:
+            with metrics.span("route.simplify"):
+                graph = graph.simplify(
+                    [graph.index_of(node_id) for node_id in node_waypoint_ids]
+                )
+        uses_astar = search == "astar" or (search == "auto" and graph.hierarchy is None)
+        space = graph.search_space() if uses_astar else None
+        multi_distance = 0
+        multi_route = [graph.node(graph.index_of(node_waypoint_ids[0]))]
+        pairs = zip(node_waypoint_ids[:-1], node_waypoint_ids[1:])
+        for current_node, next_node in pairs:
+            leg_stats = {}
+            route = cls.generate_graph_route(
+                graph, current_node, next_node, search, leg_stats, space
+            )
+            if stats is not None:
+                stats["expansions"] = stats.get("expansions", 0) + leg_stats.get("expansions", 0)
+            multi_distance += route.distance
+            multi_route += route.route[1:]
+        return cls(multi_route, multi_distance)
+
+    @classmethod
+    def generate_graph_loop(
+        cls, graph, start_id: int, distance: float, stats: dict = None, simplify: bool = False
+    ) -> Route:
+        """
+        Generates a loop of roughly distance metres that starts and ends at a node
+        With simplify the loop is searched on RoadGraph.simplify around the start
+        """
+        start = graph.index_of(start_id)
+        if not graph.on_way(start):
+            raise Exception("No connecting neighbour")
+        if simplify:
+            with metrics.span("route.simplify"):
+                graph = graph.simplify([start])
+            start = graph.index_of(start_id)
+        with metrics.span("route.search.loop"):
+            path, length = graph.loop(start, distance, stats)
+        return cls(graph.route_nodes(path), length)
+
     @staticmethod
     def get_route_distance(fastest_route_nodes: list) -> float:
         """
         Find route distance from route nodes
         Jason Yu
         """
-        return sum(
-            fastest_route_nodes[index] - fastest_route_nodes[index + 1]
-            for index in range(len(fastest_route_nodes) - 1)
-        )
+        return track_distance(fastest_route_nodes)
 
     @staticmethod
     def find_neighbours(ways: dict) -> dict:
@@ -543,19 +767,26 @@ class Route:
 
     @staticmethod
     def transform_json_nodes_and_ways(
-        nodes_json: dict, ways_json: dict, profile: dict = {}
+        nodes_json: dict, ways_json: dict, profile: RouteProfile = None
     ):
         """
         Convert node and way data to objects
-        Update node tags and multipliers
+        Update node multipliers from the highway of their ways, the cheapest way through
+        a node wins, without copying way tags into nodes
         Jason Yu
         """
         nodes = Node.json_to_nodes(nodes_json)
         ways = Way.json_to_ways(ways_json)
+        if profile is None or profile.uniform:
+            return nodes, ways  # Every multiplier is 1
+        multipliers = {}
         for way in ways.values():
-            way.update_node_tags(nodes)
-        for node in nodes.values():
-            node.get_tag_multiplier(profile)
+            multiplier = profile.multiplier(way.tags)
+            for node_id in way.node_ids:
+                multipliers[node_id] = min(multiplier, multipliers.get(node_id, inf))
+        for node_id, multiplier in multipliers.items():
+            if node_id in nodes:
+                nodes[node_id].tag_multiplier = multiplier
         return nodes, ways
 
     @staticmethod
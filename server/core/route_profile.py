@@ -0,0 +1,99 @@
+from __future__ import annotations
+import json
+import os
+
+import numpy as np
+
+PROFILE_DIRECTORY = os.path.join(os.path.dirname(__file__), "route_profiles")
+
+# Highway values a road graph stores per edge as a uint8 code, 0 for anything else
+HIGHWAY_TYPES = (
+    "",
+    "motorway",
+    "motorway_link",
+    "trunk",
+    "trunk_link",
+    "primary",
+    "primary_link",
+    "secondary",
+    "secondary_link",
+    "tertiary",
+    "tertiary_link",
+    "unclassified",
+    "residential",
+    "living_street",
+    "service",
+    "pedestrian",
+    "track",
+    "road",
+    "footway",
+    "path",
+    "cycleway",
+    "bridleway",
+    "steps",
+    "corridor",
+)
+HIGHWAY_CODES = dict((highway, code) for code, highway in enumerate(HIGHWAY_TYPES))
+
+
+def highway_code(tags: dict) -> int:
+    return HIGHWAY_CODES.get(tags.get("highway"), 0)
+
+
+class RouteProfile:
+    """
+    Cost profile from route_profiles compiled into a multiplier per highway code
+    Edge weights are edge lengths times the multiplier of their highway, a single array
+    lookup per edge. Multipliers are scaled so the smallest is 1, no road then costs less
+    than its length and the straight line heuristic of every search stays admissible.
+    Only the highway table of a profile is compiled, the other tag tables are not used yet.
+    """
+
+    profiles = {}  # name -> RouteProfile, profiles are loaded once
+
+    def __init__(self, name: str, tags: dict):
+        self.name = name
+        self.tags = tags
+        highways = tags.get("highway", {})
+        multipliers = np.array(
+            [highways.get(highway, 1) for highway in HIGHWAY_TYPES], dtype=np.float32
+        )
+        self.multipliers = multipliers / multipliers.min()
+
+    def __repr__(self):
+        return f"RouteProfile({self.name})"
+
+    @property
+    def uniform(self) -> bool:
+        """
+        Whether every road costs its length, so weights are the same as lengths
+        """
+        return bool((self.multipliers == 1).all())
+
+    @classmethod
+    def names(cls) -> list:
+        return sorted(
+            os.path.splitext(file)[0]
+            for file in os.listdir(PROFILE_DIRECTORY)
+            if file.endswith(".json")
+        )
+
+    @classmethod
+    def load(cls, name: str = "default") -> RouteProfile:
+        profile = cls.profiles.get(name)
+        if profile is None:
+            if name not in cls.names():
+                raise Exception(f"Unknown route profile {name}.")
+            with open(os.path.join(PROFILE_DIRECTORY, f"{name}.json")) as f:
+                profile = cls(name, json.load(f))
+            cls.profiles[name] = profile
+        return profile
+
+    def multiplier(self, tags: dict) -> float:
+        return float(self.multipliers[highway_code(tags)])
+
+    def weights(self, lengths, highways):
+        """
+        Weight of every edge from edge lengths and highway codes
+        """
+        return (lengths * self.multipliers[highways]).astype(np.float32)
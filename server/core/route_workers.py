@@ -0,0 +1,228 @@
+from __future__ import annotations
+import asyncio
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sanic.exceptions import abort
+
+from .route_generation import Route, Point
+from .road_graph import RoadGraph
+from .route_profile import RouteProfile
+from .tile_store import TileStore, parse_region
+
+MAX_WORKER_GRAPHS = 8  # Graphs of recently requested tile sets kept by each worker
+
+# Per process state of a route worker, set up once by init_worker
+worker_store = None
+worker_region = frozenset()
+worker_region_graph = None  # Only built once every tile of the region is on disk
+worker_graphs = OrderedDict()  # frozenset of tiles -> RoadGraph
+
+
+class RouteWorkerPool:
+    """
+    Pool of route worker processes so route searches are not serialised by the GIL
+    Workers keep road graphs resident: the configured region is loaded once at worker start
+    and graphs for other tile sets are kept in a small LRU. Requests only send coordinates
+    and receive compact coordinate arrays back.
+    When more than workers + queue_depth routes are pending new routes are refused.
+    With parallel_legs the legs of a multi waypoint route are spread over the workers.
+    """
+
+    def __init__(
+        self,
+        tile_store_directory: str,
+        workers: int = None,
+        queue_depth: int = 32,
+        region: str = "",
+        parallel_legs: bool = False,
+    ):
+        self.workers = workers or os.cpu_count()
+        self.max_pending = self.workers + queue_depth
+        self.parallel_legs = parallel_legs
+        self.pending = 0
+        self.rejected = 0
+        self.executor = ProcessPoolExecutor(
+            self.workers,
+            initializer=init_worker,
+            initargs=(tile_store_directory, region),
+        )
+
+    async def submit(self, function, *args):
+        """
+        Runs a worker function in the pool, refusing it when the pool is saturated
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            abort(503, "Route workers are busy, try again shortly.")
+        self.pending += 1
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, function, *args)
+        finally:
+            self.pending -= 1
+
+    async def route(
+        self, start: Point, end: Point, search: str = "auto", profile: str = "default"
+    ) -> Route:
+        coordinates, distance = await self.submit(
+            worker_route, tuple(start), tuple(end), search, profile
+        )
+        return route_from_coordinates(coordinates, distance)
+
+    async def multi_route(
+        self, points: list, search: str = "auto", profile: str = "default"
+    ) -> Route:
+        points = [tuple(point) for point in points]
+        legs = len(points) - 1
+        if self.parallel_legs and legs > 1 and self.pending + legs <= self.max_pending:
+            # Legs are independent once the waypoints are snapped, route them concurrently
+            results = await asyncio.gather(
+                *(
+                    self.submit(worker_leg, points, leg, search, profile)
+                    for leg in range(legs)
+                )
+            )
+            coordinates = np.concatenate(
+                [results[0][0]] + [leg_coordinates[1:] for leg_coordinates, _ in results[1:]]
+            )
+            distance = sum(leg_distance for _, leg_distance in results)
+        else:
+            coordinates, distance = await self.submit(
+                worker_multi_route, points, search, profile
+            )
+        return route_from_coordinates(coordinates, distance)
+
+    async def loop(self, start: Point, distance: float) -> Route:
+        coordinates, distance = await self.submit(worker_loop, tuple(start), distance)
+        return route_from_coordinates(coordinates, distance)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+
+def route_from_coordinates(coordinates, distance: float) -> Route:
+    """
+    Generates a Route from an (n, 2) array of latitude/longitude rows
+    """
+    route = [Point(latitude, longitude) for latitude, longitude in coordinates.tolist()]
+    return Route(route, distance)
+
+
+def init_worker(tile_store_directory: str, region: str):
+    """
+    Runs once in every worker process, loads the resident region graph if it has been ingested
+    """
+    global worker_store, worker_region, worker_region_graph
+    worker_store = TileStore(tile_store_directory)
+    worker_region_graph = None
+    if region:
+        worker_region = frozenset(worker_store.tiles_for_polygon(parse_region(region)))
+        resident_graph()
+
+
+def resident_graph():
+    """
+    The resident region graph, built once the last of its tiles has been ingested
+    Missing tiles would read as empty, so a graph of a partly ingested region is never kept.
+    """
+    global worker_region_graph
+    if worker_region_graph is None and worker_region:
+        if not worker_store.missing_tiles(worker_region):
+            worker_region_graph = worker_store.load_graph(worker_region)
+    return worker_region_graph
+
+
+def worker_graph(points: list) -> RoadGraph:
+    """
+    Graph covering a polygon, the resident region graph is used when it covers all tiles
+    Requests only reach workers once api.py has ingested their tiles, so until the whole
+    region is ingested they are served from graphs of their own tiles.
+    """
+    tiles = frozenset(worker_store.tiles_for_polygon(points))
+    if tiles <= worker_region and resident_graph() is not None:
+        return worker_region_graph
+    graph = worker_graphs.get(tiles)
+    if graph is None:
+        graph = worker_store.load_graph(tiles)
+        worker_graphs[tiles] = graph
+        while len(worker_graphs) > MAX_WORKER_GRAPHS:
+            worker_graphs.popitem(last=False)
+    else:
+        worker_graphs.move_to_end(tiles)
+    return graph
+
+
+def route_coordinates(route: Route) -> tuple:
+    """
+    Compact form of a route sent back from a worker, an (n, 2) coordinate array and distance
+    """
+    coordinates = np.array([(node.latitude, node.longitude) for node in route.route])
+    return coordinates, route.distance
+
+
+def worker_route(start: tuple, end: tuple, search: str, profile: str) -> tuple:
+    """
+    Generates a route between two coordinates inside a worker
+    """
+    start, end = Point(*start), Point(*end)
+    graph = worker_graph(Route.two_point_bounding_box(start, end))
+    start_id = int(graph.ids[graph.closest_index(start)])
+    end_id = int(graph.ids[graph.closest_index(end)])
+    return route_coordinates(
+        Route.generate_graph_route(
+            graph, start_id, end_id, search, profile=RouteProfile.load(profile)
+        )
+    )
+
+
+def worker_leg(points: list, leg: int, search: str, profile: str) -> tuple:
+    """
+    Generates one leg of a waypoint route inside a worker
+    Every leg loads the graph of the whole route, so waypoints snap to the same nodes in
+    each worker and consecutive legs join up
+    """
+    points = [Point(*point) for point in points]
+    graph = worker_graph(Route.convex_hull(points))
+    start_id = int(graph.ids[graph.closest_index(points[leg])])
+    end_id = int(graph.ids[graph.closest_index(points[leg + 1])])
+    return route_coordinates(
+        Route.generate_graph_route(
+            graph, start_id, end_id, search, profile=RouteProfile.load(profile)
+        )
+    )
+
+
+def worker_multi_route(points: list, search: str, profile: str) -> tuple:
+    """
+    Generates a route through waypoint coordinates inside a worker
+    """
+    points = [Point(*point) for point in points]
+    graph = worker_graph(Route.convex_hull(points))
+    waypoint_ids = [int(graph.ids[graph.closest_index(point)]) for point in points]
+    return route_coordinates(
+        Route.generate_graph_multi_route(
+            graph, waypoint_ids, search, profile=RouteProfile.load(profile)
+        )
+    )
+
+
+def worker_loop(start: tuple, distance: float) -> tuple:
+    """
+    Generates a loop of roughly distance metres from a coordinate inside a worker
+    """
+    start = Point(*start)
+    graph = worker_graph(Route.loop_bounding_box(start, distance))
+    start_id = int(graph.ids[graph.closest_index(start)])
+    return route_coordinates(Route.generate_graph_loop(graph, start_id, distance))
@@ -0,0 +1,263 @@
+import copy
+import time
+
+from .route import Run, SavedRun
+from .utils import snowflake, parse_snowflake
+from .metrics import metrics
+from .track import Track
+from .track_filter import simplify
+
+
+class RunStore:
+    """
+    Runs and saved runs in their own collections, one document per run
+    Documents hold the owner's user_id and the run's start_time, indexed together so a page
+    of a user's history is an index range scan no matter how many runs they have.
+    Runs are stored with a simplified track, their full resolution track is kept in run_tracks.
+    """
+
+    PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    INDEX = [("user_id", 1), ("start_time", -1), ("_id", -1)]
+
+    TRACK_TOLERANCE = 2.0  # Metres the simplified track may stray from the full one
+    TRACK_STATIONARY_RADIUS = 3.0  # Metres a runner stays within to be stopped
+    TRACK_INTERVAL = 1.0  # Seconds between packets of the simplified track
+
+    def __init__(
+        self,
+        db,
+        track_tolerance: float = TRACK_TOLERANCE,
+        track_stationary_radius: float = TRACK_STATIONARY_RADIUS,
+        track_interval: float = TRACK_INTERVAL,
+    ):
+        self.db = db
+        self.track_tolerance = track_tolerance
+        self.track_stationary_radius = track_stationary_radius
+        self.track_interval = track_interval
+
+    async def setup_indexes(self):
+        for collection in (self.db.runs, self.db.saved_runs):
+            index_info = await collection.index_information()
+            if "user_id_1_start_time_-1__id_-1" not in index_info:
+                await collection.create_index(self.INDEX)
+
+    async def add_run(self, user_id, run, start_time=None):
+        """
+        Adds a run to the history of a user, returns its id
+        """
+        run_id = str(snowflake())
+        simplified = await self.simplify(run_id, user_id, run)
+        document = run_document(run_id, user_id, simplified, start_time)
+        with metrics.span("mongo.RunStore.add_run"):
+            await self.db.runs.insert_one(document)
+        return document["_id"]
+
+    async def add_saved_run(self, user_id, saved_run, start_time=None):
+        simplified = await self.simplify(saved_run.id, user_id, saved_run)
+        document = run_document(saved_run.id, user_id, simplified, start_time)
+        with metrics.span("mongo.RunStore.add_saved_run"):
+            await self.db.saved_runs.insert_one(document)
+        return document["_id"]
+
+    async def simplify(self, run_id, user_id, run):
+        """
+        Copy of a run with a simplified track, storing the full track when anything was dropped
+        """
+        track = run.to_track()
+        with metrics.span("runs.simplify"):
+            simplified = simplify(
+                track, self.track_tolerance, self.track_stationary_radius, self.track_interval
+            )
+        if len(simplified) == len(track):
+            return run
+        with metrics.span("mongo.RunStore.add_track"):
+            await self.db.run_tracks.insert_one(
+                {"_id": run_id, "user_id": user_id, "track": track.encode()}
+            )
+        run = copy.copy(run)
+        run.location_packets = simplified
+        return run
+
+    async def full_track(self, run_id, user_id):
+        """
+        Full resolution track of a run or saved run, None when the user has no such run
+        """
+        with metrics.span("mongo.RunStore.full_track"):
+            document = await self.db.run_tracks.find_one({"_id": run_id, "user_id": user_id})
+            for collection in (self.db.runs, self.db.saved_runs):
+                if document:
+                    break
+                # Nothing was dropped from the run, so its stored track is the full one
+                document = await collection.find_one(
+                    {"_id": run_id, "user_id": user_id}, {"track": 1}
+                )
+        if not document or "track" not in document:
+            return None
+        return Track.from_bytes(document["track"])
+
+    async def get_saved_run(self, run_id, user_id=None):
+        """
+        A saved run by id, None when it does not exist or is not owned by user_id
+        """
+        query = {"_id": run_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        with metrics.span("mongo.RunStore.get_saved_run"):
+            document = await self.db.saved_runs.find_one(query)
+        return saved_run_from_document(document) if document else None
+
+    async def update_saved_run(self, run_id, user_id, update: dict) -> bool:
+        """
+        Applies a mongo update to a saved run of a user, eg likes and comments
+        """
+        with metrics.span("mongo.RunStore.update_saved_run"):
+            result = await self.db.saved_runs.update_one(
+                {"_id": run_id, "user_id": user_id}, update
+            )
+        return result.matched_count > 0
+
+    async def runs_page(self, user_id, cursor: str = None, limit: int = PAGE_SIZE):
+        """
+        Newest runs of a user from a cursor, returns the runs and the cursor of the next page
+        """
+        documents, next_cursor = await self.page(self.db.runs, user_id, cursor, limit)
+        return [run_from_document(document) for document in documents], next_cursor
+
+    async def saved_runs_page(self, user_id, cursor: str = None, limit: int = PAGE_SIZE):
+        documents, next_cursor = await self.page(self.db.saved_runs, user_id, cursor, limit)
+        return [saved_run_from_document(document) for document in documents], next_cursor
+
+    async def page(self, collection, user_id, cursor, limit):
+        """
+        Keyset pagination over (start_time, _id) descending
+        The cursor is the key of the last document returned, so pages never skip or repeat
+        runs added while paging and the database never walks over earlier pages.
+        """
+        limit = max(1, min(int(limit), self.MAX_PAGE_SIZE))
+        query = {"user_id": user_id}
+        if cursor:
+            start_time, run_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"start_time": {"$lt": start_time}},
+                {"start_time": start_time, "_id": {"$lt": run_id}},
+            ]
+        with metrics.span(f"mongo.RunStore.page.{collection.name}"):
+            documents = await collection.find(query).sort(
+                [("start_time", -1), ("_id", -1)]
+            ).limit(limit + 1).to_list(limit + 1)
+        if len(documents) <= limit:
+            return documents, None
+        documents = documents[:limit]
+        return documents, encode_cursor(documents[-1])
+
+    async def delete_user(self, user_id):
+        with metrics.span("mongo.RunStore.delete_user"):
+            await self.db.runs.delete_many({"user_id": user_id})
+            await self.db.saved_runs.delete_many({"user_id": user_id})
+            await self.db.run_tracks.delete_many({"user_id": user_id})
+
+
+def run_document(run_id, user_id, run, start_time=None) -> dict:
+    document = run.to_storage_dict()
+    document.pop("id", None)  # Saved runs keep their id as _id
+    document["_id"] = run_id
+    document["user_id"] = user_id
+    document["start_time"] = time.time() if start_time is None else start_time
+    return document
+
+
+def run_from_document(document: dict) -> Run:
+    return Run.from_data(document)
+
+
+def saved_run_from_document(document: dict) -> SavedRun:
+    data = dict(
+        (key, value)
+        for key, value in document.items()
+        if key not in ("_id", "user_id", "start_time")
+    )
+    data["id"] = document["_id"]
+    return SavedRun.from_data(data)
+
+
+def encode_cursor(document: dict) -> str:
+    return f"{document['start_time']!r}:{document['_id']}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        start_time, run_id = cursor.split(":", 1)
+        return float(start_time), run_id
+    except ValueError:
+        raise Exception("Invalid page cursor.")
+
+
+def id_time(snowflake_id, default: float = 0.0) -> float:
+    """
+    Creation time of a snowflake id
+    """
+    try:
+        return parse_snowflake(int(snowflake_id))[0]
+    except ValueError:
+        return default
+
+
+async def migrate(db, dry_run: bool = False) -> dict:
+    """
+    Moves runs and saved runs embedded in user documents into their own collections
+    Old runs have no start time, so they are given their user's creation time plus their
+    position in the history, which keeps their order and places them before new runs.
+    Ids are deterministic and documents are upserted, so an interrupted migration can be rerun.
+    """
+    store = RunStore(db)
+    if not dry_run:
+        await store.setup_indexes()
+    counts = {"users": 0, "runs": 0, "saved_runs": 0}
+    query = {"$or": [{"runs": {"$exists": True}}, {"saved_runs": {"$exists": True}}]}
+    async for user in db.users.find(query, {"runs": 1, "saved_runs": 1}):
+        user_id = user["_id"]
+        created = id_time(user_id)
+        runs = [
+            run_document(f"{user_id}-{index}", user_id, Run.from_data(data), created + index / 1000)
+            for index, data in enumerate(user.get("runs") or [])
+        ]
+        saved_runs = [
+            run_document(
+                run_id, user_id, SavedRun.from_data(data), id_time(run_id, created)
+            )
+            for run_id, data in (user.get("saved_runs") or {}).items()
+        ]
+        counts["users"] += 1
+        counts["runs"] += len(runs)
+        counts["saved_runs"] += len(saved_runs)
+        if dry_run:
+            continue
+        for document in runs:
+            await db.runs.replace_one({"_id": document["_id"]}, document, upsert=True)
+        for document in saved_runs:
+            await db.saved_runs.replace_one({"_id": document["_id"]}, document, upsert=True)
+        await db.users.update_one({"_id": user_id}, {"$unset": {"runs": "", "saved_runs": ""}})
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(
+        description="Move runs embedded in user documents into the runs collections"
+    )
+    parser.add_argument("mongo_uri", help="Database to migrate, eg mongodb://localhost")
+    parser.add_argument("--database", default="majorproject")
+    parser.add_argument("--dry-run", action="store_true", help="Count runs without moving them")
+    args = parser.parse_args()
+
+    db = AsyncIOMotorClient(args.mongo_uri)[args.database]
+    counts = asyncio.get_event_loop().run_until_complete(migrate(db, args.dry_run))
+    print(
+        f"{'Would move' if args.dry_run else 'Moved'} {counts['runs']} runs and "
+        f"{counts['saved_runs']} saved runs of {counts['users']} users"
+    )
@@ -0,0 +1,113 @@
+from __future__ import annotations
+from math import cos, radians, floor
+
+import numpy as np
+
+from .route_generation import Point
+from .geodesy import EARTH_RADIUS
+
+METRES_PER_DEGREE = radians(1) * EARTH_RADIUS
+
+
+class GridIndex:
+    """
+    Grid bucket index for nearest node lookups
+    Coordinates are projected onto a local plane (equirectangular about the centre of the data)
+    and bucketed into square cells, members of a cell are contiguous in one array
+    """
+
+    def __init__(self, latitudes, longitudes, keys=None, cell_size: float = 100):
+        self.keys = keys  # Key returned for each position, defaults to the position itself
+        self.cell_size = cell_size  # Cell side in metres
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if len(latitudes):
+            self.origin = (float(latitudes.min()), float(longitudes.min()))
+            centre_latitude = (float(latitudes.min()) + float(latitudes.max())) / 2
+        else:
+            self.origin = (0.0, 0.0)
+            centre_latitude = 0.0
+        self.lon_scale = METRES_PER_DEGREE * cos(radians(centre_latitude))
+        self.x = (longitudes - self.origin[1]) * self.lon_scale
+        self.y = (latitudes - self.origin[0]) * METRES_PER_DEGREE
+
+        # Bucket positions by cell, cells are looked up by (row, column)
+        rows = (self.y // cell_size).astype(np.int64)
+        columns = (self.x // cell_size).astype(np.int64)
+        self.rows = int(rows.max()) + 1 if len(rows) else 0
+        self.columns = int(columns.max()) + 1 if len(columns) else 0
+        cell_keys = rows * max(self.columns, 1) + columns
+        self.members = np.argsort(cell_keys, kind="stable").astype(np.int32)
+        sorted_keys = cell_keys[self.members]
+        unique_keys, starts, counts = np.unique(
+            sorted_keys, return_index=True, return_counts=True
+        )
+        self.cells = dict(
+            zip(unique_keys.tolist(), zip(starts.tolist(), (starts + counts).tolist()))
+        )
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def from_nodes(cls, nodes: dict, cell_size: float = 100) -> GridIndex:
+        """
+        Generates an index over a dict of nodes, which is keyed by node id
+        """
+        keys = list(nodes)
+        latitudes = [nodes[key].latitude for key in keys]
+        longitudes = [nodes[key].longitude for key in keys]
+        return cls(latitudes, longitudes, keys, cell_size)
+
+    def ring(self, row: int, column: int, radius: int) -> list:
+        """
+        Positions in cells on the square ring of a radius around a cell
+        """
+        positions = []
+        for ring_row in range(max(row - radius, 0), min(row + radius, self.rows - 1) + 1):
+            if abs(ring_row - row) == radius:
+                ring_columns = range(column - radius, column + radius + 1)
+            else:
+                ring_columns = (column - radius, column + radius)
+            for ring_column in ring_columns:
+                if 0 <= ring_column < self.columns:
+                    cell = self.cells.get(ring_row * self.columns + ring_column)
+                    if cell:
+                        positions.append(self.members[cell[0]:cell[1]])
+        return positions
+
+    def nearest(self, point: Point, k: int = 1, predicate=None) -> list:
+        """
+        Returns keys of the k closest positions to a point, closest first
+        Predicate takes a key and filters which positions may be returned
+        Rings of cells are searched outward until no unsearched cell can hold a closer position
+        """
+        x = (point.longitude - self.origin[1]) * self.lon_scale
+        y = (point.latitude - self.origin[0]) * METRES_PER_DEGREE
+        row, column = floor(y / self.cell_size), floor(x / self.cell_size)
+        max_radius = max(
+            abs(row), abs(row - self.rows + 1), abs(column), abs(column - self.columns + 1)
+        )
+        best = []  # (distance, key), sorted
+        for radius in range(max_radius + 1):
+            # Everything outside the searched square is at least this far away
+            if len(best) == k and best[-1][0] <= radius * self.cell_size - self.cell_size:
+                break
+            positions = self.ring(row, column, radius)
+            if not positions:
+                continue
+            positions = np.concatenate(positions)
+            distances = np.hypot(self.x[positions] - x, self.y[positions] - y)
+            order = np.argsort(distances)
+            for distance, position in zip(
+                distances[order].tolist(), positions[order].tolist()
+            ):
+                if len(best) == k and distance >= best[-1][0]:
+                    break
+                key = self.keys[position] if self.keys is not None else position
+                if predicate is not None and not predicate(key):
+                    continue
+                best.append((distance, key))
+                best.sort()
+                del best[k:]
+        return [key for distance, key in best]
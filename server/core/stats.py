@@ -4,6 +4,8 @@ from sanic import Blueprint, response
 from sanic.exceptions import abort
 import jwt
 
+from .metrics import metrics
+
 
 def authrequired(func):
     """
@@ -76,3 +78,25 @@ async def post_login(request):
 async def show_stats(request, user):
     print(user.followers)
     return request.app.render_template("stats", stats=user.stats.to_dict(), user=user)
+
+
+@stats.get("/metrics")
+async def show_metrics(request):
+    """
+    Timing histograms of instrumented spans and cache gauges,
+    as json or in the Prometheus text format with ?format=prometheus
+    """
+    cache = request.app.route_cache
+    gauges = {
+        "route_cache_entries": len(cache),
+        "route_cache_bytes": cache.bytes,
+        "route_cache_hits": cache.hits,
+        "route_cache_misses": cache.misses,
+        "route_cache_evictions": cache.evictions,
+    }
+    gauges.update(
+        (f"user_cache_{name}", value) for name, value in request.app.users.user_cache.stats.items()
+    )
+    if request.args.get("format") == "prometheus":
+        return response.text(metrics.prometheus(gauges))
+    return response.json({"spans": metrics.to_dict(), "gauges": gauges})
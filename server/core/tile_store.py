@@ -0,0 +1,328 @@
+from __future__ import annotations
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from math import floor
+
+from .route_generation import Point
+from .road_graph import RoadGraph, RoadGraphBuilder
+from .misc import Overpass
+from .metrics import metrics
+
+
+class TileStore:
+    """
+    On-disk store of OSM highway data split into fixed size lat/lon tiles
+    Each tile file holds every way with a node inside the tile plus all nodes of those ways,
+    so any set of tiles loads as a self contained node/way list.
+    Tiles that have not been ingested are fetched from Overpass by bounding box and written back.
+    Concurrent requests for the same missing tiles share one fetch.
+    """
+
+    TILE_SIZE = 0.01  # Degrees, roughly 1.1km of latitude
+    INGEST_BATCH = 5000  # Streamed elements split into tiles per executor call
+
+    def __init__(
+        self, directory: str, fetch=None, tile_size: float = TILE_SIZE, stream=None
+    ):
+        self.directory = directory
+        self.fetch = fetch  # Coroutine taking an Overpass url, returns the decoded json
+        self.stream = stream  # Async generator taking an Overpass url, yields compact elements
+        self.tile_size = tile_size
+        self.fetching = {}  # tile -> future of the fetch in flight that covers it
+        self.lock = threading.Lock()  # Ingests read, merge and write tiles in executor threads
+        os.makedirs(directory, exist_ok=True)
+
+    def tile_of(self, latitude: float, longitude: float) -> tuple:
+        return floor(latitude / self.tile_size), floor(longitude / self.tile_size)
+
+    def tile_bounds(self, tile: tuple) -> tuple:
+        """
+        Returns (south, west, north, east) of a tile
+        """
+        row, column = tile
+        return (
+            row * self.tile_size,
+            column * self.tile_size,
+            (row + 1) * self.tile_size,
+            (column + 1) * self.tile_size,
+        )
+
+    def tiles_bounds(self, tiles) -> tuple:
+        """
+        Returns (south, west, north, east) covering a set of tiles
+        """
+        bounds = [self.tile_bounds(tile) for tile in tiles]
+        return (
+            min(bound[0] for bound in bounds),
+            min(bound[1] for bound in bounds),
+            max(bound[2] for bound in bounds),
+            max(bound[3] for bound in bounds),
+        )
+
+    def tiles_for_polygon(self, points: list) -> set:
+        """
+        Tiles that intersect a polygon, such as Route.two_point_bounding_box or Route.convex_hull
+        A tile is kept if its centre or a corner is inside the polygon or a polygon vertex is inside it
+        """
+        first_row, first_column = self.tile_of(
+            min(point.latitude for point in points), min(point.longitude for point in points)
+        )
+        last_row, last_column = self.tile_of(
+            max(point.latitude for point in points), max(point.longitude for point in points)
+        )
+        vertex_tiles = set(self.tile_of(*point) for point in points)
+        tiles = set()
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                south, west, north, east = self.tile_bounds((row, column))
+                samples = (
+                    ((south + north) / 2, (west + east) / 2),
+                    (south, west),
+                    (south, east),
+                    (north, west),
+                    (north, east),
+                )
+                if (row, column) in vertex_tiles or any(
+                    point_in_polygon(latitude, longitude, points)
+                    for latitude, longitude in samples
+                ):
+                    tiles.add((row, column))
+        return tiles
+
+    def path(self, tile: tuple) -> str:
+        row, column = tile
+        return os.path.join(self.directory, f"{row}_{column}.json")
+
+    def missing_tiles(self, tiles) -> set:
+        return set(tile for tile in tiles if not os.path.exists(self.path(tile)))
+
+    def ingest(self, elements: list, tiles=None):
+        """
+        Splits Overpass elements into tiles and writes them to disk, merging with existing tiles
+        Tiles given explicitly are written even if empty, so areas without roads count as ingested
+        Only highway ways are kept and node tags, which are not used in routing, are dropped
+        """
+        ingest = TileIngest(self, tiles)
+        ingest.add_elements(elements)
+        ingest.finish()
+
+    def read(self, tile: tuple) -> list:
+        try:
+            with open(self.path(tile)) as f:
+                return json.load(f)["elements"]
+        except FileNotFoundError:
+            return []
+
+    def write(self, tile: tuple, elements: list):
+        # Each write has its own temporary file, readers never see a partial tile
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "w") as f:
+                json.dump({"elements": elements}, f)
+            os.replace(temporary_path, self.path(tile))
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def load(self, tiles) -> list:
+        """
+        Loads elements of tiles from disk, removing duplicates shared between tiles
+        """
+        elements = {}
+        for tile in tiles:
+            for element in self.read(tile):
+                elements[(element["type"], element["id"])] = element
+        return list(elements.values())
+
+    def load_graph(self, tiles) -> RoadGraph:
+        """
+        Builds the road graph of tiles, reading one tile at a time into a RoadGraphBuilder
+        """
+        builder = RoadGraphBuilder()
+        build_time = 0.0  # Building is interleaved with reading, its time is summed over tiles
+        for tile in tiles:
+            with metrics.span("tiles.parse"):
+                elements = self.read(tile)
+            time1 = time.perf_counter()
+            builder.add_elements(elements)
+            build_time += time.perf_counter() - time1
+        time1 = time.perf_counter()
+        graph = builder.build()
+        metrics.observe("graph.build", build_time + time.perf_counter() - time1)
+        return graph
+
+    async def fetch_tiles(self, tiles):
+        """
+        Fetches tiles from Overpass by their bounding box and ingests them
+        A stream is preferred, its elements are split into tiles in batches as they arrive,
+        so the response is never held as a whole and ingesting overlaps the download.
+        Tiles are only written once the response has ended, ways can span any of them.
+        """
+        bounding_box = ",".join(str(bound) for bound in self.tiles_bounds(tiles))
+        url = Overpass.BBOX_REQ.format(bounding_box)
+        loop = asyncio.get_event_loop()
+        ingest = TileIngest(self, tiles)
+        with metrics.span("overpass.fetch"):
+            if self.stream is not None:
+                batch = []
+                async for element in self.stream(url):
+                    batch.append(element)
+                    if len(batch) >= self.INGEST_BATCH:
+                        await loop.run_in_executor(
+                            None, metrics.timed, "tiles.ingest", ingest.add_elements, batch
+                        )
+                        batch = []
+                ingest.add_elements(batch)
+            elif self.fetch is not None:
+                elements = (await self.fetch(url))["elements"]
+                await loop.run_in_executor(
+                    None, metrics.timed, "tiles.ingest", ingest.add_elements, elements
+                )
+            else:
+                raise Exception("Region has not been ingested and no Overpass fallback is set.")
+        await loop.run_in_executor(None, metrics.timed, "tiles.ingest", ingest.finish)
+
+    async def ensure_region(self, points: list) -> set:
+        """
+        Makes sure every tile of a polygon is on disk, fetching tiles not yet ingested
+        Returns the tiles of the polygon
+        """
+        tiles = self.tiles_for_polygon(points)
+        missing = self.missing_tiles(tiles)
+        flights = set(self.fetching[tile] for tile in missing if tile in self.fetching)
+        new = set(tile for tile in missing if tile not in self.fetching)
+        if new:
+            future = asyncio.ensure_future(self.fetch_tiles(new))
+            for tile in new:
+                self.fetching[tile] = future
+            future.add_done_callback(lambda done: self.finish_fetch(new, done))
+            flights.add(future)
+        for future in flights:
+            # Shielded, so one waiter being cancelled does not cancel the fetch for the others
+            await asyncio.shield(future)
+        return tiles
+
+    def finish_fetch(self, tiles, future):
+        for tile in tiles:
+            if self.fetching.get(tile) is future:
+                del self.fetching[tile]
+
+    async def load_region(self, points: list) -> list:
+        """
+        Returns node and way elements for a polygon, fetching tiles not yet ingested
+        """
+        tiles = await self.ensure_region(points)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.load, tiles)
+
+    async def load_region_graph(self, points: list) -> RoadGraph:
+        """
+        Returns the road graph of a polygon, fetching tiles not yet ingested
+        """
+        tiles = await self.ensure_region(points)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.load_graph, tiles)
+
+
+class TileIngest:
+    """
+    Elements being split into tiles, added as they arrive and written by finish
+    Overpass lists nodes before ways, so ways are placed in tiles when they arrive.
+    Ways that arrive before their nodes are placed once every element has been added.
+    """
+
+    def __init__(self, store: TileStore, tiles=None):
+        self.store = store
+        self.tiles = tiles
+        self.nodes = {}
+        self.tile_elements = dict((tile, {}) for tile in tiles or ())
+        self.deferred = []  # Ways with nodes that have not arrived yet
+
+    def add_elements(self, elements):
+        for element in elements:
+            self.add(element)
+
+    def add(self, element: dict):
+        if element["type"] == "node":
+            self.nodes[element["id"]] = {
+                "type": "node",
+                "id": element["id"],
+                "lat": element["lat"],
+                "lon": element["lon"],
+            }
+        elif element["type"] == "way" and "highway" in element.get("tags", {}):
+            # Dumps may hold buildings and other non road ways
+            if all(node_id in self.nodes for node_id in element["nodes"]):
+                self.add_way(element)
+            else:
+                self.deferred.append(element)
+
+    def add_way(self, element: dict):
+        nodes = self.nodes
+        way_nodes = [nodes[node_id] for node_id in element["nodes"] if node_id in nodes]
+        way_tiles = set(self.store.tile_of(node["lat"], node["lon"]) for node in way_nodes)
+        for tile in way_tiles:
+            if self.tiles is not None and tile not in self.tile_elements:
+                continue  # Partially fetched tile, leave it for its own fetch
+            contents = self.tile_elements.setdefault(tile, {})
+            contents[("way", element["id"])] = element
+            for node in way_nodes:
+                contents[("node", node["id"])] = node
+
+    def finish(self):
+        """
+        Places deferred ways and merges every tile with what is on disk
+        """
+        for element in self.deferred:
+            self.add_way(element)
+        self.deferred = []
+        store = self.store
+        with store.lock:
+            for tile, contents in self.tile_elements.items():
+                for element in store.read(tile):
+                    contents.setdefault((element["type"], element["id"]), element)
+                store.write(tile, list(contents.values()))
+
+
+def parse_region(region: str) -> list:
+    """
+    Turns a "south,west,north,east" string into a polygon of points
+    """
+    south, west, north, east = map(float, region.split(","))
+    return [Point(south, west), Point(south, east), Point(north, east), Point(north, west)]
+
+
+def point_in_polygon(latitude: float, longitude: float, points: list) -> bool:
+    """
+    Ray casting test of a coordinate against a polygon of points
+    """
+    inside = False
+    for first, second in zip(points, points[1:] + points[:1]):
+        if (first.latitude > latitude) != (second.latitude > latitude):
+            crossing = first.longitude + (latitude - first.latitude) * (
+                second.longitude - first.longitude
+            ) / (second.latitude - first.latitude)
+            if longitude < crossing:
+                inside = not inside
+    return inside
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ingest Overpass json dumps into a tile store")
+    parser.add_argument("directory", help="Tile store directory")
+    parser.add_argument("dumps", nargs="+", help="Overpass json files, eg nodes.json ways.json")
+    args = parser.parse_args()
+
+    elements = []
+    for dump in args.dumps:
+        with open(dump) as f:
+            elements += json.load(f)["elements"]
+    store = TileStore(args.directory)
+    store.ingest(elements)
+    print(f"Ingested {len(elements)} elements into {args.directory}")
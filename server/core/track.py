@@ -0,0 +1,145 @@
+"""
+Columnar binary format for the GPS tracks of runs
+A track is stored as parallel columns of latitude, longitude, timestamp and speed.
+Each column holds the zigzag encoded difference from the value before it as a base 128 varint,
+so a packet a second apart at running speed takes about six bytes instead of a BSON
+sub-document of four fields. Tracks are written to Mongo as a single BSON binary.
+"""
+from itertools import accumulate
+
+VERSION = 1
+COORDINATE_PRECISION = 6  # Decimal places of latitude and longitude, about ten centimetres
+TIMESTAMP_PRECISION = 3  # Milliseconds
+SPEED_PRECISION = 2  # Centimetres per second
+
+NULL_SPEEDS = 1  # Flag for a bitmap of packets without a speed after the columns
+
+
+def encode_varint(value: int, buffer: bytearray):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x80:
+        buffer.append(0x80 | (value & 0x7F))
+        value >>= 7
+    buffer.append(value)
+
+
+def encode_column(values, precision: int, buffer: bytearray):
+    factor = 10 ** precision
+    last = 0
+    for value in values:
+        value = int(round(value * factor))
+        encode_varint(value - last, buffer)
+        last = value
+
+
+def decode_varints(data: bytes, offset: int, count: int):
+    """
+    Reads count zigzag varints from an offset, returns them and the offset after them
+    """
+    values = []
+    append = values.append
+    result = shift = 0
+    while len(values) < count:
+        if offset >= len(data):
+            raise Exception("Truncated track.")
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        append(~(result >> 1) if result & 1 else result >> 1)
+        result = shift = 0
+    return values, offset
+
+
+def decode_column(deltas: list, precision: int) -> list:
+    factor = 10 ** precision
+    return [value / factor for value in accumulate(deltas)]
+
+
+class Track:
+    """
+    Columns of a GPS track, decoded from their binary form on first use
+    """
+
+    def __init__(self, latitudes, longitudes, timestamps, speeds):
+        self.columns = (latitudes, longitudes, timestamps, speeds)
+        self.data = None
+
+    @classmethod
+    def from_packets(cls, packets):
+        """
+        Track of (latitude, longitude, timestamp, speed) tuples
+        """
+        columns = tuple(zip(*packets)) or ((), (), (), ())
+        return cls(*(list(column) for column in columns))
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        track = cls.__new__(cls)
+        track.columns = None
+        track.data = bytes(data)
+        return track
+
+    def __len__(self):
+        return len(self.decode()[0])
+
+    def __iter__(self):
+        """
+        Yields (latitude, longitude, timestamp, speed) tuples
+        """
+        return zip(*self.decode())
+
+    def points(self):
+        """
+        Yields (latitude, longitude) pairs without the rest of the packets
+        """
+        latitudes, longitudes, _, _ = self.decode()
+        return zip(latitudes, longitudes)
+
+    def decode(self) -> tuple:
+        """
+        The columns of the track, the whole buffer is decoded once
+        """
+        if self.columns is not None:
+            return self.columns
+        data = self.data
+        if not data or data[0] != VERSION:
+            raise Exception("Unsupported track version.")
+        flags = data[1]
+        (count,), offset = decode_varints(data, 2, 1)
+        columns = []
+        for precision in (
+            COORDINATE_PRECISION, COORDINATE_PRECISION, TIMESTAMP_PRECISION, SPEED_PRECISION
+        ):
+            deltas, offset = decode_varints(data, offset, count)
+            columns.append(decode_column(deltas, precision))
+        if flags & NULL_SPEEDS:
+            bitmap = data[offset : offset + (count + 7) // 8]
+            columns[3] = [
+                None if bitmap[index >> 3] & (1 << (index & 7)) else speed
+                for index, speed in enumerate(columns[3])
+            ]
+        self.columns = tuple(columns)
+        return self.columns
+
+    def encode(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        latitudes, longitudes, timestamps, speeds = self.columns
+        nulls = [speed is None for speed in speeds]
+        buffer = bytearray([VERSION, NULL_SPEEDS if any(nulls) else 0])
+        encode_varint(len(latitudes), buffer)
+        encode_column(latitudes, COORDINATE_PRECISION, buffer)
+        encode_column(longitudes, COORDINATE_PRECISION, buffer)
+        encode_column(timestamps, TIMESTAMP_PRECISION, buffer)
+        encode_column((speed or 0 for speed in speeds), SPEED_PRECISION, buffer)
+        if any(nulls):
+            bitmap = bytearray((len(nulls) + 7) // 8)
+            for index, null in enumerate(nulls):
+                if null:
+                    bitmap[index >> 3] |= 1 << (index & 7)
+            buffer += bitmap
+        self.data = bytes(buffer)
+        return self.data
@@ -0,0 +1,113 @@
+"""
+Simplification of GPS tracks as runs are ingested
+Phones send a packet every second or so, with jitter while moving and a pile of near duplicates
+whenever the runner stops. Stored runs keep a simplified track for feeds and maps,
+the full resolution track is kept apart for when it is asked for.
+"""
+import numpy as np
+
+from .geodesy import EARTH_RADIUS
+from .track import Track
+
+
+def local_metres(latitudes, longitudes) -> tuple:
+    """
+    Equirectangular projection to metres around the first coordinate, accurate over a run
+    """
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    x = (longitudes - longitudes[0]) * np.cos(latitudes[0]) * EARTH_RADIUS
+    y = (latitudes - latitudes[0]) * EARTH_RADIUS
+    return x, y
+
+
+def take(track: Track, indices) -> Track:
+    """
+    Track of the packets at indices, in order
+    """
+    return Track(*([column[index] for index in indices] for column in track.decode()))
+
+
+def resample(timestamps, interval: float) -> np.ndarray:
+    """
+    Indices keeping the first packet of every interval seconds, and the last packet
+    Gaps longer than the interval are left as they are rather than filled in.
+    """
+    times = np.asarray(timestamps, np.float64)
+    if interval <= 0 or len(times) < 3:
+        return np.arange(len(times))
+    bins = np.floor((times - times[0]) / interval)
+    keep = np.ones(len(times), bool)
+    keep[1:] = bins[1:] != bins[:-1]
+    keep[-1] = True
+    return np.flatnonzero(keep)
+
+
+def collapse_stationary(x, y, radius: float) -> np.ndarray:
+    """
+    Indices without the packets of stops, keeping where each stop began and ended
+    A packet is stationary while it is within radius metres of the last packet kept.
+    """
+    if radius <= 0 or len(x) < 3:
+        return np.arange(len(x))
+    keep = [0]
+    anchor = 0
+    radius_squared = radius * radius
+    for index in range(1, len(x)):
+        if (x[index] - x[anchor]) ** 2 + (y[index] - y[anchor]) ** 2 > radius_squared:
+            if keep[-1] != index - 1:
+                keep.append(index - 1)  # End of the stop, so its duration is kept
+            keep.append(index)
+            anchor = index
+    if keep[-1] != len(x) - 1:
+        keep.append(len(x) - 1)
+    return np.array(keep)
+
+
+def douglas_peucker(x, y, tolerance: float) -> np.ndarray:
+    """
+    Indices of the points Douglas-Peucker keeps within tolerance metres of the original line
+    """
+    count = len(x)
+    if tolerance <= 0 or count < 3:
+        return np.arange(count)
+    keep = np.zeros(count, bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1 : last] - x[first], y[first + 1 : last] - y[first]
+        length_squared = dx * dx + dy * dy
+        if length_squared == 0:
+            distances = np.hypot(px, py)
+        else:
+            # Distance to the segment, clamped to its ends for points beyond them
+            t = np.clip((px * dx + py * dy) / length_squared, 0, 1)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            middle = first + 1 + index
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return np.flatnonzero(keep)
+
+
+def simplify(
+    track: Track, tolerance: float, stationary_radius: float, interval: float
+) -> Track:
+    """
+    Resamples a track in time, collapses its stops then simplifies its shape
+    The first and last packets are always kept.
+    """
+    latitudes, longitudes, timestamps, _ = track.decode()
+    if len(latitudes) < 3:
+        return track
+    indices = resample(timestamps, interval)
+    x, y = local_metres(np.take(latitudes, indices), np.take(longitudes, indices))
+    kept = collapse_stationary(x, y, stationary_radius)
+    indices, x, y = indices[kept], x[kept], y[kept]
+    indices = indices[douglas_peucker(x, y, tolerance)]
+    return take(track, indices.tolist())
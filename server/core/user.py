@@ -2,40 +2,83 @@ from dataclasses import dataclass
 import datetime
 
 import bcrypt
+import bson
 import jwt
 
 from sanic import Sanic
 from sanic.exceptions import abort
 
 from .utils import snowflake
-from .route import SavedRoute, SavedRun, Run
+from .decorators import timed
+from .metrics import metrics
+from .user_cache import UserCache
+from .route import SavedRoute
 from .group import Group
-from .feed import Feed
+from .feed import Feed, FeedItem
 from .points import run_stats, levelcalc, calculateLevelProgress
 
 
+class LazyField:
+    """
+    Heavy user field, fetched by User.load and turned into objects on first access
+    """
+
+    def __init__(self, parse, default):
+        self.parse = parse  # Raw document value -> objects
+        self.default = default  # Raw value of a user document without the field
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, user, owner=None):
+        if user is None:
+            return self
+        if self.name not in user.fields:
+            if self.name not in user.raw:
+                raise Exception(f"User field {self.name} has not been loaded.")
+            user.fields[self.name] = self.parse(user.raw.pop(self.name))
+        return user.fields[self.name]
+
+    def __set__(self, user, value):
+        user.raw.pop(self.name, None)
+        user.fields[self.name] = value
+
+
 class User:
     """
     User class for database that holds all information
+    Saved routes and the feed grow with every run, so they are left out of the document
+    find_account fetches. Endpoints that use them await user.load first.
+    Runs and saved runs live in their own collections and are read a page at a time.
     Abdur Raqeeb/Jason Yu
     """
 
+    saved_routes = LazyField(
+        lambda data: dict(
+            (key, SavedRoute.from_data(saved_route_data))
+            for key,saved_route_data in data.items()
+        ),
+        {},
+    )
+    feed = LazyField(Feed.from_data, []) # list of saved route names/id with corresponding user id
+    HEAVY_FIELDS = ("saved_routes", "feed")
+    MOVED_FIELDS = ("runs", "saved_runs") # In app.runs, left in documents until migrated
+
     def __init__(self, app, user_id, **kwargs):
         self.app = app
         self.id = user_id
+        self.raw = {} # Heavy fields fetched but not yet turned into objects
+        self.fields = {} # Heavy fields turned into objects
+        self.size = 0 # Bytes of the documents the user was built from, for the user cache
         self.credentials = kwargs.get('credentials')
         self.username = kwargs.get('username')
         self.full_name = kwargs.get('full_name')
         self.groups = kwargs.get('groups')
         self.stats = kwargs.get('stats')
-        self.saved_routes = kwargs.get('saved_routes')
-        self.saved_runs = kwargs.get('saved_runs')
-        self.runs = kwargs.get('runs')
         self.followers = kwargs.get('followers') # list of ids
         self.following = kwargs.get('following') # list of ids
         self.follow_requests = kwargs.get('follow_requests')
         self.pending_follows = kwargs.get('pending_follows')
-        self.feed = kwargs.get('feed') # list of saved route names/id with corresponding user id
         self.bio = kwargs.get('bio')
 
     def __str__(self):
@@ -53,27 +96,49 @@ class User:
         Abdur Raqeeb/Jason Yu
         """
 
+        size = len(bson.encode(data))
         user_id = data.pop("_id")
-        data["saved_routes"] = dict(
-            (key, SavedRoute.from_data(saved_route_data))
-            for key,saved_route_data in data["saved_routes"].items()
-        )
-        data["saved_runs"] = dict(
-            (key, SavedRun.from_data(saved_run_data))
-            for key,saved_run_data in (data["saved_runs"].items())
+        heavy = dict(
+            (field, data.pop(field)) for field in cls.HEAVY_FIELDS if field in data
         )
-        data["runs"] = [
-            Run.from_data(run_data)
-            for run_data in data["runs"]
-        ]
+        for field in cls.MOVED_FIELDS:
+            data.pop(field, None)
         data["groups"] = {g["_id"]: Group(app, g) for g in data.get("groups", [])}
         data["credentials"] = Credentials(**(data["credentials"]))
         data["stats"] = UserStats(**(data["stats"]))
-        data["feed"] = Feed.from_data(data["feed"])
 
         user = cls(app, user_id, **data)
+        user.raw.update(heavy) # Heavy fields in the data are only parsed when used
+        user.size = size
         return user
 
+    def is_loaded(self, field):
+        return field in self.fields or field in self.raw
+
+    @timed(name="mongo.User.load")
+    async def load(self, *fields):
+        """
+        Fetches heavy fields that have not been loaded, projecting only those fields
+        """
+        missing = [field for field in fields if not self.is_loaded(field)]
+        if not missing:
+            return self
+        data = await self.app.db.users.find_one(
+            {'_id': self.id}, dict((field, 1) for field in missing)
+        )
+        for field in missing:
+            self.raw[field] = (data or {}).get(field, getattr(User, field).default)
+        if data:
+            self.size += len(bson.encode(data))
+            self.app.users.user_cache.resize(self)
+        return self
+
+    def invalidate(self):
+        """
+        Drops the user from the user cache after a write
+        """
+        self.app.users.user_cache.invalidate(self.id)
+
     def __hash__(self):
         return self.id
 
@@ -85,14 +150,20 @@ class User:
         result = bcrypt.checkpw(password, self.credentials.password)
         return result
 
+    @timed(name="mongo.User.replace")
     async def replace(self):
         """
         Updates user with current data
         Abdur Raqeeb
         """
+        await self.load(*self.HEAVY_FIELDS) # Unloaded fields would be replaced with nothing
         document = self.to_dict()
-        await self.app.db.users.replace_one({'_id': self.id}, document)
+        del document['_id']
+        # Set rather than replaced so runs of documents that have not been migrated are kept
+        await self.app.db.users.update_one({'_id': self.id}, {'$set': document})
+        self.invalidate()
 
+    @timed(name="mongo.User.push_to_array_field")
     async def push_to_array_field(self, field, item):
         """
         Pushes item to array field
@@ -105,7 +176,9 @@ class User:
             }
         }
     )
+        self.invalidate()
 
+    @timed(name="mongo.User.set_to_dict_field")
     async def set_to_dict_field(self, field, key, item):
         """
         Set item to dict field
@@ -118,7 +191,9 @@ class User:
             }
         }
     )
+        self.invalidate()
 
+    @timed(name="mongo.User.set_field")
     async def set_field(self, field, item):
         """
         Set item to field
@@ -131,7 +206,9 @@ class User:
             }
         }
     )
+        self.invalidate()
 
+    @timed(name="mongo.User.remove_from_array_field")
     async def remove_from_array_field(self, field, items):
         """
         Removes Items from array field
@@ -145,6 +222,7 @@ class User:
                 }
             },
         )
+        self.invalidate()
 
     async def remove_item_from_array_field(self, field, item):
         """
@@ -154,13 +232,22 @@ class User:
         await self.remove_from_array_field(field, [item])
 
 
+    @timed(name="mongo.User.delete")
     async def delete(self):
         """
         Deletes user from database
         Abdur Raqeeb
         """
         await self.app.db.users.delete_one({'_id': self.id})
+        await self.app.runs.delete_user(self.id)
+        self.invalidate()
+        # Followers' feeds would otherwise point at the deleted runs, cached followers
+        # see the change once their entry expires and feed_runs skips the runs until then
+        await self.app.db.users.update_many(
+            {'feed.user_id': self.id}, {'$pull': {'feed': {'user_id': self.id}}}
+        )
 
+    @timed(name="mongo.User.create_group")
     async def create_group(self, name):
 
         group_id = snowflake()
@@ -177,7 +264,9 @@ class User:
         await self.app.db.users.update_one(
             {"_id": self.id}, {"$addToSet": {"groups": group_id}}
         )
+        self.invalidate()
 
+    @timed(name="mongo.User.add_to_group")
     async def add_to_group(self, group_id):
         """
         Adds the user to a group
@@ -188,7 +277,9 @@ class User:
         await self.app.db.users.update_one(
             {"_id": self.id}, {"$addToSet": {"groups": group_id}}
         )
+        self.invalidate()
 
+    @timed(name="mongo.User.remove_from_group")
     async def remove_from_group(self, group_id):
         """
         Removes the user from the group
@@ -199,10 +290,80 @@ class User:
         await self.app.db.users.update_one(
             {"_id": self.id}, {"$pull": {"groups": group_id}}
         )
+        self.invalidate()
+
+    @timed(name="mongo.User.add_feed_item")
+    async def add_feed_item(self, user_id, saved_run_id):
+        """
+        Adds a saved run to the feed without loading it, keeping the latest MAX_FEED_LENGTH
+        """
+        item = FeedItem(user_id, saved_run_id)
+        await self.app.db.users.update_one(
+            {'_id': self.id},
+            {'$push': {'feed': {'$each': [item.to_dict()], '$slice': -Feed.MAX_FEED_LENGTH}}},
+        )
+        self.invalidate()
+        if self.is_loaded('feed'):
+            self.feed.add_item(user_id, saved_run_id)
+
+    async def add_run(self, run):
+        """
+        Adds a run to the user's history
+        """
+        return await self.app.runs.add_run(self.id, run)
+
+    async def add_saved_run(self, saved_run):
+        return await self.app.runs.add_saved_run(self.id, saved_run)
+
+    async def get_saved_run(self, run_id):
+        """
+        One saved run of the user, None if they have no run with the id
+        """
+        return await self.app.runs.get_saved_run(run_id, self.id)
+
+    async def feed_runs(self):
+        """
+        Latest ten saved runs of the feed with who ran them
+        Items whose user or saved run has since been deleted are skipped
+        """
+        await self.load('feed')
+        feed_runs = []
+        for item in self.feed.get_latest_ten():
+            user = await self.app.users.find_account(_id=item.user_id)
+            saved_run = await user.get_saved_run(item.saved_route_id) if user else None
+            if saved_run is None:
+                continue
+            feed_runs.append({
+                "user_id": item.user_id,
+                "user_name": user.full_name,
+                "route": saved_run.to_dict(),
+            })
+        return feed_runs
+
+    async def update_saved_run(self, run_id, update):
+        return await self.app.runs.update_saved_run(run_id, self.id, update)
+
+    async def full_track(self, run_id):
+        """
+        Full resolution track of one of the user's runs, stored runs are simplified
+        """
+        return await self.app.runs.full_track(run_id, self.id)
+
+    async def runs_page(self, cursor=None, limit=None):
+        """
+        Page of the user's runs, newest first, with the cursor of the next page
+        """
+        return await self.app.runs.runs_page(self.id, cursor, limit or self.app.runs.PAGE_SIZE)
+
+    async def saved_runs_page(self, cursor=None, limit=None):
+        return await self.app.runs.saved_runs_page(
+            self.id, cursor, limit or self.app.runs.PAGE_SIZE
+        )
 
     def to_dict(self):
         """
         Returns user data as a dict
+        Heavy fields have to be loaded first
         Abdur Raqeeb/ Jason Yu
         """
         return {
@@ -210,17 +371,10 @@ class User:
             "full_name": self.full_name,
             "username": self.username,
             "avatar_url": self.avatar_url,
-            "saved_runs": dict(
-                (run_id, saved_run.to_dict())
-                for run_id,saved_run in self.saved_runs.items()
-            ),
             "saved_routes": dict(
                 (route_id, saved_route.to_dict())
                 for route_id,saved_route in self.saved_routes.items()
             ),
-            "runs": [
-                run.to_dict() for run in self.runs
-            ],
             "stats": self.stats.to_dict(),
             "credentials": self.credentials.to_dict(),
             "groups": self.groups,
@@ -284,35 +438,42 @@ class UserStats:
         }
 
 
-    def update_stats(self, run_info):
+    def update_stats(self, run):
+        run_info = run.run_info
         final_duration = run_info['final_duration']
         duration = (final_duration['hours'] * 60 + final_duration['minutes']) * 60 + final_duration['seconds']
-        self.points += run_stats(float(run_info['final_distance']), duration)
+        # Phones without a distance reading fall back to the distance of the track
+        final_distance = float(run_info.get('final_distance') or run.get_distance())
+        self.points += run_stats(final_distance, duration)
         self.num_runs += 1
-        self.total_distance += float(run_info['final_distance'])
-        self.longest_distance_ran += max(float(run_info['final_distance']), self.longest_distance_ran)
+        self.total_distance += final_distance
+        self.longest_distance_ran += max(final_distance, self.longest_distance_ran)
 
 class UserBase:
-    def __init__(self, app):
+    def __init__(self, app, user_cache=None):
         self.app = app
-        self.user_cache = {}
+        self.user_cache = UserCache() if user_cache is None else user_cache
         self.group_cache = {}
 
-    async def find_account(self, **query):
+    async def find_account(self, *fields, **query):
         """
         Returns a user object based on the query
+        Heavy fields are only fetched when named, eg find_account("feed", _id=user_id)
         Abdur Raqeeb
         """
         # Checks if user can be retrieved from cache
         if len(query) == 1 and "_id" in query:
             user = self.user_cache.get(query["_id"])
             if user:
-                return user
-        data = await self.app.db.users.find_one(query)
+                return await user.load(*fields)
+        projection = dict((field, 0) for field in User.HEAVY_FIELDS if field not in fields)
+        projection.update((field, 0) for field in User.MOVED_FIELDS)
+        with metrics.span("mongo.UserBase.find_account"):
+            data = await self.app.db.users.find_one(query, projection)
         if not data:
             return None
         user = User.from_data(self.app, data)
-        self.user_cache[user.id] = user
+        self.user_cache.put(user)
         return user
 
     async def register(self, request):
@@ -347,7 +508,8 @@ class UserBase:
         hashed = bcrypt.hashpw(password, salt)
         user_id = str(snowflake())
         # Adding Avatar to images
-        await self.app.db.images.insert_one({"user_id": user_id, "avatar": avatar})
+        with metrics.span("mongo.UserBase.register"):
+            await self.app.db.images.insert_one({"user_id": user_id, "avatar": avatar})
         # Generates Credentials
         credentials = Credentials(
             **({"email": email, "password": hashed, "token": None})
@@ -355,9 +517,7 @@ class UserBase:
         # Generates document for DB
         document = {
             "_id": user_id,
-            "saved_runs": dict(),
             "saved_routes": dict(),
-            "runs": [],
             "full_name": full_name,
             "username": username,
             "stats": initial_stats.to_dict(),
@@ -371,10 +531,12 @@ class UserBase:
             "bio": "",
         }
         # Adds user to DB
-        await self.app.db.users.insert_one(document)
+        with metrics.span("mongo.UserBase.register"):
+            await self.app.db.users.insert_one(document)
         user = User.from_data(self.app, document)
         return user
 
+    @timed(name="mongo.UserBase.issue_token")
     async def issue_token(self, user):
         """
         Creates and returns a token if not already existing
@@ -387,10 +549,11 @@ class UserBase:
         user.credentials.token = token = jwt.encode(payload, self.app.secret)
         # Adds token to credentials
         await self.app.db.users.update_one(
-            {"user_id": user.id}, {"$set": {"credentials.token": token}}
+            {"_id": user.id}, {"$set": {"credentials.token": token}}
         )
+        user.invalidate()
 
         return token
 
-    async def clear_cache(self, user):
-        del self.user_cache[user.id]
+    def clear_cache(self, user):
+        self.user_cache.invalidate(user.id)
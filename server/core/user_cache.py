@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """
+    Bounded cache of User objects by id
+    Entries are evicted least recently used first once either the entry count or the
+    estimated byte budget is exceeded, and expire after a time to live so changes made
+    by other workers are picked up. Writes through User invalidate the user's entry.
+    Sizes are the BSON size of the documents a user was built from, an estimate of its memory.
+    """
+
+    def __init__(
+        self, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # Seconds
+        self.entries = OrderedDict()  # user id -> (expiry time, size, user)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, user_id) -> bool:
+        entry = self.entries.get(user_id)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, user_id):
+        """
+        Returns the cached user or None, a hit marks the entry as recently used
+        """
+        entry = self.entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expiry, size, user = entry
+        if expiry <= time.monotonic():
+            self.remove(user_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def put(self, user):
+        if user.size > self.max_bytes:
+            return
+        if user.id in self.entries:
+            self.remove(user.id)
+        self.entries[user.id] = (time.monotonic() + self.ttl, user.size, user)
+        self.bytes += user.size
+        self.evict()
+
+    def resize(self, user):
+        """
+        Accounts for fields loaded into a cached user since it was stored
+        """
+        entry = self.entries.get(user.id)
+        if entry is None or entry[2] is not user:
+            return
+        expiry, size, _ = entry
+        if user.size > self.max_bytes:
+            self.remove(user.id)
+            self.evictions += 1
+            return
+        self.entries[user.id] = (expiry, user.size, user)
+        self.bytes += user.size - size
+        self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate(self, user_id):
+        """
+        Drops a user after a write, the next lookup fetches it again
+        """
+        if user_id in self.entries:
+            self.remove(user_id)
+            self.invalidations += 1
+
+    def remove(self, user_id):
+        expiry, size, user = self.entries.pop(user_id)
+        self.bytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
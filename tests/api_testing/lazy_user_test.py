@@ -0,0 +1,132 @@
+from server.core.memory_db import MemoryClient
+from server.core.user import User, UserBase, UserStats, Credentials
+from server.core.run_store import RunStore
+from server.core.route import SavedRun
+from server.core.feed import Feed
+import asyncio
+import bson
+import types
+
+
+def location_packets(count):
+    return [
+        {
+            "location": {"latitude": -33.87 + i * 1e-5, "longitude": 151.2},
+            "timestamp": i,
+            "speed": 3.0,
+        }
+        for i in range(count)
+    ]
+
+
+def document(user_id, runs):
+    return {
+        "_id": user_id,
+        "full_name": f"Runner {user_id}",
+        "username": f"runner{user_id}",
+        "credentials": Credentials("runner@test.com", b"hash").to_dict(),
+        "stats": UserStats().to_dict(),
+        "groups": [],
+        "followers": ["2"],
+        "following": [],
+        "follow_requests": [],
+        "pending_follows": [],
+        "bio": "",
+        "runs": [
+            {"location_packets": location_packets(500), "run_info": {}} for _ in range(runs)
+        ],
+        "saved_runs": dict(
+            (
+                str(number),
+                {
+                    "id": str(number),
+                    "name": "Run",
+                    "description": "",
+                    "location_packets": location_packets(500),
+                    "run_info": {},
+                    "likes": [],
+                    "comments": [],
+                },
+            )
+            for number in range(runs)
+        ),
+        "saved_routes": dict(
+            (
+                str(number),
+                {
+                    "id": str(number),
+                    "name": "Route",
+                    "description": "",
+                    "route": {
+                        "polyline": "_p~iF~ps|U_ulLnnqC_mqNvxq`@",
+                        "precision": 5,
+                        "distance": 1000,
+                    },
+                    "start_name": "Start",
+                    "end_name": "End",
+                },
+            )
+            for number in range(runs)
+        ),
+        "feed": Feed([]).to_dict(),
+    }
+
+
+async def main():
+    app = types.SimpleNamespace(db=MemoryClient().majorproject)
+    app.users = UserBase(app)
+    app.runs = RunStore(app.db)
+    await app.db.users.insert_one(document("1", 50))
+    await app.db.users.insert_one(document("2", 0))
+
+    full = await app.db.users.find_one({"_id": "1"})
+    projected = await app.db.users.find_one(
+        {"_id": "1"}, dict((field, 0) for field in User.HEAVY_FIELDS + User.MOVED_FIELDS)
+    )
+    print(f"Full user document {len(bson.encode(full))} bytes")
+    print(f"Auth projection {len(bson.encode(projected))} bytes")
+    assert len(bson.encode(projected)) < 1000
+
+    # Auth and follow endpoints only see light fields
+    user = await app.users.find_account(_id="1")
+    assert user.followers == ["2"] and not user.is_loaded("saved_routes")
+    try:
+        user.saved_routes
+        raise AssertionError("Unloaded field was readable")
+    except Exception as e:
+        assert "has not been loaded" in str(e)
+
+    # Loading fetches raw data, objects are only built on first access
+    await user.load("saved_routes")
+    assert "saved_routes" in user.raw and "saved_routes" not in user.fields
+    assert len(user.saved_routes) == 50 and "saved_routes" in user.fields
+
+    # Feed items are pushed without loading the follower's feed
+    follower = await app.users.find_account(_id="2")
+    for number in range(Feed.MAX_FEED_LENGTH + 5):
+        await follower.add_feed_item("1", str(number))
+    assert not follower.is_loaded("feed")
+    await follower.load("feed")
+    assert len(follower.feed.items) == Feed.MAX_FEED_LENGTH
+    assert follower.feed.get_latest_ten()[0].saved_route_id == str(Feed.MAX_FEED_LENGTH + 4)
+
+    # Everything loads for the full user dict, runs of unmigrated documents are kept
+    await user.load(*User.HEAVY_FIELDS)
+    await user.replace()
+    assert len((await app.db.users.find_one({"_id": "1"}))["runs"]) == 50
+
+    # The feed skips runs and users deleted since they were shared
+    saved_run = SavedRun.from_real_time_data("Run", "", {}, location_packets(10), [], [])
+    await user.add_saved_run(saved_run)
+    await follower.add_feed_item("1", saved_run.id)
+    await follower.add_feed_item("3", saved_run.id)  # Never existed
+    feed_runs = await follower.feed_runs()
+    assert [item["route"]["id"] for item in feed_runs] == [saved_run.id]
+    await user.delete()
+    assert await follower.feed_runs() == []
+    feed = (await app.db.users.find_one({"_id": "2"}))["feed"]
+    assert [item["user_id"] for item in feed] == ["3"]
+    print("Lazy users load only what is used")
+
+
+asyncio.get_event_loop().run_until_complete(main())
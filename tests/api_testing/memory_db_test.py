@@ -0,0 +1,54 @@
+from server.core.memory_db import MemoryClient
+import asyncio
+
+
+async def main():
+    db = MemoryClient().majorproject
+    users = db.users
+    await users.create_index([("username", "text"), ("full_name", "text")])
+    await users.insert_one(
+        {"_id": "1", "username": "jason", "full_name": "Jason Yu", "runs": [], "feed": [],
+         "saved_runs": {}, "credentials": {"email": "jason@test.com"}}
+    )
+    await users.insert_one(
+        {"_id": "2", "username": "sunny", "full_name": "Sunny Yan", "runs": [], "feed": [],
+         "saved_runs": {}, "credentials": {"email": "sunny@test.com"}}
+    )
+
+    # Documents come back as copies like decoded BSON
+    document = await users.find_one({"_id": "1"})
+    document.pop("_id")
+    assert (await users.find_one({"_id": "1"}))["_id"] == "1"
+
+    # Update operators the user model sends
+    await users.update_one({"_id": "1"}, {"$push": {"runs": {"distance": 5}}})
+    await users.update_one({"_id": "1"}, {"$set": {"saved_runs.abc": {"likes": []}}})
+    await users.update_one({"_id": "1"}, {"$push": {"saved_runs.abc.likes": "2"}})
+    await users.update_one({"_id": "1"}, {"$addToSet": {"groups": 7}})
+    await users.update_one({"_id": "1"}, {"$addToSet": {"groups": 7}})
+    await users.update_one({"_id": "1"}, {"$pull": {"saved_runs.abc.likes": {"$in": ["2"]}}})
+    await users.update_one({"_id": "1"}, {"$push": {"feed": {"user_id": "2", "saved_route_id": "a"}}})
+    await users.update_many({"feed.user_id": "2"}, {"$pull": {"feed": {"user_id": "2"}}})
+    document = await users.find_one({"_id": "1"})
+    assert document["runs"] == [{"distance": 5}]
+    assert document["saved_runs"]["abc"]["likes"] == []
+    assert document["groups"] == [7]
+    assert document["feed"] == []
+
+    # Queries on nested fields, text search, projections, cursors
+    assert (await users.find_one({"credentials.email": "sunny@test.com"}))["_id"] == "2"
+    assert await users.find_one({"credentials.email": "nobody"}) is None
+    found = await users.find({"$text": {"$search": "yan"}}).to_list(10)
+    assert [user["_id"] for user in found] == ["2"]
+    projected = await users.find_one({"_id": "1"}, {"username": 1})
+    assert projected == {"_id": "1", "username": "jason"}
+    ordered = await users.find({}).sort("username", -1).limit(1).to_list(None)
+    assert [user["username"] for user in ordered] == ["sunny"]
+    assert await users.count_documents({"runs.distance": {"$gt": 4}}) == 1
+
+    result = await users.delete_one({"_id": "2"})
+    assert result.deleted_count == 1 and await users.count_documents({}) == 1
+    print("Memory database matches the motor calls the server makes")
+
+
+asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,97 @@
+from server.core.memory_db import MemoryClient
+from server.core.run_store import RunStore, migrate
+from server.core.route import Run, SavedRun
+from server.core.utils import snowflake
+import asyncio
+import time
+
+
+def location_packets(count):
+    return [
+        {
+            "location": {"latitude": -33.87 + i * 1e-5, "longitude": 151.2},
+            "timestamp": i,
+            "speed": 3.0,
+        }
+        for i in range(count)
+    ]
+
+
+def saved_run_data(run_id):
+    return {
+        "id": run_id,
+        "name": f"Run {run_id}",
+        "description": "",
+        "location_packets": location_packets(10),
+        "run_info": {},
+        "likes": [],
+        "comments": [],
+    }
+
+
+async def main():
+    db = MemoryClient().majorproject
+    user_id = str(snowflake(time.time() - 86400))  # Signed up yesterday
+    saved_run_ids = [str(snowflake(time.time() - 3600 + number)) for number in range(5)]
+    await db.users.insert_one({
+        "_id": user_id,
+        "runs": [
+            {"location_packets": location_packets(10), "run_info": {"number": number}}
+            for number in range(45)
+        ],
+        "saved_runs": dict((run_id, saved_run_data(run_id)) for run_id in saved_run_ids),
+    })
+
+    # Dry runs only count, migrating twice moves everything once
+    counts = await migrate(db, dry_run=True)
+    assert counts == {"users": 1, "runs": 45, "saved_runs": 5}, counts
+    assert await db.runs.count_documents({}) == 0
+    await migrate(db)
+    assert await db.runs.count_documents({"user_id": user_id}) == 45
+    assert "runs" not in await db.users.find_one({"_id": user_id})
+    counts = await migrate(db)
+    assert counts["runs"] == 0 and await db.runs.count_documents({}) == 45
+    assert "user_id_1_start_time_-1__id_-1" in await db.runs.index_information()
+
+    # Pages are newest first and walk the whole history once, even as runs are added
+    store = RunStore(db)
+    await store.add_run(user_id, Run.from_real_time_data(location_packets(10), {"number": 45}))
+    runs, cursor = await store.runs_page(user_id, limit=20)
+    numbers = [run.run_info["number"] for run in runs]
+    await store.add_run(user_id, Run.from_real_time_data(location_packets(10), {"number": 46}))
+    while cursor:
+        runs, cursor = await store.runs_page(user_id, cursor, limit=20)
+        numbers += [run.run_info["number"] for run in runs]
+    assert numbers == list(range(45, -1, -1)), numbers
+
+    # Saved runs keep their ids and only their owner's runs are updated
+    saved_run = await store.get_saved_run(saved_run_ids[2], user_id)
+    assert saved_run.id == saved_run_ids[2] and len(saved_run.location_packets) == 10
+    assert await store.get_saved_run(saved_run_ids[2], "someone else") is None
+    assert await store.update_saved_run(saved_run_ids[2], user_id, {"$push": {"likes": "2"}})
+    assert not await store.update_saved_run(saved_run_ids[2], "2", {"$push": {"likes": "2"}})
+    assert (await store.get_saved_run(saved_run_ids[2])).likes == ["2"]
+    new_run = SavedRun.from_real_time_data("New", "", {}, location_packets(10), [], [])
+    await store.add_saved_run(user_id, new_run)
+    saved_runs, cursor = await store.saved_runs_page(user_id, limit=3)
+    assert saved_runs[0].id == new_run.id and cursor
+    assert [run.id for run in saved_runs[1:]] == saved_run_ids[:-3:-1]
+
+    # Stored tracks are simplified, the full track is kept apart
+    jitter = [
+        dict(packet, location={"latitude": -33.87 + i * 1e-5, "longitude": 151.2 + (i % 2) * 1e-5})
+        for i, packet in enumerate(location_packets(200))
+    ]
+    run_id = await store.add_run(user_id, Run.from_real_time_data(jitter, {}))
+    runs, _ = await store.runs_page(user_id, limit=1)
+    assert len(runs[0].location_packets) == 2
+    assert len(await store.full_track(run_id, user_id)) == 200
+    assert await store.full_track(run_id, "someone else") is None
+    assert len(await store.full_track(saved_run_ids[0], user_id)) == 10
+
+    await store.delete_user(user_id)
+    assert await db.runs.count_documents({}) == 0
+    print("Runs migrated and paged")
+
+
+asyncio.get_event_loop().run_until_complete(main())
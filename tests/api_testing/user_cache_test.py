@@ -0,0 +1,78 @@
+from server.core.memory_db import MemoryClient
+from server.core.user import UserBase, UserStats, Credentials
+from server.core.user_cache import UserCache
+from server.core.run_store import RunStore
+from server.core.feed import Feed
+import asyncio
+import time
+import tracemalloc
+import types
+
+
+def document(user_id):
+    return {
+        "_id": user_id,
+        "full_name": f"Runner {user_id}",
+        "username": f"runner{user_id}",
+        "credentials": Credentials(f"runner{user_id}@test.com", b"hash").to_dict(),
+        "stats": UserStats().to_dict(),
+        "groups": [],
+        "followers": [],
+        "following": [],
+        "follow_requests": [],
+        "pending_follows": [],
+        "bio": "",
+        "saved_routes": {},
+        "feed": Feed([]).to_dict(),
+    }
+
+
+async def main():
+    app = types.SimpleNamespace(db=MemoryClient().majorproject)
+    app.users = UserBase(app, UserCache(max_entries=100, max_bytes=30000, ttl=0.2))
+    app.runs = RunStore(app.db)
+    await app.db.users.insert_many([document(str(number)) for number in range(2000)])
+    cache = app.users.user_cache
+
+    # Repeat lookups hit, writes invalidate so the next lookup sees the database
+    user = await app.users.find_account(_id="1")
+    assert await app.users.find_account(_id="1") is user
+    await user.set_field("bio", "Hello")
+    assert "1" not in cache and cache.invalidations == 1
+    assert (await app.users.find_account(_id="1")).bio == "Hello"
+    follower = await app.users.find_account(_id="2")
+    await follower.add_feed_item("1", "run")
+    assert "2" not in cache
+    app.users.clear_cache(user)
+    app.users.clear_cache(user)  # Clearing a user that is not cached is fine
+    assert "1" not in cache
+
+    # Loading heavy fields is accounted for
+    user = await app.users.find_account(_id="3")
+    size = cache.bytes
+    await user.load("feed", "saved_routes")
+    assert cache.bytes > size and user.size == cache.entries["3"][1]
+
+    # Memory stays flat however many users are seen
+    tracemalloc.start()
+    for number in range(1000):
+        await app.users.find_account(_id=str(number))
+    first = tracemalloc.get_traced_memory()[0]
+    for number in range(1000, 2000):
+        await app.users.find_account(_id=str(number))
+    second = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(cache) <= 100 and cache.bytes <= 30000 and cache.evictions > 1000
+    assert second < first * 1.2, (first, second)
+    print(f"{len(cache)} users cached in {cache.bytes} bytes after 2000 lookups")
+
+    # Entries expire so writes from other workers are seen
+    user = await app.users.find_account(_id="1999")
+    await asyncio.sleep(0.25)
+    assert await app.users.find_account(_id="1999") is not user
+    assert cache.expirations >= 1
+    print(cache.stats)
+    print("User cache stays bounded")
+
+
+asyncio.get_event_loop().run_until_complete(main())
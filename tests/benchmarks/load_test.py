@@ -0,0 +1,328 @@
+"""
+HTTP load test of the whole server
+Boots server/app.py in load testing mode, with the in-memory database (mongo_uri=memory://)
+and map data served from the mock Overpass dumps (overpass_mock), registers a set of users
+who follow each other, then drives a weighted mix of route, login, save_run and get_feed
+requests from concurrent clients. Reports requests per second and a latency histogram for
+every endpoint as json.
+
+    python tests/benchmarks/load_test.py --duration 30 --concurrency 16 --output load.json
+    python tests/benchmarks/load_test.py --mix route=1,get_feed=3 --url http://127.0.0.1:8000
+
+Run from the repository root, the server resolves its static files and avatar from there.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+from server import RoadGraph
+from route_benchmark import DATASETS, load_dataset, largest_component
+
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]  # Upper bounds in ms
+ENDPOINTS = ("route", "login", "save_run", "get_feed")
+DEFAULT_MIX = "route=4,login=1,save_run=2,get_feed=3"
+PASSWORD = "loadtest"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, dataset: str, tiles: str) -> subprocess.Popen:
+    """
+    Starts the server in a child process so clients and server do not share an event loop
+    """
+    directory = DATASETS[dataset]
+    env = dict(
+        os.environ,
+        development="0",
+        HOST="127.0.0.1",
+        PORT=str(port),
+        mongo_uri="memory://",
+        overpass_mock=",".join(
+            os.path.join(directory, name) for name in ("nodes.json", "ways.json")
+        ),
+        tile_store=tiles,
+        route_workers="0",
+        contraction_hierarchy="",
+        host="127.0.0.1",
+        secret="loadtest",
+        webhook_url="http://127.0.0.1/webhook",
+        google_maps_api="",
+        google_android_login_id="",
+        google_ios_login_id="",
+    )
+    return subprocess.Popen(
+        [sys.executable, os.path.join("server", "app.py")],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_for_server(session, url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url + "/api/get_keys") as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise Exception(f"Server at {url} did not start within {timeout}s.")
+
+
+class LoadTest:
+    """
+    Concurrent clients sending a weighted mix of requests, recording latency per endpoint
+    """
+
+    def __init__(self, session, url: str, args):
+        self.session = session
+        self.url = url
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.users = []  # (email, token, user_id)
+        self.latencies = {}  # endpoint -> list of ms
+        self.errors = {}  # endpoint -> count
+        self.statuses = {}  # endpoint -> {status: count}
+
+        nodes_json, ways_json = load_dataset(DATASETS[args.dataset])
+        graph = RoadGraph.from_json(nodes_json, ways_json)
+        component = largest_component(graph)
+        points = [f"{graph.latitudes[index]},{graph.longitudes[index]}" for index in component]
+        self.points = points
+        # A fixed pool of routes so repeated requests exercise the route cache like real users
+        self.routes = [tuple(self.rng.sample(points, 2)) for _ in range(args.route_pairs)]
+        self.mix = []
+        for part in args.mix.split(","):
+            endpoint, weight = part.split("=")
+            if endpoint not in ENDPOINTS:
+                raise Exception(f"Unknown endpoint {endpoint} in mix.")
+            self.mix.append((endpoint, float(weight)))
+
+    async def request(self, endpoint: str, method: str, path: str, token=None, **kwargs):
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        time1 = time.perf_counter()
+        try:
+            async with self.session.request(
+                method, self.url + path, headers=headers, **kwargs
+            ) as response:
+                body = await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            body, status = b"", 0
+        latency = (time.perf_counter() - time1) * 1000
+        if endpoint is not None:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            statuses = self.statuses.setdefault(endpoint, {})
+            statuses[status] = statuses.get(status, 0) + 1
+            if status != 200:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return status, json.loads(body) if body else None
+
+    async def setup(self):
+        """
+        Registers users in a ring where each follows the next, so saved runs reach a feed
+        """
+        for number in range(self.args.users):
+            email = f"loadtest{number}@racepace.test"
+            credentials = {
+                "email": email,
+                "password": PASSWORD,
+                "full_name": f"Load Test {number}",
+                "username": f"loadtest{number}",
+            }
+            status, data = await self.request(None, "POST", "/api/register", json=credentials)
+            if status != 200:
+                status, data = await self.request(
+                    None, "POST", "/api/login", json={"email": email, "password": PASSWORD}
+                )
+            if status != 200:
+                raise Exception(f"Could not register load test user {email}: {data}")
+            self.users.append((email, data["token"], data["user_id"]))
+        for number, (email, token, user_id) in enumerate(self.users):
+            other_email, other_token, other_id = self.users[(number + 1) % len(self.users)]
+            if other_id == user_id:
+                continue
+            await self.request(
+                None, "POST", "/api/sendFollowRequest", token, json={"other_user_id": other_id}
+            )
+            await self.request(
+                None,
+                "POST",
+                "/api/acceptFollowRequest",
+                other_token,
+                json={"other_user_id": user_id},
+            )
+        for email, token, user_id in self.users:
+            await self.request(None, "POST", "/api/save_run", token, json=self.run_payload())
+
+    def run_payload(self) -> dict:
+        """
+        A run of args.packets location packets walking between random points of the extract
+        """
+        start = [float(value) for value in self.rng.choice(self.points).split(",")]
+        end = [float(value) for value in self.rng.choice(self.points).split(",")]
+        packets = []
+        for number in range(self.args.packets):
+            fraction = number / max(self.args.packets - 1, 1)
+            packets.append(
+                {
+                    "location": {
+                        "latitude": start[0] + (end[0] - start[0]) * fraction,
+                        "longitude": start[1] + (end[1] - start[1]) * fraction,
+                    },
+                    "timestamp": 1000 * number,
+                    "speed": 3.0,
+                }
+            )
+        seconds = self.args.packets
+        return {
+            "name": "Load test run",
+            "description": "",
+            "run_info": {
+                "final_duration": {
+                    "hours": seconds // 3600,
+                    "minutes": seconds // 60 % 60,
+                    "seconds": seconds % 60,
+                },
+                "final_distance": 3.0 * seconds,
+            },
+            "location_packets": packets,
+        }
+
+    async def route(self):
+        start, end = self.rng.choice(self.routes)
+        await self.request("route", "GET", "/api/route", params={"start": start, "end": end})
+
+    async def login(self):
+        email, token, user_id = self.rng.choice(self.users)
+        await self.request(
+            "login", "POST", "/api/login", json={"email": email, "password": PASSWORD}
+        )
+
+    async def save_run(self):
+        email, token, user_id = self.rng.choice(self.users)
+        await self.request("save_run", "POST", "/api/save_run", token, json=self.run_payload())
+
+    async def get_feed(self):
+        email, token, user_id = self.rng.choice(self.users)
+        await self.request("get_feed", "POST", "/api/get_feed", token, json={})
+
+    async def client(self, deadline: float, remaining: list):
+        endpoints = [endpoint for endpoint, weight in self.mix]
+        weights = [weight for endpoint, weight in self.mix]
+        while time.monotonic() < deadline:
+            if self.args.requests:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            endpoint = self.rng.choices(endpoints, weights)[0]
+            await getattr(self, endpoint)()  # Methods are named after their endpoint
+
+    async def run(self) -> dict:
+        await self.setup()
+        time1 = time.perf_counter()
+        deadline = time.monotonic() + self.args.duration
+        remaining = [self.args.requests]
+        await asyncio.gather(
+            *[self.client(deadline, remaining) for _ in range(self.args.concurrency)]
+        )
+        elapsed = time.perf_counter() - time1
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        labels = [f"<={bucket}ms" for bucket in HISTOGRAM_BUCKETS]
+        labels.append(f">{HISTOGRAM_BUCKETS[-1]}ms")
+        for endpoint, latencies in sorted(self.latencies.items()):
+            counts, _ = np.histogram(latencies, [0] + HISTOGRAM_BUCKETS + [np.inf])
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(endpoint, 0),
+                "statuses": dict((str(status), count) for status, count in statuses.items()),
+                "requests_per_second": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                "max_ms": round(float(max(latencies)), 3),
+                "histogram": dict(
+                    (label, int(count)) for label, count in zip(labels, counts)
+                ),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "meta": {
+                "seed": self.args.seed,
+                "dataset": self.args.dataset,
+                "concurrency": self.args.concurrency,
+                "users": self.args.users,
+                "mix": self.args.mix,
+                "elapsed_s": round(elapsed, 3),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "requests": total,
+            "requests_per_second": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+async def main(args) -> dict:
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        tiles = tempfile.mkdtemp(prefix="racepace-tiles-")
+        server = start_server(port, args.dataset, tiles)
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_for_server(session, url, args.startup_timeout)
+            return await LoadTest(session, url, args).run()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the server over http")
+    parser.add_argument("--url", help="Test a running server instead of starting one")
+    parser.add_argument("--dataset", default="mockdata", choices=sorted(DATASETS))
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight,...")
+    parser.add_argument("--route-pairs", type=int, default=50, help="Distinct routes requested")
+    parser.add_argument("--packets", type=int, default=300, help="Location packets per saved run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=30)
+    parser.add_argument("--output", help="Write the json report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.get_event_loop().run_until_complete(main(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
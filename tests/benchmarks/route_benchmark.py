@@ -0,0 +1,291 @@
+"""
+Route computation benchmark over the bundled OSM extracts
+Runs a fixed, seeded set of point to point and multi waypoint queries through every route
+generator and reports latency percentiles, node expansions and peak memory as json, so two
+runs can be compared for regressions.
+
+    PYTHONPATH=../.. python route_benchmark.py --output baseline.json
+    PYTHONPATH=../.. python route_benchmark.py --compare baseline.json
+"""
+from server import Route, RoadGraph
+from server.core.contraction import ContractionHierarchy
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+TESTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS = {
+    "mockdata": os.path.join(TESTS, "mockdata"),
+    "data_generation": os.path.join(TESTS, "data_generation_testing"),
+}
+
+
+def load_dataset(directory: str) -> tuple:
+    with open(os.path.join(directory, "nodes.json")) as f:
+        nodes_json = json.load(f)["elements"]
+    with open(os.path.join(directory, "ways.json")) as f:
+        ways_json = json.load(f)["elements"]
+    return nodes_json, ways_json
+
+
+def largest_component(graph: RoadGraph) -> list:
+    """
+    Indices of the largest connected piece of the graph, queries inside it always succeed
+    """
+    seen = set()
+    largest = []
+    for index in range(len(graph)):
+        if index in seen or not graph.on_way(index):
+            continue
+        component = graph.component(index)
+        seen.update(component)
+        if len(component) > len(largest):
+            largest = component
+    return sorted(largest)
+
+
+def make_queries(graph: RoadGraph, seed: int, count: int, waypoints: int) -> tuple:
+    """
+    Seeded point to point pairs and waypoint lists of node ids
+    """
+    component = largest_component(graph)
+    rng = random.Random(seed)
+    ids = lambda indices: [int(graph.ids[index]) for index in indices]
+    pairs = [ids(rng.sample(component, 2)) for _ in range(count)]
+    multis = [ids(rng.sample(component, waypoints)) for _ in range(count)]
+    return pairs, multis
+
+
+def percentile(values: list, q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def measure(name: str, kind: str, run, queries: list, memory_queries: int) -> dict:
+    """
+    Times every query, then reruns the first few under tracemalloc for peak memory
+    Timing and memory passes are separate as tracemalloc slows allocation heavy code
+    """
+    latencies = []
+    expansions = []
+    distances = []
+    for query in queries:
+        stats = {}
+        time1 = time.perf_counter()
+        route = run(query, stats)
+        latencies.append((time.perf_counter() - time1) * 1000)
+        expansions.append(stats.get("expansions", 0))
+        distances.append(route.distance)
+
+    peak = 0
+    for query in queries[:memory_queries]:
+        tracemalloc.start()
+        run(query, {})
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "method": name,
+        "kind": kind,
+        "queries": len(queries),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "mean_ms": round(float(np.mean(latencies)), 3),
+        "expansions_p50": percentile(expansions, 50),
+        "expansions_p95": percentile(expansions, 95),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "distance_total_m": round(float(sum(distances)), 1),
+    }
+
+
+def benchmark_dataset(name: str, directory: str, args) -> dict:
+    setup = {}
+    time1 = time.perf_counter()
+    nodes_json, ways_json = load_dataset(directory)
+    setup["load_ms"] = (time.perf_counter() - time1) * 1000
+
+    time1 = time.perf_counter()
+    nodes, ways = Route.transform_json_nodes_and_ways(nodes_json, ways_json)
+    neighbours = Route.find_neighbours(ways)
+    setup["transform_ms"] = (time.perf_counter() - time1) * 1000
+
+    time1 = time.perf_counter()
+    graph = RoadGraph.from_json(nodes_json, ways_json)
+    setup["graph_ms"] = (time.perf_counter() - time1) * 1000
+
+    pairs, multis = make_queries(graph, args.seed, args.queries, args.waypoints)
+
+    methods = [
+        (
+            "generate_route",
+            "point",
+            lambda q, s: Route.generate_route(nodes, ways, q[0], q[1], stats=s),
+            pairs,
+        ),
+        (
+            "generate_route_shared_neighbours",
+            "point",
+            lambda q, s: Route.generate_route(nodes, ways, q[0], q[1], neighbours, s),
+            pairs,
+        ),
+        (
+            "graph_astar",
+            "point",
+            lambda q, s: Route.generate_graph_route(graph, q[0], q[1], "astar", s),
+            pairs,
+        ),
+        (
+            "graph_bidirectional",
+            "point",
+            lambda q, s: Route.generate_graph_route(graph, q[0], q[1], "bidirectional", s),
+            pairs,
+        ),
+        (
+            "graph_astar_simplified",
+            "point",
+            lambda q, s: Route.generate_graph_route(
+                graph, q[0], q[1], "astar", s, simplify=True
+            ),
+            pairs,
+        ),
+        (
+            "generate_multi_route",
+            "multi",
+            lambda q, s: Route.generate_multi_route(nodes, ways, q, s),
+            multis,
+        ),
+        (
+            "graph_multi_route",
+            "multi",
+            lambda q, s: Route.generate_graph_multi_route(graph, q, "astar", stats=s),
+            multis,
+        ),
+    ]
+    if args.hierarchy:
+        time1 = time.perf_counter()
+        hierarchy_graph = RoadGraph.from_json(nodes_json, ways_json)
+        ContractionHierarchy.build(hierarchy_graph)
+        setup["hierarchy_ms"] = (time.perf_counter() - time1) * 1000
+        methods += [
+            (
+                "graph_hierarchy",
+                "point",
+                lambda q, s: Route.generate_graph_route(
+                    hierarchy_graph, q[0], q[1], "hierarchy", s
+                ),
+                pairs,
+            ),
+            (
+                "graph_hierarchy_multi_route",
+                "multi",
+                lambda q, s: Route.generate_graph_multi_route(
+                    hierarchy_graph, q, "hierarchy", stats=s
+                ),
+                multis,
+            ),
+        ]
+
+    results = []
+    for method, kind, run, queries in methods:
+        if args.methods and method not in args.methods:
+            continue
+        result = measure(method, kind, run, queries, args.memory_queries)
+        result["dataset"] = name
+        results.append(result)
+        print(
+            f"{name:>16} {method:<34} p50 {result['p50_ms']:9.2f}ms "
+            f"p95 {result['p95_ms']:9.2f}ms peak {result['peak_memory_kb']:9.1f}KB",
+            file=sys.stderr,
+        )
+    return {
+        "nodes": len(nodes_json),
+        "graph_nodes": len(graph),
+        "component_nodes": len(largest_component(graph)),
+        "setup_ms": dict((key, round(value, 3)) for key, value in setup.items()),
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Latency ratios against a baseline report, returns the rows slower than the tolerance
+    """
+    previous = dict(
+        ((name, result["method"]), result)
+        for name, dataset in baseline["datasets"].items()
+        for result in dataset["results"]
+    )
+    regressions = []
+    for name, dataset in report["datasets"].items():
+        for result in dataset["results"]:
+            old = previous.get((name, result["method"]))
+            if old is None or old["p50_ms"] == 0:
+                continue
+            ratio = result["p50_ms"] / old["p50_ms"]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = " REGRESSION"
+                regressions.append((name, result["method"], ratio))
+            print(
+                f"{name:>16} {result['method']:<34} p50 x{ratio:5.2f}{flag}", file=sys.stderr
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark route generation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=50, help="Queries of each kind")
+    parser.add_argument("--waypoints", type=int, default=5, help="Points per multi query")
+    parser.add_argument(
+        "--memory-queries", type=int, default=5, help="Queries rerun under tracemalloc"
+    )
+    parser.add_argument("--datasets", nargs="*", choices=sorted(DATASETS))
+    parser.add_argument("--methods", nargs="*", help="Only run these methods")
+    parser.add_argument(
+        "--hierarchy", action="store_true", help="Also build and query contraction hierarchies"
+    )
+    parser.add_argument("--output", help="Write the json report here instead of stdout")
+    parser.add_argument("--compare", help="Baseline json report to compare latencies with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed p50 slowdown against the baseline"
+    )
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "seed": args.seed,
+            "queries": args.queries,
+            "waypoints": args.waypoints,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "datasets": {},
+    }
+    for name in args.datasets or sorted(DATASETS):
+        report["datasets"][name] = benchmark_dataset(name, DATASETS[name], args)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
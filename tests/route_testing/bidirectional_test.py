@@ -0,0 +1,34 @@
+from server import Route, RoadGraph
+import json
+import random
+import time
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+graph = RoadGraph.from_json(nodedata, waydata)
+way_node_ids = [int(graph.ids[index]) for index in range(len(graph)) if graph.on_way(index)]
+
+random.seed(0)
+pairs = [random.sample(way_node_ids, 2) for i in range(200)]
+for search in ("astar", "bidirectional"):
+    expansions, seconds, distances = 0, 0, []
+    for start_id, end_id in pairs:
+        stats = {}
+        time1 = time.perf_counter()
+        try:
+            route = Route.generate_graph_route(graph, start_id, end_id, search, stats)
+            distances.append(round(route.distance, 3))
+        except Exception as e:
+            if "cannot be reached" not in str(e):
+                raise
+            distances.append(None)  # Mock extract has disconnected pieces
+        seconds += time.perf_counter() - time1
+        expansions += stats.get("expansions", 0)
+    print(f"{search}: {expansions} expansions, {seconds * 1000:.1f} ms")
+    if search == "astar":
+        astar_distances = distances
+    else:
+        assert distances == astar_distances
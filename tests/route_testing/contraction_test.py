@@ -0,0 +1,49 @@
+from server import Route, RoadGraph, Point
+from server.core.contraction import ContractionHierarchy
+from server.core.route_profile import RouteProfile
+import json
+import random
+import time
+
+for folder in ("../mockdata", "../data_generation_testing"):
+    with open(f"{folder}/ways.json") as f:
+        waydata = json.load(f)["elements"]
+    with open(f"{folder}/nodes.json") as f:
+        nodedata = json.load(f)["elements"]
+
+    graph = RoadGraph.from_json(nodedata, waydata)
+    time1 = time.perf_counter()
+    hierarchy = ContractionHierarchy.build(graph)
+    print(f"{folder}: built in {time.perf_counter() - time1:.2f}s")
+    way_nodes = [index for index in range(len(graph)) if graph.on_way(index)]
+
+    # Pairs within the largest of a few components, the extracts have disconnected pieces
+    random.seed(0)
+    component = max((graph.component(index) for index in random.sample(way_nodes, 20)), key=len)
+    component_ids = [int(graph.ids[index]) for index in component]
+    pairs = [random.sample(component_ids, 2) for i in range(200)]
+    results = {}
+    for search in ("astar", "hierarchy"):
+        distances = []
+        time1 = time.perf_counter()
+        for start_id, end_id in pairs:
+            try:
+                route = Route.generate_graph_route(graph, start_id, end_id, search)
+                distances.append(round(route.distance, 2))
+            except Exception as e:
+                if "cannot be reached" not in str(e):
+                    raise
+                distances.append(None)  # One way streets can still cut a pair off
+        results[search] = distances
+        print(f"{search}: {(time.perf_counter() - time1) * 1000:.1f} ms")
+    assert results["astar"] == results["hierarchy"]
+    routed = len([distance for distance in results["astar"] if distance is not None])
+    print(f"{routed} of {len(pairs)} pairs routed")
+    assert routed > len(pairs) // 2
+
+    # Hierarchy searches are only answered inside the region, for profiles that cost lengths
+    inside = [graph.node(component[0]), graph.node(component[-1])]
+    outside = [Point(0, 0), Point(0, 1)]
+    assert hierarchy.answers(inside, RouteProfile.load("default"))
+    assert not hierarchy.answers(outside, RouteProfile.load("default"))
+    assert not hierarchy.answers(inside, RouteProfile.load("running"))
@@ -0,0 +1,38 @@
+from server import Route, RoadGraph
+import json
+import random
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+graph = RoadGraph.from_json(nodedata, waydata)
+nodes, ways = Route.transform_json_nodes_and_ways(nodedata, waydata)
+way_nodes = [index for index in range(len(graph)) if graph.on_way(index)]
+
+random.seed(0)
+expansions = {"dijkstra": 0, "astar": 0}
+routes, longer = 0, 0
+for i in range(200):
+    start, end = random.sample(way_nodes, 2)
+    lengths = {}
+    for search in ("dijkstra", "astar"):
+        stats = {}
+        try:
+            path, lengths[search] = getattr(graph, search)(start, end, stats)
+        except Exception:
+            break  # Mock extract has disconnected pieces
+        expansions[search] += stats["expansions"]
+    else:
+        routes += 1
+        # A* must find routes exactly as short as Dijkstra
+        assert abs(lengths["astar"] - lengths["dijkstra"]) < 0.01, lengths
+        # Object based search measures on the plane at its start, so allow a little slack
+        start_id, end_id = int(graph.ids[start]), int(graph.ids[end])
+        route = Route.generate_route(nodes, ways, start_id, end_id)
+        longer += route.distance > lengths["dijkstra"] * 1.01
+
+print(f"{routes} routes, A* and Dijkstra lengths match")
+print(f"Expansions: dijkstra {expansions['dijkstra']}, astar {expansions['astar']}")
+print(f"Route.generate_route more than 1% longer than Dijkstra: {longer}")
@@ -0,0 +1,38 @@
+from server import Route, Point
+from server.core.geodesy import coordinates, distances_from, segment_distances
+import json
+import random
+import time
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+nodes, ways = Route.transform_json_nodes_and_ways(nodedata, waydata)
+track = list(nodes.values())
+latitudes, longitudes = coordinates(track)
+
+# Batch kernels must agree with the scalar Point distance
+segments = segment_distances(latitudes, longitudes)
+for index in random.sample(range(len(segments)), 200):
+    assert abs(segments[index] - (track[index] - track[index + 1])) < 1e-6
+
+time1 = time.time()
+scalar = sum(track[index] - track[index + 1] for index in range(len(track) - 1))
+time2 = time.time()
+vectorised = Route.get_route_distance(track)
+time3 = time.time()
+assert abs(scalar - vectorised) < 1e-3 * len(track)
+print(f"Track of {len(track)} points: {vectorised:.0f}m")
+print(f"Scalar {(time2 - time1) * 1000:.1f}ms, vectorised {(time3 - time2) * 1000:.1f}ms")
+
+point = Point(-33.8796, 151.2102)
+time1 = time.time()
+closest = min(track, key=lambda other: point - other)
+time2 = time.time()
+distances = distances_from(point.latitude, point.longitude, latitudes, longitudes)
+time3 = time.time()
+assert track[int(distances.argmin())] is closest
+assert point.closest_node(nodes) is closest
+print(f"Closest node scalar {(time2 - time1) * 1000:.1f}ms, vectorised {(time3 - time2) * 1000:.1f}ms")
@@ -0,0 +1,16 @@
+from server import Route, RoadGraph
+import json
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+graph = RoadGraph.from_json(nodedata, waydata)
+print(f"{len(graph)} nodes, {len(graph.targets)} edges, {graph.nbytes / len(graph):.1f} bytes per node")
+
+start_id = 8109379
+end_id = 8109400
+
+route = Route.generate_graph_route(graph, start_id, end_id)
+print(route.route, route.distance)
@@ -0,0 +1,49 @@
+from server import Route, RoadGraph, Point
+import json
+import time
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+graph = RoadGraph.from_json(nodedata, waydata)
+start = Point(-33.8776308, 151.2006453)
+start_id = int(graph.ids[graph.closest_index(start)])
+
+for distance in (1000, 2000, 3000, 5000):
+    stats = {}
+    time1 = time.time()
+    route = Route.generate_graph_loop(graph, start_id, distance, stats)
+    time2 = time.time()
+    assert route.route[0].id == route.route[-1].id == start_id
+    print(
+        f"Target {distance}m: {route.distance:.0f}m, {stats['candidates']} candidates, "
+        f"{stats['expansions']} expansions, score {stats['score']:.2f}, "
+        f"{(time2 - time1) * 1000:.0f}ms"
+    )
+
+# The expansion cap ends the search with the best loop so far, other errors are not hidden
+from server.core.loop_generation import LoopGenerator
+from server.core.road_graph import SearchSpace
+
+index = graph.index_of(start_id)
+stats = {}
+path, length = LoopGenerator(graph, max_expansions=3000).generate(index, 3000, stats)
+assert path[0] == path[-1] == index and stats["expansions"] <= 3000 + len(graph)
+
+
+def broken_astar(self, *args):
+    raise TypeError("Broken search")
+
+
+astar = SearchSpace.astar
+SearchSpace.astar = broken_astar
+try:
+    LoopGenerator(graph).generate(index, 3000)
+    raise AssertionError("Search error was hidden")
+except TypeError:
+    pass
+finally:
+    SearchSpace.astar = astar
+print("Only the expansion cap stops loop candidates")
@@ -0,0 +1,52 @@
+from server import Route, RoadGraph, Point
+from server.core.metrics import metrics, Histogram
+from server.core.decorators import timed
+import asyncio
+import json
+import time
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+# Quantiles are estimated inside buckets and never pass the largest duration seen
+histogram = Histogram()
+for milliseconds in range(1, 101):
+    histogram.observe(milliseconds / 1000)
+assert 0.025 <= histogram.quantile(0.5) <= 0.05, histogram.quantile(0.5)
+assert histogram.quantile(0.99) <= 0.1
+assert histogram.count == 100
+
+
+@timed
+def sleep_sync():
+    time.sleep(0.002)
+
+
+@timed(name="test.async")
+async def sleep_async():
+    await asyncio.sleep(0.002)
+
+
+metrics.clear()
+sleep_sync()
+asyncio.get_event_loop().run_until_complete(sleep_async())
+spans = metrics.to_dict()
+assert spans["test.async"]["count"] == 1 and spans["test.async"]["max_ms"] >= 2
+assert any(name.endswith("sleep_sync") for name in spans), spans.keys()
+
+# Route generation records its simplify and search spans
+graph = RoadGraph.from_json(nodedata, waydata)
+waypoint_ids = [
+    int(graph.ids[graph.closest_index(point)])
+    for point in [Point(-33.8776308, 151.2006453), Point(-33.8819886, 151.2054857)]
+]
+metrics.clear()
+Route.generate_graph_route(graph, *waypoint_ids, "astar", simplify=True)
+spans = metrics.to_dict()
+assert spans["route.simplify"]["count"] == 1
+assert spans["route.search.astar"]["count"] == 1
+print(json.dumps(spans["route.search.astar"], indent=2))
+print(metrics.prometheus({"route_cache_entries": 0}).splitlines()[2])
+print("Spans recorded")
@@ -0,0 +1,51 @@
+from server import Route, RoadGraph
+import json
+import random
+import time
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+graph = RoadGraph.from_json(nodedata, waydata)
+way_nodes = [index for index in range(len(graph)) if graph.on_way(index)]
+space = graph.search_space()
+
+# Scratch array A* must match RoadGraph.astar leg after leg
+random.seed(0)
+legs = 0
+for i in range(200):
+    start, end = random.sample(way_nodes, 2)
+    try:
+        path, length = graph.astar(start, end)
+    except Exception:
+        continue  # Mock extract has disconnected pieces
+    space_path, space_length = space.astar(start, end)
+    assert abs(space_length - length) < 0.01, (length, space_length)
+    assert space_path[0] == start and space_path[-1] == end
+    legs += 1
+print(f"{legs} legs matched RoadGraph.astar")
+
+# A 30 waypoint route inside the component of a connected start
+costs = {}
+start = way_nodes[0]
+component = [start]
+for index in component:
+    for neighbour, length in graph.neighbours(index):
+        if neighbour not in costs:
+            costs[neighbour] = length
+            component.append(neighbour)
+waypoint_ids = [int(graph.ids[index]) for index in random.sample(component, 30)]
+
+time1 = time.time()
+route = Route.generate_graph_multi_route(graph, waypoint_ids, "astar")
+time2 = time.time()
+multi_distance = sum(
+    Route.generate_graph_route(graph, first, second, "astar").distance
+    for first, second in zip(waypoint_ids[:-1], waypoint_ids[1:])
+)
+time3 = time.time()
+assert abs(route.distance - multi_distance) < 0.1
+print(f"30 waypoints, {route.distance:.0f}m")
+print(f"Shared search space {(time2 - time1) * 1000:.0f}ms, per leg {(time3 - time2) * 1000:.0f}ms")
@@ -0,0 +1,70 @@
+from server import Route, RoadGraph, Point
+from server.core.overpass_stream import ElementParser, compact_element
+from server.core.road_graph import RoadGraphBuilder
+from server.core.tile_store import TileStore
+from server.core.misc import LocalOverpass
+import asyncio
+import json
+import os
+import tempfile
+import tracemalloc
+
+with open("../mockdata/nodes.json", "rb") as f:
+    body = f.read()
+
+# Elements must come out whole however the response is split
+expected = [compact_element(element) for element in json.loads(body)["elements"]]
+for chunk_size in (1, 7, 4096, len(body)):
+    parser = ElementParser()
+    elements = []
+    for start in range(0, len(body), chunk_size):
+        elements += parser.feed(body[start : start + chunk_size])
+    parser.close()
+    assert elements == expected, chunk_size
+print(f"{len(expected)} elements parsed at every chunk size")
+
+# Peak memory of decoding the whole response against streaming it into the builder
+tracemalloc.start()
+graph = RoadGraph.from_elements(json.loads(body)["elements"])
+whole_peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+tracemalloc.start()
+parser, builder = ElementParser(), RoadGraphBuilder()
+for start in range(0, len(body), 64 * 1024):
+    builder.add_elements(parser.feed(body[start : start + 64 * 1024]))
+streamed = builder.build()
+stream_peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+assert len(streamed) == len(graph)
+print(f"Graph {graph.nbytes / 1024:.0f}KB")
+print(f"Peak whole response {whole_peak / 1024:.0f}KB, streamed {stream_peak / 1024:.0f}KB")
+
+# Tiles filled through the stream route the same as from decoded json
+overpass = LocalOverpass.from_files("../mockdata/nodes.json", "../mockdata/ways.json")
+store = TileStore(tempfile.mkdtemp(), stream=overpass.stream)
+start = Point(-33.8776308, 151.2006453)
+end = Point(-33.8819886, 151.2054857)
+
+
+async def main():
+    graph = await store.load_region_graph(Route.two_point_bounding_box(start, end))
+    start_id = int(graph.ids[graph.closest_index(start)])
+    end_id = int(graph.ids[graph.closest_index(end)])
+    route = Route.generate_graph_route(graph, start_id, end_id)
+    print(f"{len(graph)} nodes from {overpass.requests} streamed request(s), route {route.distance:.0f}m")
+
+    # Ways that arrive before their nodes are placed in the same tiles
+    with open("../mockdata/ways.json") as f:
+        elements = json.load(f)["elements"] + json.loads(body)["elements"]
+    forwards, backwards = TileStore(tempfile.mkdtemp()), TileStore(tempfile.mkdtemp())
+    forwards.ingest(elements[::-1])
+    backwards.ingest(elements)
+    tiles = [name for name in os.listdir(forwards.directory)]
+    assert tiles and sorted(tiles) == sorted(os.listdir(backwards.directory))
+    for name in tiles:
+        tile = tuple(map(int, name[: -len(".json")].split("_")))
+        key = lambda element: (element["type"], element["id"])
+        assert sorted(forwards.read(tile), key=key) == sorted(backwards.read(tile), key=key)
+
+
+asyncio.run(main())
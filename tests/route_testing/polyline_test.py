@@ -0,0 +1,47 @@
+from server import Route, RoadGraph, Point
+from server.core import polyline
+from server.core.route import SavedRoute
+import json
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+# Reference polyline from the format description
+coordinates = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+assert polyline.encode(coordinates) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+assert polyline.decode("_p~iF~ps|U_ulLnnqC_mqNvxq`@") == coordinates
+
+graph = RoadGraph.from_json(nodedata, waydata)
+start, end = [
+    int(graph.ids[graph.closest_index(point)])
+    for point in [Point(-33.8776308, 151.2006453), Point(-33.8819886, 151.2054857)]
+]
+route = Route.generate_graph_route(graph, start, end)
+
+# Decoded points stay within the precision of the encoding
+for precision in (polyline.PRECISION, polyline.STORAGE_PRECISION):
+    decoded = polyline.decode(route.to_polyline(precision), precision)
+    assert len(decoded) == len(route.route)
+    for (latitude, longitude), node in zip(decoded, route.route):
+        assert abs(latitude - node.latitude) <= 0.5 / 10 ** precision + 1e-12
+        assert abs(longitude - node.longitude) <= 0.5 / 10 ** precision + 1e-12
+
+points_size = len(json.dumps(route.json))
+polyline_size = len(json.dumps(route.to_json("polyline")))
+print(f"{len(route.route)} points: {points_size} bytes as points, {polyline_size} as polyline")
+assert polyline_size * 5 < points_size
+
+# Saved routes store the polyline and decode only when their points are used
+saved = SavedRoute.from_real_time_data(route, "Test", "", "A", "B")
+stored = json.loads(json.dumps(saved.to_dict()))
+legacy = json.loads(json.dumps(saved.to_dict("points")))
+print(f"Stored saved route {len(json.dumps(stored))} bytes, was {len(json.dumps(legacy))}")
+loaded = SavedRoute.from_data(json.loads(json.dumps(stored)))  # from_data consumes its dict
+assert loaded.route._route is None
+assert loaded.to_dict()["route"] == stored["route"]  # Stored again without decoding
+assert loaded.route._route is None
+assert len(loaded.route.route) == len(route.route)
+assert SavedRoute.from_data(legacy).to_dict()["route"] == stored["route"]
+print("Polyline routes match")
@@ -0,0 +1,64 @@
+from server import Route, RoadGraph
+from server.core.route_profile import RouteProfile, HIGHWAY_TYPES
+import json
+import random
+import time
+
+with open("../mockdata/ways.json") as f:
+    waydata = json.load(f)["elements"]
+with open("../mockdata/nodes.json") as f:
+    nodedata = json.load(f)["elements"]
+
+graph = RoadGraph.from_json(nodedata, waydata)
+running = RouteProfile.load("running")
+runner_graph = graph.with_profile(running)
+way_nodes = [index for index in range(len(graph)) if graph.on_way(index)]
+preferred = set(HIGHWAY_TYPES.index(highway) for highway in ("footway", "path", "pedestrian"))
+
+
+def preferred_share(path):
+    positions = [graph.edge_position(first, second) for first, second in zip(path[:-1], path[1:])]
+    metres = sum(float(graph.lengths[position]) for position in positions)
+    on_preferred = sum(
+        float(graph.lengths[position])
+        for position in positions
+        if graph.highways[position] in preferred
+    )
+    return on_preferred / metres if metres else 0
+
+
+random.seed(0)
+routes, shares = 0, {"default": 0, "running": 0}
+for i in range(200):
+    start, end = random.sample(way_nodes, 2)
+    try:
+        default_path, default_distance = graph.astar(start, end)
+    except Exception:
+        continue  # Mock extract has disconnected pieces
+    # Profile weights never undercut lengths, so A* stays exact against Dijkstra
+    path, weight = runner_graph.astar(start, end)
+    dijkstra_path, dijkstra_weight = runner_graph.dijkstra(start, end)
+    assert abs(weight - dijkstra_weight) < 0.05
+    route = Route.generate_graph_route(
+        graph, int(graph.ids[start]), int(graph.ids[end]), "astar", profile=running
+    )
+    simplified = Route.generate_graph_route(
+        graph, int(graph.ids[start]), int(graph.ids[end]), "astar", simplify=True, profile=running
+    )
+    assert abs(route.distance - graph.path_length(path)) < 0.05
+    assert abs(route.distance - simplified.distance) < 0.05
+    assert route.distance >= default_distance - 0.05
+    shares["default"] += preferred_share(default_path)
+    shares["running"] += preferred_share(path)
+    routes += 1
+print(f"{routes} routes, A* matched Dijkstra on profile weights")
+print(
+    f"Share on footways and paths: default {shares['default'] / routes:.0%}, "
+    f"running {shares['running'] / routes:.0%}"
+)
+
+# Dict based routing takes multipliers from way highways without copying tags into nodes
+time1 = time.time()
+nodes, ways = Route.transform_json_nodes_and_ways(nodedata, waydata, running)
+time2 = time.time()
+print(f"transform_json_nodes_and_ways with a profile: {(time2 - time1) * 1000:.0f}ms")
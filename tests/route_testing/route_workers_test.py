@@ -0,0 +1,41 @@
+from server import Route, Point
+from server.core import route_workers
+from server.core.route_workers import RouteWorkerPool
+from server.core.tile_store import TileStore, parse_region
+from server.core.misc import LocalOverpass
+import asyncio
+import tempfile
+
+overpass = LocalOverpass.from_files("../mockdata/nodes.json", "../mockdata/ways.json")
+start = Point(-33.8776308, 151.2006453)
+end = Point(-33.8819886, 151.2054857)
+bounding_box = Route.two_point_bounding_box(start, end)
+region = "-33.90,151.19,-33.87,151.22"
+
+
+async def main():
+    # Workers started on an empty tile store route tiles ingested after they started
+    directory = tempfile.mkdtemp()
+    store = TileStore(directory, overpass.fetch)
+    pool = RouteWorkerPool(directory, 1, region=region)
+    await store.ensure_region(bounding_box)
+    route = await pool.route(start, end)
+    pool.shutdown()
+    print(f"Worker route of {len(route.route)} nodes, {route.distance:.0f}m")
+    assert len(route.route) > 2 and route.distance > 500
+
+    # The resident graph is only built once the whole region is on disk
+    directory = tempfile.mkdtemp()
+    store = TileStore(directory, overpass.fetch)
+    route_workers.init_worker(directory, region)
+    assert route_workers.worker_region_graph is None
+    await store.ensure_region(bounding_box)
+    coordinates, distance = route_workers.worker_route(tuple(start), tuple(end), "auto", "default")
+    assert route_workers.worker_region_graph is None and abs(distance - route.distance) < 1
+    await store.ensure_region(parse_region(region))
+    coordinates, distance = route_workers.worker_route(tuple(start), tuple(end), "auto", "default")
+    assert route_workers.worker_region_graph is not None and abs(distance - route.distance) < 1
+    print("Workers pick up ingested tiles")
+
+
+asyncio.run(main())
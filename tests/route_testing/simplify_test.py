@@ -0,0 +1,37 @@
+from server import Route, RoadGraph, Point
+import json
+import random
+
+for directory in ("../mockdata", "../data_generation_testing"):
+    with open(f"{directory}/ways.json") as f:
+        waydata = json.load(f)["elements"]
+    with open(f"{directory}/nodes.json") as f:
+        nodedata = json.load(f)["elements"]
+
+    graph = RoadGraph.from_json(nodedata, waydata)
+    way_nodes = [index for index in range(len(graph)) if graph.on_way(index)]
+    random.seed(0)
+    expansions = {"full": 0, "simplified": 0}
+    routes, nodes = 0, {"full": 0, "simplified": 0}
+    for i in range(200):
+        start, end = random.sample(way_nodes, 2)
+        start_id, end_id = int(graph.ids[start]), int(graph.ids[end])
+        stats, simplified_stats = {}, {}
+        try:
+            route = Route.generate_graph_route(graph, start_id, end_id, "astar", stats)
+        except Exception:
+            continue  # Mock extract has disconnected pieces
+        simplified = Route.generate_graph_route(
+            graph, start_id, end_id, "astar", simplified_stats, simplify=True
+        )
+        # Same route length and the collapsed geometry is put back
+        assert abs(route.distance - simplified.distance) < 0.05
+        assert [node.id for node in route.route] == [node.id for node in simplified.route]
+        nodes["full"] += len(graph)
+        nodes["simplified"] += len(graph.simplify([start, end]))
+        expansions["full"] += stats["expansions"]
+        expansions["simplified"] += simplified_stats["expansions"]
+        routes += 1
+    print(f"{directory}: {routes} routes")
+    print(f"Nodes searched over: full {nodes['full'] // routes}, simplified {nodes['simplified'] // routes}")
+    print(f"Expansions: full {expansions['full']}, simplified {expansions['simplified']}")
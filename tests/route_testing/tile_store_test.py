@@ -0,0 +1,48 @@
+from server import Route, RoadGraph, Point
+from server.core.tile_store import TileStore
+from server.core.misc import LocalOverpass
+import asyncio
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+overpass = LocalOverpass.from_files("../mockdata/nodes.json", "../mockdata/ways.json")
+store = TileStore(tempfile.mkdtemp(), overpass.fetch)
+
+start = Point(-33.8776308, 151.2006453)
+end = Point(-33.8819886, 151.2054857)
+bounding_box = Route.two_point_bounding_box(start, end)
+
+
+async def main():
+    elements = await store.load_region(bounding_box)  # Misses, filled from the stand-in
+    elements = await store.load_region(bounding_box)  # Served from disk
+    print(f"{len(elements)} elements, {overpass.requests} Overpass request(s)")
+    graph = RoadGraph.from_elements(elements)
+    start_id = int(graph.ids[graph.closest_index(start)])
+    end_id = int(graph.ids[graph.closest_index(end)])
+    route = Route.generate_graph_route(graph, start_id, end_id)
+    print(route.route, route.distance)
+
+    # Concurrent requests for the same missing tiles share one Overpass request
+    shared = TileStore(tempfile.mkdtemp(), overpass.fetch)
+    requests = overpass.requests
+    await asyncio.gather(*(shared.ensure_region(bounding_box) for _ in range(5)))
+    assert overpass.requests == requests + 1 and not shared.fetching
+
+    # Concurrent ingests of one tile neither collide on temporary files nor lose elements
+    tile = shared.tile_of(-33.8775, 151.2005)
+    ways = [
+        [{"type": "node", "id": -i, "lat": -33.8775, "lon": 151.2005},
+         {"type": "way", "id": -i, "nodes": [-i], "tags": {"highway": "footway"}}]
+        for i in range(1, 33)
+    ]
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda elements: shared.ingest(elements, [tile]), ways))
+    ids = set(element["id"] for element in shared.read(tile) if element["type"] == "way")
+    assert all(-i in ids for i in range(1, 33))
+    assert not [name for name in os.listdir(shared.directory) if name.endswith(".tmp")]
+    print("Tile fetches are shared")
+
+
+asyncio.run(main())
@@ -0,0 +1,82 @@
+from server.core.route import Run, SavedRun
+from server.core.track import Track
+from server.core.track_filter import simplify, douglas_peucker
+import numpy as np
+import bson
+import math
+import random
+import time
+
+# An hour long run at one packet a second, wandering around Moore Park
+random.seed(1)
+packets = []
+latitude, longitude, speed = -33.8928, 151.2226, 3.2
+for second in range(3600):
+    latitude += random.uniform(-1, 1) * 2e-5
+    longitude += random.uniform(-1, 1) * 2e-5
+    speed = max(0.0, speed + random.uniform(-0.2, 0.2))
+    packets.append(
+        {
+            "location": {"latitude": latitude, "longitude": longitude},
+            "timestamp": second + random.uniform(0, 0.01),
+            "speed": speed,
+        }
+    )
+run = Run.from_real_time_data(packets, {"final_distance": 10000})
+
+# Stored runs decode to the packets they were made from, within the track precision
+stored = bson.decode(bson.encode(run.to_storage_dict()))
+legacy = bson.encode(run.to_dict())
+print(f"Stored run {len(bson.encode(stored))} bytes, was {len(legacy)}")
+assert len(bson.encode(stored)) * 4 < len(legacy)
+loaded = Run.from_data(stored)
+assert loaded._location_packets is None
+assert math.isclose(loaded.get_distance(), run.get_distance(), rel_tol=1e-3)
+assert Run.from_data(Run.from_real_time_data(packets[:1], {}).to_storage_dict()).get_distance() == 0
+time1 = time.perf_counter()
+decoded = loaded.location_packets
+print(f"Decoded {len(decoded)} packets in {(time.perf_counter() - time1) * 1000:.1f}ms")
+for original, packet in zip(packets, loaded.to_dict()["location_packets"]):
+    assert math.isclose(packet["location"]["latitude"], original["location"]["latitude"], abs_tol=6e-7)
+    assert math.isclose(packet["location"]["longitude"], original["location"]["longitude"], abs_tol=6e-7)
+    assert math.isclose(packet["timestamp"], original["timestamp"], abs_tol=6e-4)
+    assert math.isclose(packet["speed"], original["speed"], abs_tol=6e-3)
+
+# Speeds the phone did not send stay missing, and empty runs store nothing
+track = Track.from_packets([(-33.9, 151.2, 0, None), (-33.9, 151.2, 1, 2.5)])
+assert [packet[3] for packet in Track.from_bytes(track.encode())] == [None, 2.5]
+assert len(Track.from_bytes(Run.from_real_time_data([], {}).to_storage_dict()["track"])) == 0
+
+# Saved runs from before tracks still load, and are stored as tracks again
+saved = SavedRun.from_real_time_data("Run", "", {}, packets[:10], [], [])
+legacy = SavedRun.from_data(saved.to_dict())
+assert "track" in legacy.to_storage_dict() and len(legacy.location_packets) == 10
+# Douglas-Peucker drops points of a straight line and keeps corners
+x = np.array([0.0, 10, 20, 30, 30, 30])
+y = np.array([0.0, 0.5, 0, 0, 10, 20])
+assert douglas_peucker(x, y, 1.0).tolist() == [0, 3, 5]
+
+# Stops collapse to where they began and ended, the track keeps within its tolerance
+stop = [
+    {
+        "location": {
+            "latitude": latitude + random.uniform(-1, 1) * 5e-6,
+            "longitude": longitude + random.uniform(-1, 1) * 5e-6,
+        },
+        "timestamp": 3600 + second,
+        "speed": 0.0,
+    }
+    for second in range(300)
+]
+run = Run.from_real_time_data(packets + stop, {})
+time1 = time.perf_counter()
+simplified = simplify(run.to_track(), 2.0, 3.0, 1.0)
+print(
+    f"Simplified {len(run.location_packets)} packets to {len(simplified)} "
+    f"in {(time.perf_counter() - time1) * 1000:.1f}ms"
+)
+assert len(simplified) * 3 < len(run.location_packets)
+timestamps = simplified.decode()[2]
+assert timestamps[0] == packets[0]["timestamp"] and timestamps[-1] == 3899
+assert len([timestamp for timestamp in timestamps if timestamp >= 3600]) <= 3
+print("Tracks match")